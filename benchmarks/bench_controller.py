@@ -0,0 +1,86 @@
+# per-call latency of Controller against TableController
+# run from the repository root: python benchmarks/bench_controller.py
+
+import sys
+import os
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from nlsymb import Trajectory
+from nlsymb.lqr import Controller, TableController
+
+# target for a single TableController call, in seconds
+TARGET = 20e-6
+
+
+def schedule(n=4, m=2, tlims=(0, 2.0), num=400):
+    # a reference and gain schedule shaped like the ones the
+    # optimizer produces, on an irregular (vode-like) time grid
+    rng = np.random.RandomState(0)
+    t = np.sort(np.concatenate((tlims, rng.uniform(tlims[0], tlims[1],
+                                                   num - 2))))
+    ref = Trajectory('x', 'u')
+    gains = Trajectory('K', 'C')
+    for tt in t:
+        ref.addpoint(tt, x=np.sin(tt + np.arange(n)),
+                     u=np.cos(tt + np.arange(m)))
+        gains.addpoint(tt, K=np.outer(np.arange(m) + 1, np.sin(tt)
+                                      * np.ones(n)),
+                       C=tt * np.ones(m))
+    ref.interpolate()
+    gains.interpolate()
+    ref.tlims = tlims
+    return ref, gains
+
+
+def latency(func, calls):
+    start = time.time()
+    for (t, x) in calls:
+        func(t, x)
+    return (time.time() - start) / len(calls)
+
+
+def run(ncalls=20000):
+    ref, gains = schedule()
+    ta, tb = ref.tlims
+    n = len(ref._x[0])
+
+    rng = np.random.RandomState(1)
+    tlist = rng.uniform(ta, tb, ncalls)
+    xlist = rng.randn(ncalls, n)
+    calls = list(zip(tlist, xlist))
+
+    ctrl = Controller(reference=ref, K=gains.K, C=gains.C)
+    table = TableController(reference=ref, K=gains.K, C=gains.C)
+
+    out = {}
+    out['controller'] = latency(ctrl, calls[:ncalls // 10])
+    out['table'] = latency(table, calls)
+
+    start = time.time()
+    table(tlist, xlist)
+    out['table_batched'] = (time.time() - start) / ncalls
+
+    # the table is an interpolation of the same data, so the two
+    # should agree to the accuracy of the grid
+    err = max(np.abs(ctrl(t, x) - table(t, x)).max() for (t, x) in
+              calls[:100])
+    out['max_abs_error'] = err
+    return out
+
+
+if __name__ == "__main__":
+    res = run()
+    for k in ['controller', 'table', 'table_batched']:
+        print("%-16s %8.2f us/call" % (k, 1e6 * res[k]))
+    print("%-16s %8.2e" % ('max abs error', res['max_abs_error']))
+    print("speedup          %8.1fx" % (res['controller'] / res['table']))
+
+    if res['table'] > TARGET:
+        print("FAIL: TableController above %.0f us/call target"
+              % (1e6 * TARGET))
+        sys.exit(1)
+    print("OK: TableController within %.0f us/call target" % (1e6 * TARGET))
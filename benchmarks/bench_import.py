@@ -0,0 +1,63 @@
+# import time of the numeric runtime, which must not pull in sympy,
+# IPython or termcolor (those are loaded once a SymSys is built)
+# run from the repository root: python benchmarks/bench_import.py
+
+import sys
+import os
+import json
+import subprocess
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# modules to time, each in a fresh interpreter
+MODULES = ['nlsymb', 'nlsymb.lqr', 'nlsymb.sys', 'nlsymb.optim',
+           'nlsymb.mpc', 'nlsymb.multistart']
+
+# none of these may be imported by the modules above
+HEAVY = ['sympy', 'IPython', 'termcolor', 'nlsymb.tensor']
+
+# target for importing any one of MODULES, in seconds
+TARGET = 1.0
+
+PROBE = """
+import sys, time, json
+start = time.time()
+import %s
+took = time.time() - start
+print(json.dumps({'seconds': took,
+                  'heavy': [m for m in %r if m in sys.modules]}))
+"""
+
+
+def probe(module):
+    out = subprocess.check_output([sys.executable, '-c',
+                                   PROBE % (module, HEAVY)], cwd=root)
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def run(repeat=3):
+    # best of repeat fresh imports; the first one also warms the disk
+    # cache, which is why it is not simply taken once
+    out = {}
+    for module in MODULES:
+        runs = [probe(module) for i in range(repeat)]
+        out[module] = {'seconds': min(r['seconds'] for r in runs),
+                       'heavy': runs[0]['heavy']}
+    return out
+
+
+if __name__ == "__main__":
+    res = run()
+    fail = False
+    for module in MODULES:
+        r = res[module]
+        print("%-20s %8.3fs %s" % (module, r['seconds'],
+                                   ', '.join(r['heavy'])))
+        if r['heavy'] or r['seconds'] > TARGET:
+            fail = True
+
+    if fail:
+        print("FAIL: heavy imports or above %.1fs target" % TARGET)
+        sys.exit(1)
+    print("OK: numeric runtime imports within %.1fs, no %s"
+          % (TARGET, ', '.join(HEAVY)))
@@ -0,0 +1,315 @@
+# timings of the stages the optimizer is made of: the symbolic build,
+# single f/dfdx/dfdu calls, integration, riccati solves, cost
+# evaluation and one full optimization iteration.
+#
+# run from the repository root:
+#   python benchmarks/bench_suite.py                  # FlatFloor2D
+#   python benchmarks/bench_suite.py --system sin     # SinFloor2D, slow build
+#   python benchmarks/bench_suite.py --save-baseline  # store as the baseline
+#
+# every run is appended to benchmarks/history.json; a benchmark slower
+# than the stored baseline (benchmarks/baseline.json) by more than the
+# tolerance is flagged as a regression and the exit status is 1.
+# baselines are machine specific and not part of the repository, so a
+# machine has to save its own first; without one for the system the
+# exit status is 2, so that a check never passes by comparing nothing.
+
+import sys
+import os
+import time
+import json
+import pickle
+import platform
+import argparse
+import subprocess
+
+import numpy as np
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, '..'))
+
+from nlsymb import Trajectory
+from nlsymb.sys import System, SinFloor2D, FlatFloor2D
+from nlsymb.lqr import CDRE, LQ
+from nlsymb.optim import TrajectoryOptimizer
+
+HISTORY = os.path.join(here, 'history.json')
+BASELINE = os.path.join(here, 'baseline.json')
+SINREF = os.path.join(here, '..', 'pkl', 'sin_forced.p')
+
+# the benchmarks, in the order they run:
+# (name, func(ctx, repeat) -> seconds)
+benchmarks = []
+
+
+def bench(name):
+    def register(func):
+        benchmarks.append((name, func))
+        return func
+    return register
+
+
+def best(func, repeat):
+    # best of repeat runs, the least noisy estimate on a shared box
+    times = []
+    for i in range(repeat):
+        start = time.time()
+        func()
+        times.append(time.time() - start)
+    return min(times)
+
+
+def percall(func, calls):
+    start = time.time()
+    for i in xrange(calls):
+        func()
+    return (time.time() - start) / calls
+
+
+def reference(system, s):
+    # the bundled reference for the sin floor if there is one, a
+    # straight line through the guard otherwise
+    if system == 'sin' and os.path.exists(SINREF):
+        with open(SINREF, 'rb') as f:
+            ref = pickle.load(f)
+        ref.interpolate()
+        ref.tlims = (0, 1.9)
+        return ref
+
+    tlims = (0, 1.0)
+    ref = Trajectory('x', 'u')
+    for t in np.linspace(tlims[0], tlims[1], 21):
+        q = np.array([t, 1.0 - 1.5 * t])
+        x = np.concatenate((s.Psi(q), np.dot(s.dPsi(q), [1.0, -1.5])))
+        ref.addpoint(t, x=x, u=np.array([0.0, 9.8]))
+    ref.interpolate()
+    ref.tlims = tlims
+    return ref
+
+
+def setup(system):
+    ctx = {'system': system}
+
+    start = time.time()
+    s = SinFloor2D(k=3) if system == 'sin' else FlatFloor2D(k=3)
+    ctx['build'] = time.time() - start
+    ctx['s'] = s
+
+    ref = reference(system, s)
+    ta, tb = ref.tlims
+    itj = Trajectory('x', 'u')
+    itj.addpoint(ta, x=ref.x(ta), u=np.array([0.0, 0.0]))
+    itj.addpoint(tb, x=ref.x(tb), u=np.array([0.0, 0.0]))
+    itj.interpolate()
+    itj.tlims = ref.tlims
+
+    ctx.update(ref=ref, itj=itj, tlims=ref.tlims,
+               R=lambda t: np.diag([10, 10]),
+               Q=lambda t: np.diag([10, 10, 1, 1]))
+    ctx['PT'] = ctx['Q'](tb)
+    ctx['x0'] = ref.x(ta)
+    ctx['u0'] = ref.u(ta)
+    return ctx
+
+
+def system(ctx):
+    s, ref = ctx['s'], ctx['ref']
+    nlsys = System(s.f, tlims=ctx['tlims'], xinit=ctx['x0'],
+                   dfdx=s.dfdx, dfdu=s.dfdu)
+    nlsys.phi = s.phi
+    nlsys.delf = s.delf
+    nlsys.ref = ref
+    # track the reference open loop, u = ref.u(t)
+    nlsys.set_u(lambda t, x: ref.u(t))
+    return nlsys
+
+
+def linearization(ctx):
+    if 'lin' not in ctx:
+        ctx['lin'] = system(ctx).integrate(linearize=False)
+        s, lin = ctx['s'], ctx['lin']
+        lin.A = lambda t: s.dfdx(t, lin.x(t), lin.u(t))
+        lin.B = lambda t: s.dfdu(t, lin.x(t), lin.u(t))
+    return ctx['lin']
+
+
+@bench('build')
+def bench_build(ctx, repeat):
+    # the build is only done once, in setup()
+    return ctx['build']
+
+
+@bench('f')
+def bench_f(ctx, repeat):
+    s, x, u = ctx['s'], ctx['x0'], ctx['u0']
+    return percall(lambda: s.f(0.0, x, u), 200 * repeat)
+
+
+@bench('dfdx')
+def bench_dfdx(ctx, repeat):
+    s, x, u = ctx['s'], ctx['x0'], ctx['u0']
+    return percall(lambda: s.dfdx(0.0, x, u), 200 * repeat)
+
+
+@bench('dfdu')
+def bench_dfdu(ctx, repeat):
+    s, x, u = ctx['s'], ctx['x0'], ctx['u0']
+    return percall(lambda: s.dfdu(0.0, x, u), 200 * repeat)
+
+
+@bench('integrate')
+def bench_integrate(ctx, repeat):
+    nlsys = system(ctx)
+    return best(lambda: nlsys.integrate(linearize=False), repeat)
+
+
+@bench('integrate_lin')
+def bench_integrate_lin(ctx, repeat):
+    nlsys = system(ctx)
+    return best(lambda: nlsys.integrate(linearize=True), repeat)
+
+
+@bench('cdre')
+def bench_cdre(ctx, repeat):
+    lin = linearization(ctx)
+
+    def solve():
+        CDRE(ctx['tlims'], lin.A, lin.B).solve()
+    return best(solve, repeat)
+
+
+@bench('lq')
+def bench_lq(ctx, repeat):
+    lin, ref = linearization(ctx), ctx['ref']
+    Q, R, PT = ctx['Q'], ctx['R'], ctx['PT']
+    tb = ctx['tlims'][1]
+    q = lambda t: np.dot(lin.x(t) - ref.x(t), Q(t))
+    r = lambda t: np.dot(lin.u(t) - ref.u(t), R(t))
+    qf = np.dot(lin.x(tb) - ref.x(tb), PT)
+
+    def solve():
+        LQ(ctx['tlims'], lin.A, lin.B, q=q, r=r, qf=qf).solve()
+    return best(solve, repeat)
+
+
+@bench('cost')
+def bench_cost(ctx, repeat):
+    lin = linearization(ctx)
+    nlsys = system(ctx)
+    cost = nlsys.build_cost(R=ctx['R'], Q=ctx['Q'], PT=ctx['PT'])
+    return best(lambda: cost(lin), repeat)
+
+
+@bench('iteration')
+def bench_iteration(ctx, repeat):
+    # initial projection and direction, then one line search step
+    def iteration():
+        opt = TrajectoryOptimizer(ctx['s'], ctx['ref'], ctx['R'], ctx['Q'],
+                                  ctx['PT'], tlims=ctx['tlims'],
+                                  maxiter=1, verbose=False)
+        opt.run(ctx['itj'])
+    return best(iteration, repeat)
+
+
+def commit():
+    try:
+        out = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                      cwd=here, stderr=subprocess.STDOUT)
+        return out.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load(path, default):
+    if not os.path.exists(path):
+        return default
+    with open(path) as f:
+        return json.load(f)
+
+
+def save(path, data):
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(data, f, indent=1, sort_keys=True)
+    os.rename(tmp, path)
+
+
+def compare(results, baseline, tolerance):
+    # {name: ratio} of the benchmarks slower than baseline * (1 + tol)
+    out = {}
+    for (name, secs) in results.iteritems():
+        if name in baseline and baseline[name] > 0:
+            ratio = secs / baseline[name]
+            if ratio > 1 + tolerance:
+                out[name] = ratio
+    return out
+
+
+def run(system='flat', repeat=3, only=None):
+    ctx = setup(system)
+    results = {}
+    for (name, func) in benchmarks:
+        if only and name not in only:
+            continue
+        results[name] = func(ctx, repeat)
+        print("%-16s %12.6fs" % (name, results[name]))
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="nlsymb benchmark suite")
+    parser.add_argument('--system', choices=['flat', 'sin'], default='flat')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--only', default=None,
+                        help="comma separated benchmark names")
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help="allowed slowdown against the baseline")
+    parser.add_argument('--history', default=HISTORY)
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--save-baseline', action='store_true')
+    args = parser.parse_args()
+
+    only = args.only.split(',') if args.only else None
+    results = run(args.system, args.repeat, only)
+
+    record = {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'commit': commit(),
+        'system': args.system,
+        'repeat': args.repeat,
+        'host': platform.node(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'results': results,
+    }
+    history = load(args.history, [])
+    history.append(record)
+    save(args.history, history)
+
+    # baselines are kept per system since the builds differ a lot
+    baselines = load(args.baseline, {})
+    if args.save_baseline:
+        baselines[args.system] = record
+        save(args.baseline, baselines)
+        print("saved baseline for %s to %s" % (args.system, args.baseline))
+        sys.exit(0)
+
+    if args.system not in baselines:
+        sys.stderr.write("ERROR: no baseline for %s in %s, nothing was "
+                         "compared; run with --save-baseline on this "
+                         "machine first\n" % (args.system, args.baseline))
+        sys.exit(2)
+
+    base = baselines[args.system]
+    missing = sorted(set(results) - set(base['results']))
+    if missing:
+        print("not in the baseline, not compared: %s" % ", ".join(missing))
+    slow = compare(results, base['results'], args.tolerance)
+    for name in sorted(slow):
+        print("REGRESSION: %-12s %.2fx baseline (%s)" %
+              (name, slow[name], base['commit']))
+    if slow:
+        sys.exit(1)
+    print("OK: within %d%% of baseline (%s)" %
+          (100 * args.tolerance, base['commit']))
@@ -12,6 +12,8 @@ import nlsymb
 from nlsymb import Timer, LineSearch, np, colored
 from nlsymb.sys import *
 from nlsymb.lqr import *
+from nlsymb.optim import TrajectoryOptimizer, load_system
+from nlsymb import export
 
 
 # coming soon to a theatre near you
@@ -111,6 +113,7 @@ if __name__ == "__main__":
     import matplotlib.pyplot as plt
     import time
     import pickle
+    import os
 
     # the following lines are in order to be able to reload nlsymb
     # in ipython
@@ -132,10 +135,18 @@ if __name__ == "__main__":
     u = map(ref.u, t)
     """
 
+    # delete the checkpoint file to start over
+    ckpt = 'pkl/flat_optim_ckpt.p'
+
     with Timer("whole program"):
-        with Timer("creating symbolic system"):
-            #s = FlatFloor2D(k=3)
-            s = SinFloor2D(k=3)
+        # a checkpointed run loads the system it exported when it
+        # started instead of building it again
+        s = load_system(ckpt) if os.path.exists(ckpt) else None
+        if s is None:
+            with Timer("creating symbolic system"):
+                #s = FlatFloor2D(k=3)
+                s = SinFloor2D(k=3)
+                s = export.load(export.export(s, 'pkl/flat_optim_sys.py'))
 
         # load the reference (target) trajectory
         ref_file = open('pkl/flat_ref.p', 'rb')
@@ -165,85 +176,28 @@ if __name__ == "__main__":
         itj.xtoq(s)
         itj.interpolate()
 
-        nlsys = System(s.f, tlims=tlims, xinit=itj.x(tlims[0]),
-                       dfdx=s.dfdx, dfdu=s.dfdu)
-        nlsys.phi = s.phi
-        nlsys.ref = ref
-        nlsys.delf = s.delf
-
         Rcost = lambda t: np.diag([10, 10])
         Qcost = lambda t: np.diag([10, 10, 1, 1])
 
         PTcost = Qcost(tb)
 
-        # zerocontrol = Controller(reference=ref)
-        # nlsys.set_u(zerocontrol)
-
-        trajectories = []
-        costs = []
-        gradcosts = []
-        with Timer("initial projection and descent direction"):
-            tj = nlsys.project(itj, lin=True)
-            trajectories.append(tj)
-
-            cost = nlsys.build_cost(R=Rcost, Q=Qcost, PT=PTcost)
-            q = lambda t: matmult(tj.x(t) - ref.x(t), Qcost(t))
-            r = lambda t: matmult(tj.u(t) - ref.u(t), Rcost(t))
-            qf = matmult(tj.x(tb) - ref.x(tb), PTcost)
-
-            descdir = GradDirection(tlims, tj.A, tj.B, jumps=tj.jumps,
-                                    q=q, r=r, qf=qf)
-            descdir.solve()
-
-            costs.append(cost(tj))
-            print("[initial cost]\t\t" +
-                  colored("%f" % costs[-1], 'red'))
-
-            ddir = descdir.direction
-            ddircost = cost(ddir, tspace=True)
-            gradcosts.append(ddircost)
-            print("[descent direction]\t" + colored("%f" % ddircost, 'yellow'))
-
-        index = 0
-        ls = None
-        while ddircost > 1e-7:
-            index = index + 1
-
-            with Timer("descent direction and line search "):
-                if index is not 1:
-                    costs.append(cost(tj))
-                    print("[cost]\t\t" + colored("%f" % costs[-1], 'blue'))
-
-                    ddir = descdir.direction
-                    ddircost = cost(ddir, tspace=True)
-                    gradcosts.append(ddircost)
-                    print("[descent direction]\t" +\
-                          colored("%f" % ddircost, 'yellow'))
-
-                if ls is None:
-                    alpha = 100 / ddircost
-                else:
-                    alpha = ls.gamma * 10
-                ls = LineSearch(cost, cost.grad, alpha=alpha, beta=1e-8)
-                ls.x = tj
-                ls.p = descdir.direction
-                ls.search()
-
-                tj = tj + ls.gamma * descdir.direction
-                # print("cost of trajectory after descent: %f" % cost(tj))
-
-            with Timer("second projection"):
-                tj = nlsys.project(tj, tlims=tlims, lin=True)
-                trajectories.append(tj)
-
-            cost = nlsys.build_cost(R=Rcost, Q=Qcost, PT=PTcost)
-            q = lambda t: matmult(tj.x(t) - ref.x(t), Qcost(t))
-            r = lambda t: matmult(tj.u(t) - ref.u(t), Rcost(t))
-            qf = matmult(tj.x(tb) - ref.x(tb), PTcost)
-
-            descdir = GradDirection(tlims, tj.A, tj.B, jumps=tj.jumps,
-                                    q=q, r=r, qf=qf)
-            descdir.solve()
+        opt = TrajectoryOptimizer(s, ref, Rcost, Qcost, PTcost, tlims=tlims,
+                                  tol=1e-7, checkpoint=ckpt)
+        if os.path.exists(ckpt):
+            print("resuming from " + ckpt)
+            opt.resume(ckpt)
+        else:
+            with Timer("initial projection and descent direction"):
+                opt.start(itj)
+
+        with Timer("descent iterations"):
+            tj = opt.run()
+
+        trajectories = opt.trajectories
+        costs = opt.costs
+        gradcosts = opt.gradcosts
+        nlsys = opt.nlsys
+        print(opt.report())
 
 
     # tjt = tj
@@ -1,14 +1,71 @@
 import numpy as np
-import sympy as sym
 
 from functools import reduce
 import time
+import importlib
 import scipy
 from scipy.integrate import ode
 import scipy.interpolate
 from copy import deepcopy
 from timeout import TimeoutError
-from termcolor import colored
+import profiling
+import sparse
+
+# the numeric runtime (Trajectory, sysIntegrate, lqr, System, cost)
+# does not need sympy; it is only imported once a SymSys is built or
+# sym is used. keep it that way, see benchmarks/bench_import.py
+
+
+class LazyModule(object):
+    # stands in for a module that is imported on first attribute access
+
+    def __init__(self, name):
+        self.__dict__['_name'] = name
+        self.__dict__['_module'] = None
+
+    def __getattr__(self, attr):
+        module = self.__dict__['_module']
+        if module is None:
+            module = importlib.import_module(self.__dict__['_name'])
+            self.__dict__['_module'] = module
+        return getattr(module, attr)
+
+
+class LazyAttribute(object):
+    # stands in for an attribute of a LazyModule, e.g. a class: calls,
+    # attribute access and isinstance/issubclass checks go to the real
+    # object, which is looked up (importing its module) on first use
+
+    def __init__(self, module, name):
+        self.__dict__['_module'] = module
+        self.__dict__['_name'] = name
+
+    def _target(self):
+        return getattr(self.__dict__['_module'], self.__dict__['_name'])
+
+    def __call__(self, *args, **kwargs):
+        return self._target()(*args, **kwargs)
+
+    def __getattr__(self, attr):
+        return getattr(self._target(), attr)
+
+    def __instancecheck__(self, obj):
+        return isinstance(obj, self._target())
+
+    def __subclasscheck__(self, cls):
+        return issubclass(cls, self._target())
+
+
+sym = LazyModule('sympy')
+
+
+def colored(text, *args, **kwargs):
+    # termcolor.colored, imported on first use; plain text without it
+    try:
+        from termcolor import colored as tcolored
+    except ImportError:
+        return text
+    return tcolored(text, *args, **kwargs)
 
 # from matutils import matmult
 
@@ -59,8 +116,21 @@ class Trajectory():
         self._t.append(t)
 
         for name, val in kwargs.iteritems():
-            current = getattr(self, '_' + name)
-            setattr(self, '_' + name, current + [val])
+            getattr(self, '_' + name).append(val)
+
+    def addpoints(self, t, **kwargs):
+        # batch version of addpoint: t is a sequence of times and each
+        # keyword a sequence (or stacked array) of values, one per time
+        t = list(t)
+        if not t:
+            return
+        lo, hi = min(t), max(t)
+        self.tmin = lo if self.tmin is None else min(self.tmin, lo)
+        self.tmax = hi if self.tmax is None else max(self.tmax, hi)
+        self._t.extend(t)
+
+        for name, vals in kwargs.iteritems():
+            getattr(self, '_' + name).extend(vals)
 
     def reset(self):
         # used for resetting all the args to []
@@ -152,6 +222,7 @@ class LineSearch():
         self.alpha = alpha
         self.beta = beta
 
+    @profiling.profiled('linesearch')
     def search(self):
         x = self.x
         p = self.p
@@ -161,8 +232,9 @@ class LineSearch():
         gamma = self.alpha
         while True:
             try:
-                if self.func(x + gamma * p) > \
-                        func + self.beta * gamma * grad:
+                with profiling.section('linesearch.trial'):
+                    trial = self.func(x + gamma * p)
+                if trial > func + self.beta * gamma * grad:
                     gamma = gamma / 2
                     print("decreasing gamma to %e" % gamma)
                     # this will not work with the -O flag
@@ -176,18 +248,85 @@ class LineSearch():
 
 
 class Timer():
+    # prints the time a block took; with profiling enabled the block
+    # is also recorded as a section named after fmts
 
     def __init__(self, fmts=""):
+        self.name = fmts
         self.fmts = fmts + " took %fs to run"
 
     def __enter__(self):
+        self.section = profiling.section(self.name)
+        self.section.__enter__()
         self.start = time.time()
 
     def __exit__(self, *args):
         delta = time.time() - self.start
+        self.section.__exit__(*args)
         print(self.fmts % delta)
 
 
+class IntegrationStats(object):
+    # how much work one or more vode integrations did
+
+    """
+     steps : accepted steps
+     rhs, jac : right hand side and jacobian evaluations
+     lu : LU decompositions of the iteration matrix
+     rejected : steps rejected by the error test or for a nonlinear
+            solver convergence failure
+     restarts : times the integration was restarted, at jumps and at
+            guard crossings
+     crossings : guard crossings found
+     wall : wall time in seconds
+
+    vode counts from its last (re)start only, so collect(solver) has to
+    be called before every set_initial_value() restart and at the end.
+    stats add up with + (and += in place), e.g. to total a whole
+    projection.
+    """
+
+    fields = ('steps', 'rhs', 'jac', 'lu', 'rejected', 'restarts',
+              'crossings', 'wall')
+
+    def __init__(self, **kwargs):
+        for k in self.fields:
+            setattr(self, k, kwargs[k] if k in kwargs else 0)
+
+    def collect(self, solver):
+        # add the counters vode keeps in iwork (see the DVODE docs)
+        iwork = getattr(solver._integrator, 'iwork', None)
+        if iwork is None:
+            return
+        self.steps += int(iwork[10])
+        self.rhs += int(iwork[11])
+        self.jac += int(iwork[12])
+        self.lu += int(iwork[18])
+        self.rejected += int(iwork[20]) + int(iwork[21])
+
+    def restart(self, solver, y, t):
+        # set_initial_value, keeping the counters of the run so far
+        self.collect(solver)
+        self.restarts += 1
+        solver.set_initial_value(y, t)
+
+    def __add__(self, other):
+        return IntegrationStats(**{k: getattr(self, k) + getattr(other, k)
+                                   for k in self.fields})
+
+    def __iadd__(self, other):
+        for k in self.fields:
+            setattr(self, k, getattr(self, k) + getattr(other, k))
+        return self
+
+    def asdict(self):
+        return {k: getattr(self, k) for k in self.fields}
+
+    def __repr__(self):
+        return "IntegrationStats(%s)" % ", ".join(
+            "%s=%s" % (k, getattr(self, k)) for k in self.fields)
+
+
 def sysIntegrate(func, init, control=None, phi=None, debug=False, 
                  tlims=(0, 10), jac=None, method='bdf', **kw):
     """
@@ -203,15 +342,37 @@ def sysIntegrate(func, init, control=None, phi=None, debug=False,
     'jumps': [(tj,fj), ...] list of times and jump matrices
              fj is a matrix that multiplies x at the jump time
     'delfunc': delf(t, x, u) a callable that returns a jump matrix
+    'stats': an IntegrationStats that the work done is added to
+    'band': (lband, uband) of the jacobian, e.g. sparse.Pattern.hint(),
+            a hint for the stiff solver; jac still returns the full
+            matrix, it is packed here
+    'exact': if True, integration stops at tf and the last point is
+            exactly at tf (interpolated by vode), instead of the run
+            ending somewhere within a step past tf; a crossing in that
+            last step but past tf is then left alone
     """
 
+    start = time.time()
+    stats = kw['stats'] if 'stats' in kw else IntegrationStats()
+
     ti, tf = tlims
     t, x = ([ti], [init])
 
+    band = kw['band'] if 'band' in kw else None
+    bandkw = {}
+    if band is not None:
+        bandkw = {'lband': band[0], 'uband': band[1]}
+        if jac is not None:
+            jac = sparse.banded(jac, band[0], band[1], len(init))
+
+    func = profiling.wrap('rhs', func)
+    if jac is not None:
+        jac = profiling.wrap('jac', jac)
+
     solver = ode(func, jac)
     solver.set_integrator('vode',
                           max_step=1e-2,
-                          method=method)
+                          method=method, **bandkw)
     solver.set_initial_value(init, ti)
 
     if control is not None:
@@ -222,7 +383,10 @@ def sysIntegrate(func, init, control=None, phi=None, debug=False,
     jumps_out = []
     jumps_in = kw['jumps'] if 'jumps' in kw else []
 
-    while solver.successful() and solver.t < tf + 1e-2:
+    exact = kw['exact'] if 'exact' in kw else False
+    tstop = tf if exact else tf + 1e-2
+
+    while solver.successful() and solver.t < tstop:
         solver.integrate(tf, relax=True, step=True)
         
         xx = solver.y
@@ -230,7 +394,7 @@ def sysIntegrate(func, init, control=None, phi=None, debug=False,
             for (tj, fj) in jumps_in:
                 if t[-1] < tj and tj < solver.t:
                     xx = xx  + matmult(fj,xx)
-                    solver.set_initial_value(xx, solver.t)
+                    stats.restart(solver, xx, solver.t)
 
         x.append(xx)
         t.append(solver.t)
@@ -247,6 +411,12 @@ def sysIntegrate(func, init, control=None, phi=None, debug=False,
 
                 # replace the wrong values
                 t[-1], x[-1] = (tcross, xcross)
+                stats.crossings += 1
+
+                # an exact run ends at tf, so a crossing past it belongs
+                # to whatever is integrated next
+                if exact and tcross > tf:
+                    break
 
                 # obtain jump term
                 if 'delfunc' in kw:
@@ -255,12 +425,24 @@ def sysIntegrate(func, init, control=None, phi=None, debug=False,
                     jumps_out.append((tcross, jmatrix))
 
                 # reset integration
-                solver.set_initial_value(xcross, tcross)
+                stats.restart(solver, xcross, tcross)
                 if debug:
                     print("found intersection at t=%f" % tcross)
 
             
 
+    if exact:
+        # the solver stepped just past tf (or to a crossing past tf,
+        # which it was not restarted at); vode interpolates back to tf
+        keep = len([tt for tt in t if tt < tf])
+        xf = solver.integrate(tf) if solver.t > tf else solver.y
+        stats.collect(solver)
+        stats.wall += time.time() - start
+        return (t[:keep] + [tf], x[:keep] + [np.array(xf)], jumps_out)
+
+    stats.collect(solver)
+    stats.wall += time.time() - start
+
     # make the last point be exactly at tf
     # xf = x[-2] + (tf - t[-2])*(x[-1] - x[-2])/(t[-1] - t[-2])
     # x[-1] = xf
@@ -270,6 +452,7 @@ def sysIntegrate(func, init, control=None, phi=None, debug=False,
 
 # a wrapper around interp1d that also extrapolates
 class interxpolate(scipy.interpolate.interp1d):
+    @profiling.profiled('interpolate')
     def __call__(self, x):
         try:
             return super(interxpolate, self).__call__(x)
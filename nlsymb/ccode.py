@@ -0,0 +1,106 @@
+import ctypes
+import hashlib
+import os
+import subprocess
+
+from nlsymb import np, sym
+
+# native backend for tensor.SymExpr: the expression tensor is printed as
+# one C function void f(double a0, double a1, ..., double *out), compiled
+# into a shared library with the local compiler and called through
+# ctypes. the parameters are passed by value and the result written
+# into a ctypes buffer, which is cheaper per call than going through
+# numpy arrays.
+# libraries are cached on disk by the hash of their source, so every
+# expression is compiled once per machine.
+
+CACHE = os.environ['NLSYMB_CACHE'] if 'NLSYMB_CACHE' in os.environ \
+    else os.path.join(os.path.expanduser('~'), '.cache', 'nlsymb')
+CC = os.environ['CC'] if 'CC' in os.environ else 'cc'
+CFLAGS = ['-O2', '-shared', '-fPIC']
+
+# what compiled() raises when the C function cannot be had here, for
+# callers to fall back on: no compiler (OSError), a failed compile
+# (CalledProcessError), a library built for another platform (OSError)
+# or without the function (AttributeError), and parameters or printed
+# expressions ctypes and the compiler cannot take (ValueError, TypeError)
+ERRORS = (OSError, subprocess.CalledProcessError, AttributeError,
+          ValueError, TypeError)
+
+TEMPLATE = '''\
+#include <math.h>
+
+void nlsymb_eval(%s)
+{
+%s
+}
+'''
+
+
+def source(params, expr):
+    # C source computing every entry of expr into out, in C order,
+    # with the common subexpressions computed once
+    expr = np.array(expr)
+    args = [sym.Symbol('a%d' % i) for i in range(len(params))]
+    rule = dict(zip(params, args))
+    flat = [sym.sympify(e).xreplace(rule) for e in expr.flat]
+
+    temps, reduced = sym.cse(flat, symbols=sym.numbered_symbols('c'))
+
+    signature = ", ".join(["double %s" % a for a in args] +
+                          ["double *out"])
+    lines = []
+    for (c, e) in temps:
+        lines.append("    const double %s = %s;" % (c, sym.ccode(e)))
+    for (i, e) in enumerate(reduced):
+        lines.append("    out[%d] = %s;" % (i, sym.ccode(e)))
+    return TEMPLATE % (signature, "\n".join(lines))
+
+
+def build(src):
+    # path of the shared library for src, compiling it if not cached;
+    # raises OSError or CalledProcessError if there is no compiler
+    # that can build it
+    key = hashlib.sha1(" ".join([CC] + CFLAGS) + src).hexdigest()
+    lib = os.path.join(CACHE, 'nlsymb_%s.so' % key)
+    if os.path.exists(lib):
+        return lib
+
+    if not os.path.isdir(CACHE):
+        os.makedirs(CACHE)
+    csrc = os.path.join(CACHE, 'nlsymb_%s.c' % key)
+    with open(csrc, 'w') as f:
+        f.write(src)
+
+    # build under a temporary name so that concurrent builds (e.g. the
+    # MultiStart workers) never load a half written library
+    tmp = '%s.%d.tmp' % (lib, os.getpid())
+    subprocess.check_call([CC] + CFLAGS + ['-o', tmp, csrc, '-lm'])
+    os.rename(tmp, lib)
+    return lib
+
+
+def compiled(params, expr):
+    """
+    a callable func(*vals) evaluating the tensor expr at params = vals,
+    as tensor.lambdify does, through a compiled C function.
+    func(*vals, out=buf) writes into the float array buf instead of
+    allocating the result.
+    """
+    shape = np.array(expr).shape
+    cfunc = ctypes.CDLL(build(source(params, expr))).nlsymb_eval
+    cfunc.argtypes = [ctypes.c_double] * len(params) + [ctypes.c_void_p]
+    cfunc.restype = None
+    Buffer = ctypes.c_double * int(np.prod(shape))
+
+    def func(*vals, **kwargs):
+        if 'out' in kwargs:
+            out = kwargs['out']
+            cfunc(*(vals + (out.ctypes.data,)))
+            return out
+        buf = Buffer()
+        cfunc(*(vals + (buf,)))
+        return np.frombuffer(buf).reshape(shape)
+
+    func.shape = shape
+    return func
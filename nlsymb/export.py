@@ -0,0 +1,223 @@
+import imp
+import os
+import time
+
+from nlsymb import np, sym, LazyModule, profiling, sparse
+
+from .sys import SymSys
+
+tn = LazyModule('nlsymb.tensor')
+
+
+# the numeric functions a SymSys needs at run time:
+# (name in the module, attribute of the SymSys, parameters)
+# parameters are names of SymSys attributes holding the symbols
+FIELDS = [
+    ('fplus', '_fplus', ('t', 'x', 'u')),
+    ('fmins', '_fmins', ('t', 'x', 'u')),
+    ('dfxp', '_dfxp', ('t', 'x', 'u')),
+    ('dfxm', '_dfxm', ('t', 'x', 'u')),
+    ('dfup', '_dfup', ('t', 'x', 'u')),
+    ('dfum', '_dfum', ('t', 'x', 'u')),
+    ('P', '_P', ('z',)),
+    ('dP', '_dP', ('z',)),
+    ('Ohm', '_Ohm', ('z',)),
+    ('dOhm', '_dOhm', ('z',)),
+    ('Psi', '_Psi', ('q',)),
+    ('dPsi', '_dPsi', ('q',)),
+]
+
+# only exported when they were built, i.e. s.dfdxx() was called
+HESSIANS = [
+    ('dfxxp', '_dfxxp', ('t', 'x', 'u')),
+    ('dfxxm', '_dfxxm', ('t', 'x', 'u')),
+    ('dfxup', '_dfxup', ('t', 'x', 'u')),
+    ('dfxum', '_dfxum', ('t', 'x', 'u')),
+]
+
+HEADER = '''\
+# generated by nlsymb.export from %(cls)s on %(date)s, do not edit
+# load with nlsymb.export.load(path) for a SymSys-like object
+from __future__ import division
+
+from numpy import *
+
+Abs = abs
+
+
+def _stack(entries, shape, like):
+    # the entries as a float array of shape; for the batched calls,
+    # where the parameters (like) are arrays of N points, (N,) + shape
+    if ndim(like) == 0:
+        return array(entries, dtype=float).reshape(shape)
+    out = array(broadcast_arrays(like, *entries)[1:], dtype=float)
+    return out.T.reshape((len(like),) + shape)
+
+cls = %(cls)r
+dim = %(dim)d
+si = %(si)d
+hessians = %(hessians)r
+
+# structural nonzeros of dfdx and dfdu, see nlsymb.sparse
+dfdx_pattern = %(dfdx_pattern)r
+dfdu_pattern = %(dfdu_pattern)r
+dfdx_unit = %(dfdx_unit)r
+dfdu_unit = %(dfdu_unit)r
+'''
+
+
+def _function(name, expr, params):
+    # python source of name(*params) returning expr as a float array,
+    # common subexpressions computed once; numpy's functions, so that
+    # it takes arrays of N points for each parameter as well
+    expr = np.array(expr)
+    args = [sym.Symbol('a%d' % i) for i in range(len(params))]
+    rule = dict(zip(params, args))
+    flat = [sym.sympify(e).xreplace(rule) for e in expr.flat]
+    from sympy.core.function import AppliedUndef
+    if any(e.atoms(AppliedUndef) for e in flat):
+        raise Exception("%s calls functions that are evaluated numerically "
+                        "(tn.Opaque, e.g. for a coupled mass matrix), it "
+                        "cannot be exported" % name)
+
+    temps, reduced = sym.cse(flat, symbols=sym.numbered_symbols('c'))
+
+    lines = ["def %s(%s):" % (name, ", ".join(str(a) for a in args))]
+    for (c, e) in temps:
+        lines.append("    %s = %s" % (c, _repr(e)))
+    body = ", ".join(_repr(e) for e in reduced)
+    lines.append("    return _stack([%s], %r, a0)" % (body, expr.shape))
+    return "\n".join(lines)
+
+
+def _repr(expr):
+    from sympy.printing.lambdarepr import NumPyPrinter
+    return NumPyPrinter().doprint(expr)
+
+
+def _params(s, names):
+    out = []
+    for name in names:
+        p = getattr(s, name)
+        out.extend(np.array(p).flat if not isinstance(p, sym.Symbol)
+                   else [p])
+    return out
+
+
+def export(s, path):
+    """
+    writes the numeric functions of the SymSys s to path, a pure python
+    module that only needs numpy. the functions take the flattened
+    parameters, the same way the lambdified SymExpr.func do.
+    """
+    fields = list(FIELDS)
+    hessians = '_dfxxp' in s.__dict__
+    if hessians:
+        fields += HESSIANS
+
+    header = HEADER % {'cls': type(s).__name__, 'dim': s.dim, 'si': s.si,
+                       'hessians': hessians,
+                       'dfdx_pattern': s.dfdx_pattern.mask.tolist(),
+                       'dfdu_pattern': s.dfdu_pattern.mask.tolist(),
+                       'dfdx_unit': s.dfdx_pattern.unit.tolist(),
+                       'dfdu_unit': s.dfdu_pattern.unit.tolist(),
+                       'date': time.strftime('%Y-%m-%d %H:%M')}
+    src = [header.rstrip()]
+    for (name, attr, params) in fields:
+        expr = getattr(s, attr)
+        if isinstance(expr, tn.SymExpr):
+            expr = expr.expr
+        src.append(_function(name, expr, _params(s, params)))
+
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        f.write("\n\n\n".join(src) + "\n")
+    os.rename(tmp, path)
+    return path
+
+
+class _Func(object):
+    # stands in for a SymExpr, only its func is used at run time
+
+    def __init__(self, func):
+        self.func = func
+
+    def batch(self, *args):
+        # the exported functions take arrays of N points as they are
+        return self.func(*args)
+
+
+class CompiledSys(SymSys):
+# a SymSys whose numeric functions come from an exported module
+
+    """
+    has the run time interface of the SymSys it was exported from
+    (f, dfdx, dfdu, delf, phi, dphi, P, dP, Ohm, dOhm, Psi, dPsi,
+    xtopq, xtoq, ... and dfdxx/dfdxu if the hessians were exported)
+    without any symbolic expressions. build with load(path). the
+    batched f_batch, dfdx_batch, ... evaluate all points in one call.
+    """
+
+    def __init__(self, module):
+        self.module = module
+        self.name = module.cls
+        self.dim = module.dim
+        self.si = module.si
+
+        for (name, attr, params) in FIELDS + \
+                (HESSIANS if module.hessians else []):
+            setattr(self, attr, _Func(getattr(module, name)))
+
+        self._ohm = module.Ohm
+        self._psi = module.Psi
+
+        # modules exported before the patterns were recorded lack them
+        self.dfdx_pattern, self.dfdu_pattern = [
+            sparse.Pattern(getattr(module, k + '_pattern'),
+                           getattr(module, k + '_unit', None))
+            if hasattr(module, k + '_pattern') else None
+            for k in ('dfdx', 'dfdu')]
+        self.delf = lambda t, x, u: self._delf(t, x, u)
+
+    def Ohm(self, z):
+        return self.module.Ohm(*z)
+
+    def dOhm(self, z):
+        return self.module.dOhm(*z)
+
+    def Psi(self, q):
+        return self.module.Psi(*q)
+
+    def dPsi(self, q):
+        return self.module.dPsi(*q)
+
+    def P(self, zval):
+        if zval[self.si] > 0:
+            return zval
+        return self.module.P(*zval)
+
+    def dP(self, zval):
+        return self.module.dP(*zval)
+
+    @profiling.profiled('lambdified.delf')
+    def _delf(self, t, xval, uval):
+        # SymSys._delf without the (unused) mass matrix evaluation
+        params = np.concatenate(([t], xval, uval))
+        fp = self._fplus.func(*params)
+        fm = self._fmins.func(*params)
+        dphi = self.dphi(xval)
+        return -np.outer(fp - fm, dphi) / np.abs(np.inner(fp, dphi))
+
+    def _makehess(self):
+        raise Exception("%s was exported without second derivatives, "
+                        "call dfdxx() on the SymSys before exporting"
+                        % self.name)
+
+
+def load(path):
+    # a CompiledSys from a module written by export(); it remembers path,
+    # so that checkpoints of optimizations of it can load it again
+    name = os.path.splitext(os.path.basename(path))[0]
+    s = CompiledSys(imp.load_source('nlsymb_export_' + name, path))
+    s.path = os.path.abspath(path)
+    return s
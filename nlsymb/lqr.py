@@ -1,9 +1,62 @@
 import numpy as np
-from scipy.linalg import schur
+from scipy.linalg import schur, cho_factor, cho_solve
+from scipy.interpolate import interp1d
 from numpy.linalg import inv
 from scipy.integrate import ode
 
-from . import matmult, sysIntegrate, Trajectory
+from . import time, matmult, sysIntegrate, Trajectory, interxpolate, \
+    profiling, IntegrationStats, sparse
+
+
+# evaluate func(t) for every t in tlist and stack the results;
+# interpolation objects are evaluated in one vectorized call, and a
+# constant array is repeated for every t
+def _sample(func, tlist):
+    tlist = np.asarray(tlist, dtype=float)
+    if not callable(func):
+        func = np.asarray(func, dtype=float)
+        return np.repeat(func[None], len(tlist), axis=0)
+    if isinstance(func, interp1d):
+        lo, hi = func.x[0], func.x[-1]
+        inside = (tlist >= lo) & (tlist <= hi)
+        if inside.all():
+            return np.asarray(func(tlist))
+        out = np.empty((len(tlist),) + func.y.shape[1:])
+        out[inside] = func(tlist[inside])
+        for i in np.flatnonzero(~inside):
+            out[i] = func(tlist[i])
+        return out
+
+    return np.array([func(t) for t in tlist], dtype=float)
+
+
+# func itself if it is callable, a constant function returning it
+# as a float array otherwise
+def _function(func):
+    if callable(func):
+        return func
+    func = np.array(func, dtype=float)
+    return lambda t: func
+
+
+# matrix exponential of a stack of matrices M (N, k, k) by scaling
+# and squaring a truncated Taylor series, accurate to roundoff
+def _expm(M, order=10):
+    M = np.asarray(M, dtype=float)
+    eye = np.eye(M.shape[-1])
+    norm = np.abs(M).sum(axis=-2).max() if M.size else 0.0
+    squarings = max(0, int(np.ceil(np.log2(norm / 0.5)))) if norm else 0
+
+    X = M / 2.0 ** squarings
+    E = eye + X
+    term = X
+    for j in range(2, order + 1):
+        term = np.einsum('kij,kjl->kil', term, X) / j
+        E = E + term
+
+    for _ in range(squarings):
+        E = np.einsum('kij,kjl->kil', E, E)
+    return E
 
 
 # check that the dimensions of A and B are correct and return them
@@ -65,8 +118,18 @@ class CDRE(object):
         # get R and Q and Pb from qwargs
         self.Q = kwargs['Q'] if 'Q' in kwargs \
             else lambda t: np.eye(n)
-        self.R = kwargs['R'] if 'R' in kwargs \
-            else lambda t: np.eye(m)
+
+        # R can also be given as a constant array, in which case
+        # (as for the default) its factorization is computed once
+        R = kwargs['R'] if 'R' in kwargs else np.eye(m)
+        if callable(R):
+            self.R = R
+            self._Rfac = None
+        else:
+            R = np.array(R, dtype=float)
+            self.R = lambda t: R
+            self._Rfac = cho_factor(R)
+            self._Rinv = inv(R)
 
         # if Pb is not given get it from solving
         # a CARE at the final time
@@ -86,6 +149,13 @@ class CDRE(object):
         #else:
         self.jumps = []
 
+        # sparse.Pattern of A(t) and B(t), e.g. SymSys.dfdx_pattern,
+        # for structured products
+        self.Apattern = kwargs['Apattern'] if 'Apattern' in kwargs \
+            else None
+        self.Bpattern = kwargs['Bpattern'] if 'Bpattern' in kwargs \
+            else None
+
     def _Pdot(self, s, P):
         A, B = self.A(-s), self.B(-s)
         R, Q = self.R(-s), self.Q(-s)
@@ -93,16 +163,49 @@ class CDRE(object):
 
         # rebuild the matrix from the array
         P = P.reshape((n, n))
-        # do necessary matrix algebra
-        Pd = matmult(P, B, inv(R), B.T, P) \
-            - matmult(A.T, P) - matmult(P, A) - Q
+        Rinv = inv(R) if self._Rfac is None else self._Rinv
+        # do necessary matrix algebra; P is symmetric, so P A = (A.T P).T
+        BtP = sparse.tdot(self.Bpattern, B, P)
+        AtP = sparse.tdot(self.Apattern, A, P)
+        Pd = matmult(BtP.T, Rinv, BtP) - AtP - AtP.T - Q
         # ravel and multiply by -1 (for backwards integration)
         return -Pd.ravel()
 
+    def _Rsolve(self, tlist, Y):
+        # solve R(t) Z = Y(t) for a stack of right hand sides, one
+        # per time in tlist; Y has shape (N, m) or (N, m, k)
+        Y = np.asarray(Y, dtype=float)
+        vec = Y.ndim == 2
+        if vec:
+            Y = Y[:, :, None]
+
+        if self._Rfac is not None:
+            N, m, k = Y.shape
+            Z = cho_solve(self._Rfac, Y.transpose(1, 0, 2).reshape(m, -1))
+            Z = Z.reshape(m, N, k).transpose(1, 0, 2)
+        else:
+            Z = np.linalg.solve(_sample(self.R, tlist), Y)
+
+        return Z[:, :, 0] if vec else Z
+
+    def _gains(self, tlist, Ps):
+        # K(t) = R^-1 B(t).T P(t) for all times at once
+        Bs = _sample(self.B, tlist)
+        return self._Rsolve(tlist, np.einsum('kji,kjl->kil', Bs, Ps))
+
+    def _feedforward(self, tlist, bs, rs):
+        # C(t) = R^-1 (B(t).T b(t) + r(t)) for all times at once
+        Bs = _sample(self.B, tlist)
+        return self._Rsolve(tlist, np.einsum('kji,kj->ki', Bs, bs) + rs)
+
+    @profiling.profiled('riccati')
     def solve(self, **kwargs):
         n, m = self.dims
         sa, sb = (-self.ta, -self.tb)
 
+        start = time.time()
+        self.stats = IntegrationStats()
+
         Pdot = lambda s, P: self._Pdot(s, P)
         solver = ode(Pdot)
 
@@ -124,10 +227,13 @@ class CDRE(object):
                     if prevtime > tj and tj > -solver.t:
                         #  positive sign because backwards integration
                         P = P + matmult(fj.T, P) + matmult(P, fj)
-                        solver.set_initial_value(P.ravel(), solver.t) 
+                        self.stats.restart(solver, P.ravel(), solver.t)
             
             results.append((-solver.t, P))
 
+        self.stats.collect(solver)
+        self.stats.wall += time.time() - start
+
         for (t, P) in reversed(results):
             self._Ptj.addpoint(t, P=P)
 
@@ -146,6 +252,8 @@ class LQR(CDRE):
      dims : optional, dimensions of state and control
      Q(t), S(t), R(t), Qf=Pb : cost function matrices
                             if not provided, default is identity
+     Apattern, Bpattern : optional, sparse.Pattern of A(t) and B(t)
+            (e.g. SymSys.dfdx_pattern), used for structured products
      NOTE: xa, S(t) not actually implemented
     """
 
@@ -163,10 +271,9 @@ class LQR(CDRE):
 
     def solve(self, **kwargs):
         super(LQR, self).solve()
+        t = self._Ptj._t
         self._Kt = Trajectory('K')
-        for (t, P) in zip(self._Ptj._t, self._Ptj._P):
-            K = matmult(inv(self.R(t)), self.B(t).T, P)
-            self._Kt.addpoint(t, K=K)
+        self._Kt.addpoints(t, K=self._gains(t, np.array(self._Ptj._P)))
 
         self._Kt.interpolate()
         self.K = lambda t: self._Kt.K(t)
@@ -186,6 +293,11 @@ class LQ(LQR):
             return the optimal cost later on
      jumps : optional, list of pairs (t, f) at which dynamics
             switch and the jump term to be added to q(t) at that time
+     fused : optional, if False P is integrated first and b in a
+            second pass that interpolates K; defaults to True
+     warmstart : optional, a WarmStart instance used to obtain P and K,
+            only b is integrated then (implies fused=False)
+     Apattern, Bpattern : optional, sparse.Pattern of A(t) and B(t)
     """
 
     def __init__(self, tlims, A, B, **kwargs):
@@ -198,6 +310,14 @@ class LQ(LQR):
 
         self.bdot = lambda s, b: self._bdot(s, b)
 
+        # solve for P and b in one backward pass (default), or
+        # integrate b after P as two separate passes
+        self.fused = kwargs['fused'] if 'fused' in kwargs else True
+        self.warmstart = kwargs['warmstart'] if 'warmstart' in kwargs \
+            else None
+        self._riccatikw = {k: kwargs[k] for k in ('Q', 'R', 'Pb')
+                           if k in kwargs}
+
         if 'jumps' in kwargs:
             self.jumps = kwargs['jumps']
         #else:
@@ -209,13 +329,113 @@ class LQ(LQR):
         K = self.K(-s)
 
         # b is already a vector
-        bd = matmult(K.T, r) - q - \
-            matmult((A - matmult(B, K)).T, b)
+        bd = matmult(K.T, r) - q - sparse.tdot(self.Apattern, A, b) + \
+            matmult(K.T, sparse.tdot(self.Bpattern, B, b))
 
         return -bd  # negative for reverse integration
 
+    def _Pbdot(self, s, y):
+        # Riccati equation and affine term stacked into one system,
+        # with K computed from the current P instead of interpolated
+        A, B = self.A(-s), self.B(-s)
+        R, Q = self.R(-s), self.Q(-s)
+        q, r = self.q(-s), self.r(-s)
+        n, m = self.dims
+
+        P = y[:n*n].reshape((n, n))
+        b = y[n*n:]
+        BtP = sparse.tdot(self.Bpattern, B, P)
+        if self._Rfac is None:
+            K = np.linalg.solve(R, BtP)
+        else:
+            K = cho_solve(self._Rfac, BtP)
+
+        # P is symmetric, so P A = (A.T P).T and P B = (B.T P).T
+        AtP = sparse.tdot(self.Apattern, A, P)
+        Pd = matmult(BtP.T, K) - AtP - AtP.T - Q
+        bd = matmult(K.T, r) - q - sparse.tdot(self.Apattern, A, b) + \
+            matmult(K.T, sparse.tdot(self.Bpattern, B, b))
+
+        # negative for reverse integration
+        return -np.concatenate((Pd.ravel(), bd))
+
+    @profiling.profiled('lq')
     def solve(self, **kwargs):
-        super(LQ, self).solve()
+        if not self.fused or self.warmstart is not None:
+            return self._solve_staged(**kwargs)
+
+        n, m = self.dims
+        sa, sb = (-self.ta, -self.tb)
+
+        start = time.time()
+        self.stats = IntegrationStats()
+
+        Pbdot = lambda s, y: self._Pbdot(s, y)
+        solver = ode(Pbdot)
+        solver.set_integrator('vode', max_step=1e-2, **kwargs)
+        solver.set_initial_value(np.concatenate((self.Pb.ravel(), self.qf)),
+                                 sb)
+
+        results = [(-sb, self.Pb, self.qf)]
+        while solver.successful() and solver.t < sa + 1e-2:
+            solver.integrate(sa, step=True)
+            P = solver.y[:n*n].reshape((n, n))
+            b = solver.y[n*n:]
+
+            # same jump handling as in CDRE.solve and _solve_staged
+            if self.jumps:
+                prevtime = results[-1][0]
+                for (tj, fj) in self.jumps:
+                    if prevtime > tj and tj > -solver.t:
+                        # positive sign because backwards integration
+                        P = P + matmult(fj.T, P) + matmult(P, fj)
+                        b = b + matmult(fj.T, b)
+                        self.stats.restart(
+                            solver, np.concatenate((P.ravel(), b)), solver.t)
+
+            results.append((-solver.t, P, b))
+
+        self.stats.collect(solver)
+        self.stats.wall += time.time() - start
+
+        results.reverse()
+        t = [res[0] for res in results]
+        Ps = np.array([res[1] for res in results])
+        bs = np.array([res[2] for res in results])
+        rs = _sample(self.r, t)
+
+        self._Ptj = Trajectory('P')
+        self._Ptj.addpoints(t, P=Ps)
+        self._Kt = Trajectory('K')
+        self._Kt.addpoints(t, K=self._gains(t, Ps))
+        self._bt = Trajectory('b')
+        self._bt.addpoints(t, b=bs)
+        self._Ct = Trajectory('C')
+        self._Ct.addpoints(t, C=self._feedforward(t, bs, rs))
+
+        for tj in (self._Ptj, self._Kt, self._bt, self._Ct):
+            tj.interpolate()
+
+        self.P = lambda t: self._Ptj.P(t)
+        self.K = lambda t: self._Kt.K(t)
+        self.b = self._bt.b
+        self.C = lambda t: self._Ct.C(t)
+
+    def _solve_staged(self, **kwargs):
+        # stats add up the riccati pass, if there is one, and the b pass
+        if self.warmstart is None:
+            super(LQ, self).solve()
+            stats = self.stats
+        else:
+            stats = IntegrationStats()
+            reg = self.warmstart.riccati(self.tlims, self.A, self.B,
+                                         **self._riccatikw)
+            self._Ptj, self._Kt = reg._Ptj, reg._Kt
+            self.P, self.K = reg.P, reg.K
+
+        start = time.time()
+        self.stats = IntegrationStats()
+
         sa, sb = (-self.ta, -self.tb)
         solver = ode(self.bdot)
         solver.set_integrator('vode', max_step=1e-2, **kwargs)
@@ -234,10 +454,14 @@ class LQ(LQR):
                     if prevtime > tj and tj > -solver.t:
                         # positive sign because backwards integration
                         b = b + matmult(fj.T, b)
-                        solver.set_initial_value(b, solver.t) 
+                        self.stats.restart(solver, b, solver.t)
 
             results.append((-solver.t, b))
 
+        self.stats.collect(solver)
+        self.stats.wall += time.time() - start
+        self.stats = stats + self.stats
+
         self._bt = Trajectory('b')
         for (t, b) in reversed(results):
             self._bt.addpoint(t, b=b)
@@ -245,11 +469,10 @@ class LQ(LQR):
         self._bt.interpolate()
         self.b = self._bt.b
 
+        t = self._bt._t
+        Cs = self._feedforward(t, np.array(self._bt._b), _sample(self.r, t))
         self._Ct = Trajectory('C')
-        for (t, b) in zip(self._bt._t, self._bt._b):
-            C = matmult(inv(self.R(t)),
-                        matmult(self.B(t).T, b) + self.r(t))
-            self._Ct.addpoint(t, C=C)
+        self._Ct.addpoints(t, C=Cs)
 
         self._Ct.interpolate()
         self.C = lambda t: self._Ct.C(t)
@@ -267,12 +490,78 @@ class Controller(object):
             self.K = kwargs['K']
         else:
             self.K = lambda t: np.zeros((m, n))
+        self.feedback, self.feedforward = 'K' in kwargs, 'C' in kwargs
+        # the Trajectory with field K that K(t) interpolates (LQR._Kt),
+        # so that nlsymb.shooting can rebuild the controller elsewhere
+        self.schedule = kwargs['schedule'] if 'schedule' in kwargs \
+            else None
 
     def __call__(self, t, x):
         return self.ref.u(t) - \
             matmult(self.K(t), x - self.ref.x(t)) - self.C(t)
 
 
+class TableController(Controller):
+# a Controller with reference, gain and feedforward compiled into
+# one table, for evaluation inside integrators and real-time loops
+
+    """
+    ref.u, ref.x, K and C are sampled once on a uniform grid of
+    spacing dt (default 1e-3) over tlims (default: the reference's time
+    span). every grid time stores one row [ref.u + K ref.x - C, K],
+    so a call is a single row lookup with linear interpolation between
+    neighbours followed by u = row[:m] - K x. times outside tlims get
+    the first or last row.
+
+    calling with an array of N times and an (N, n) array of states
+    returns the (N, m) array of controls.
+    """
+
+    def __init__(self, dt=1e-3, tlims=None, **kwargs):
+        super(TableController, self).__init__(**kwargs)
+        n, m = self.n, self.m
+
+        if tlims is None:
+            tlims = (self.ref._t[0], self.ref._t[-1])
+        ta, tb = tlims
+        num = max(int(np.ceil((tb - ta) / dt)), 1)
+        t = np.linspace(ta, tb, num + 1)
+
+        K = _sample(self.K, t).reshape(len(t), m, n)
+        ff = _sample(self.ref.u, t) - _sample(self.C, t) + \
+            np.einsum('kij,kj->ki', K, _sample(self.ref.x, t))
+
+        table = np.ascontiguousarray(
+            np.hstack((ff, K.reshape(len(t), m * n))))
+
+        self.t = t
+        self._t0 = ta
+        self._idt = num / float(tb - ta)
+        self._end = float(num)
+        self._last = num - 1
+        self._table = table
+        # slope to the next row, so a lookup is row + w * slope
+        self._slope = np.vstack((np.diff(table, axis=0), table[-1:] * 0))
+
+    def __call__(self, t, x):
+        n, m = self.n, self.m
+        # clamped to the table first, so that the interpolation never
+        # extrapolates past its ends
+        s = (t - self._t0) * self._idt
+
+        if np.ndim(t) == 0:
+            s = min(max(s, 0.0), self._end)
+            i = min(int(s), self._last)
+            row = self._table[i] + (s - i) * self._slope[i]
+            return row[:m] - np.dot(row[m:].reshape(m, n), x)
+
+        s = np.clip(s, 0.0, self._end)
+        i = np.minimum(s.astype(int), self._last)
+        rows = self._table[i] + (s - i)[:, None] * self._slope[i]
+        K = rows[:, m:].reshape(len(i), m, n)
+        return rows[:, :m] - np.einsum('kij,kj->ki', K, x)
+
+
 class DescentDirection(object):
 # implements a descent direction, given a quadratic model
 # see section 6.3.2 of Elliot Johnson's thesis
@@ -281,9 +570,14 @@ class DescentDirection(object):
         u = self._controller(t, x)
         A = self.A(t)
         B = self.B(t)
-        return matmult(A, x) + matmult(B, u)
+        return sparse.dot(self.Apattern, A, x) + \
+            sparse.dot(self.Bpattern, B, u)
 
+    @profiling.profiled('direction')
     def solve(self, **kwargs):
+        if kwargs.get('exact', getattr(self, 'exact', False)):
+            return self._solve_exact()
+
         n, m = self.dims
 
         # make a zero trajectory
@@ -298,12 +592,80 @@ class DescentDirection(object):
                                       K=self.lq.K, C=self.lq.C)
 
         xdot = lambda t, x: self._xdot(t, x)
+        stats = IntegrationStats()
         (t, x, jumps) = sysIntegrate(xdot, self.dx0, tlims=self.tlims,
-                                    jumps=self.jumps)
+                                    jumps=self.jumps, stats=stats)
         tj = Trajectory('x', 'u')
         for (tt, xx) in zip(t, x):
             tj.addpoint(tt, x=xx, u=self._controller(tt, xx))
 
+        tj.interpolate()
+        tj.tlims = self.tlims
+        tj.stats = stats
+        self.direction = tj
+
+    def _schedule(self):
+        # times, gains and feedforward of the LQ solution on its own
+        # grid, cut to tlims (the vode solvers step past ta)
+        lq = self.lq
+        if isinstance(lq, DLQ):
+            t, K, C = lq.t, lq.Ks, lq.Cs
+        else:
+            t = np.array(lq._Kt._t)
+            K = np.array(lq._Kt._K)
+            if len(lq._Ct._t) == len(t) and np.allclose(lq._Ct._t, t):
+                C = np.array(lq._Ct._C)
+            else:
+                C = _sample(lq._Ct.C, t)
+
+        inside = (t > self.ta) & (t < self.tb)
+        ends = [self.ta, self.tb]
+        t = np.concatenate(([self.ta], t[inside], [self.tb]))
+        K = np.concatenate((K[:1] * 0, K[inside], K[:1] * 0))
+        C = np.concatenate((C[:1] * 0, C[inside], C[:1] * 0))
+        K[0], K[-1] = map(lq.K, ends)
+        C[0], C[-1] = map(lq.C, ends)
+        return t, K, C
+
+    def _solve_exact(self):
+        # the closed loop xdot = (A - BK) x - BC is linear, so on every
+        # cell of the LQ grid x is advanced by the exponential of the
+        # augmented matrix [[A - BK, -BC], [0, 0]] h, with A, B, K and C
+        # averaged over the cell; all cells are exponentiated at once
+        n, m = self.dims
+        t, K, C = self._schedule()
+        A = _sample(self.A, t)
+        B = _sample(self.B, t)
+
+        Acl = A - np.einsum('kij,kjl->kil', B, K)
+        f = -np.einsum('kij,kj->ki', B, C)
+
+        h = np.diff(t)
+        M = np.zeros((len(h), n + 1, n + 1))
+        M[:, :n, :n] = (Acl[:-1] + Acl[1:]) / 2
+        M[:, :n, n] = (f[:-1] + f[1:]) / 2
+        Phi = _expm(h[:, None, None] * M)
+
+        # jumps are applied at the end of the cell they fall in,
+        # as sysIntegrate does
+        celljumps = {}
+        for (tj, fj) in self.jumps:
+            k = np.searchsorted(t, tj) - 1
+            if 0 <= k < len(h):
+                celljumps.setdefault(k, []).append(fj)
+
+        x = np.empty((len(t), n))
+        x[0] = self.dx0
+        for k in range(len(h)):
+            xx = matmult(Phi[k, :n, :n], x[k]) + Phi[k, :n, n]
+            for fj in celljumps.get(k, []):
+                xx = xx + matmult(fj, xx)
+            x[k + 1] = xx
+
+        u = -np.einsum('kij,kj->ki', K, x) - C
+
+        tj = Trajectory('x', 'u')
+        tj.addpoints(t, x=x, u=u)
         tj.interpolate()
         tj.tlims = self.tlims
         self.direction = tj
@@ -320,6 +682,10 @@ class GradDirection(DescentDirection):
         n, m = self.dims
 
         self.A, self.B = A, B
+        self.Apattern = kwargs['Apattern'] if 'Apattern' in kwargs \
+            else None
+        self.Bpattern = kwargs['Bpattern'] if 'Bpattern' in kwargs \
+            else None
 
         self.q = kwargs['q']
         self.r = kwargs['r']
@@ -330,7 +696,414 @@ class GradDirection(DescentDirection):
         # set initial condition to zero if nothing is passed
         self.dx0 = kwargs['dx0'] if 'dx0' in kwargs else np.zeros(n)
 
-        self.lq = LQ(tlims, A, B, **kwargs)
+        # 'exact': propagate the direction with per-cell transition
+        # matrices on the LQ grid instead of integrating it with vode
+        self.exact = kwargs['exact'] if 'exact' in kwargs else False
+
+        # 'discrete': use the fixed grid DLQ solver instead of vode
+        if kwargs.get('discrete', False):
+            self.lq = DLQ(tlims, A, B, **kwargs)
+        else:
+            self.lq = LQ(tlims, A, B, **kwargs)
         self.lq.solve()
         # don't need to set R, Q, Qf, S because set to I
         # and 0 by default
+
+
+class NewtonDirection(GradDirection):
+# descent direction from a second order model of the cost
+
+    """
+    GradDirection weights the LQ model with identity, which makes it a
+    steepest descent step. here the model uses the actual cost weights
+    (Gauss-Newton), and optionally the curvature of the dynamics
+    weighted by the costate (Newton), so that a unit step is the
+    minimizer of the model.
+
+    what we need, on top of what GradDirection takes:
+     Q(t), R(t), PT : the cost function matrices
+     fxx : optional, fxx(t) returns the (n, n, n) array of second
+            derivatives d^2 f_i / dx_j dx_k along the trajectory, e.g.
+            lambda t: s.dfdxx(t, tj.x(t), tj.u(t)) for a SymSys s.
+            without it the direction is Gauss-Newton
+     psd : optional, smallest eigenvalue the Newton Q is clipped to so
+            the LQ problem stays convex, defaults to 1e-6
+
+    the costate follows ldot = -A.T l - q, l(tb) = qf, with the same
+    jump terms as b in LQ. the mixed x-u curvature is not used since
+    LQ has no cross term (S) yet.
+    """
+
+    def __init__(self, tlims, A, B, **kwargs):
+        self.tlims = tlims
+        self.ta, self.tb = self.tlims
+        self.A = A
+
+        kwargs = dict(kwargs)
+        R, Q, PT = kwargs.pop('R'), kwargs.pop('Q'), kwargs.pop('PT')
+        fxx = kwargs.pop('fxx', None)
+        psd = kwargs.pop('psd', 1e-6)
+        self.q, self.qf = kwargs['q'], kwargs['qf']
+        self.jumps = kwargs['jumps'] if 'jumps' in kwargs else []
+        self.Apattern = kwargs['Apattern'] if 'Apattern' in kwargs \
+            else None
+
+        if fxx is not None:
+            Q = self._newtonQ(Q, fxx, psd)
+
+        super(NewtonDirection, self).__init__(tlims, A, B, Q=Q, R=R,
+                                              Pb=np.array(PT, dtype=float),
+                                              **kwargs)
+
+    def _costate(self):
+        # integrate ldot = -A.T l - q backwards, the same way LQ does b
+        sa, sb = (-self.ta, -self.tb)
+        ldot = lambda s, l: sparse.tdot(self.Apattern, self.A(-s), l) + \
+            self.q(-s)
+
+        start = time.time()
+        stats = IntegrationStats()
+
+        solver = ode(ldot)
+        solver.set_integrator('vode', max_step=1e-2)
+        solver.set_initial_value(np.array(self.qf, dtype=float), sb)
+
+        results = [(-sb, np.array(self.qf, dtype=float))]
+        while solver.successful() and solver.t < sa + 1e-2:
+            solver.integrate(sa, step=True)
+            l = solver.y
+            prevtime = results[-1][0]
+            for (tj, fj) in self.jumps:
+                if prevtime > tj and tj > -solver.t:
+                    l = l + matmult(fj.T, l)
+                    stats.restart(solver, l, solver.t)
+            results.append((-solver.t, l))
+
+        stats.collect(solver)
+        stats.wall += time.time() - start
+        self.costate_stats = stats
+
+        results.reverse()
+        return (np.array([res[0] for res in results]),
+                np.array([res[1] for res in results]))
+
+    def _newtonQ(self, Q, fxx, psd):
+        t, l = self._costate()
+        self.costate = interxpolate(t, l, axis=0, kind='slinear')
+
+        H = np.einsum('ki,kijl->kjl', l, _sample(fxx, t))
+        Qn = _sample(Q, t) + (H + H.transpose(0, 2, 1)) / 2
+
+        # clip the spectrum so the model stays convex
+        w, V = np.linalg.eigh(Qn)
+        w = np.maximum(w, psd)
+        Qn = np.einsum('kij,kj,klj->kil', V, w, V)
+
+        return interxpolate(t, Qn, axis=0, kind='slinear')
+
+
+class DLQ(object):
+# discrete-time LQ problem and solver on a fixed time grid
+
+    """
+    an alternative to LQ for optimization iterations, where solving the
+    continuous Riccati equation with vode is more accuracy than needed.
+    the linearization is discretized on a fixed grid and the discrete
+    Riccati and affine-term recursions are run backwards over it.
+
+    what we need:
+     tlims = (ta, tb) : time interval
+     A(t), B(t) : linear system matrices
+     q(t), r(t), qf : optional, linear terms in cost function
+     Q(t), R(t), Pb : optional, quadratic model matrices,
+            default to I, I and 0 as in CDRE; Q and R can also be
+            constant arrays
+     dt : optional, grid spacing, defaults to 1e-2
+     tgrid : optional, increasing array of times spanning tlims,
+            overrides dt
+     jumps : optional, list of pairs (t, f) of impact times and jump
+            terms, applied at the grid cell that contains t
+
+    after solve() the schedule is available as arrays on the grid
+    (self.t, self.Ps, self.Ks, self.bs, self.Cs) and as callables
+    P(t), K(t), b(t), C(t) like the continuous solvers provide
+    """
+
+    def __init__(self, tlims, A, B, **kwargs):
+        self.tlims = tlims
+        self.ta, self.tb = self.tlims
+        ta, tb = tlims
+
+        self.dims = DimExtract(A(ta), B(ta))
+        n, m = self.dims
+
+        self.A, self.B = A, B
+
+        self.Q = _function(kwargs['Q']) if 'Q' in kwargs \
+            else lambda t: np.eye(n)
+        self.R = _function(kwargs['R']) if 'R' in kwargs \
+            else lambda t: np.eye(m)
+        self.Pb = kwargs['Pb'] if 'Pb' in kwargs else np.zeros((n, n))
+
+        self.q = kwargs['q'] if 'q' in kwargs else lambda t: np.zeros(n)
+        self.r = kwargs['r'] if 'r' in kwargs else lambda t: np.zeros(m)
+        self.qf = kwargs['qf'] if 'qf' in kwargs else np.zeros(n)
+
+        self.jumps = kwargs['jumps'] if 'jumps' in kwargs else []
+
+        if 'tgrid' in kwargs:
+            self.t = np.asarray(kwargs['tgrid'], dtype=float)
+        else:
+            dt = kwargs['dt'] if 'dt' in kwargs else 1e-2
+            num = max(int(np.ceil((tb - ta) / dt)), 1)
+            self.t = np.linspace(ta, tb, num + 1)
+
+    def _discretize(self):
+        # second order hold of the dynamics on every cell, using the
+        # average of the end point values; all cells at once
+        t = self.t
+        h = np.diff(t)
+        n, m = self.dims
+
+        A = _sample(self.A, t)
+        B = _sample(self.B, t)
+        Am = (A[:-1] + A[1:]) / 2
+        Bm = (B[:-1] + B[1:]) / 2
+
+        hA = h[:, None, None] * Am
+        eye = np.eye(n)[None]
+        Ad = eye + hA + np.einsum('kij,kjl->kil', hA, hA) / 2
+        Bd = h[:, None, None] * np.einsum('kij,kjl->kil', eye + hA / 2, Bm)
+
+        Qd = h[:, None, None] * _sample(self.Q, t[:-1])
+        Rd = h[:, None, None] * _sample(self.R, t[:-1])
+        qd = h[:, None] * _sample(self.q, t[:-1])
+        rd = h[:, None] * _sample(self.r, t[:-1])
+
+        return (B, Ad, Bd, Qd, Rd, qd, rd)
+
+    @profiling.profiled('riccati')
+    def solve(self, **kwargs):
+        n, m = self.dims
+        t = self.t
+        N = len(t) - 1
+
+        (B, Ad, Bd, Qd, Rd, qd, rd) = self._discretize()
+
+        # cell index of every jump, jump k lies in (t[k], t[k+1]]
+        celljumps = {}
+        for (tj, fj) in self.jumps:
+            k = np.searchsorted(t, tj) - 1
+            if 0 <= k < N:
+                celljumps.setdefault(k, []).append(fj)
+
+        Ps = np.empty((N + 1, n, n))
+        bs = np.empty((N + 1, n))
+        Ks = np.empty((N + 1, m, n))
+        Cs = np.empty((N + 1, m))
+
+        P = np.array(self.Pb, dtype=float)
+        b = np.array(self.qf, dtype=float)
+        Ps[N], bs[N] = P, b
+        Rb = self.R(t[N])
+        Ks[N] = np.linalg.solve(Rb, matmult(B[N].T, P))
+        Cs[N] = np.linalg.solve(Rb, matmult(B[N].T, b) + self.r(t[N]))
+
+        for k in range(N - 1, -1, -1):
+            for fj in celljumps.get(k, []):
+                # positive sign because of the backwards recursion
+                P = P + matmult(fj.T, P) + matmult(P, fj)
+                b = b + matmult(fj.T, b)
+
+            BP = matmult(Bd[k].T, P)
+            H = Rd[k] + matmult(BP, Bd[k])
+            G = matmult(BP, Ad[k])
+            g = matmult(Bd[k].T, b) + rd[k]
+
+            KC = np.linalg.solve(H, np.column_stack((G, g)))
+            K, C = KC[:, :n], KC[:, n]
+
+            P = Qd[k] + matmult(Ad[k].T, P, Ad[k]) - matmult(G.T, K)
+            P = (P + P.T) / 2
+            b = qd[k] + matmult(Ad[k].T, b) - matmult(K.T, g)
+
+            Ps[k], bs[k], Ks[k], Cs[k] = P, b, K, C
+
+        self.Ps, self.bs, self.Ks, self.Cs = Ps, bs, Ks, Cs
+
+        kw = dict(axis=0, kind='slinear')
+        self.P = interxpolate(t, Ps, **kw)
+        self.b = interxpolate(t, bs, **kw)
+        self.K = interxpolate(t, Ks, **kw)
+        self.C = interxpolate(t, Cs, **kw)
+
+
+class WarmStart(object):
+# reuses the last Riccati solution across optimization iterations
+
+    """
+    hands out solved LQR objects, re-solving the Riccati equation only
+    when the linearization moved. A(t), B(t) are sampled on a uniform
+    grid and compared against the samples the stored solution was
+    computed from.
+
+     tol : relative change in A and B below which the linearization
+            counts as unchanged
+     samples : number of comparison times over tlims
+     partial : if True, only [ta, t*] is re-solved, where t* is the
+            end of the last window that changed; the stored P and K
+            are kept after t* and P(t*) is the new terminal condition
+     shift : if True and tlims moved forward in time (a receding
+            horizon), the new end piece of the window is solved and the
+            overlap with the old window, if the linearization there is
+            unchanged, is re-solved backwards from it only until P
+            agrees with the stored solution to tol; the Riccati
+            equation forgets its terminal condition backwards in time,
+            so the stored gains before that point are kept
+
+    Q, R and Pb must be the same on every call to riccati().
+    how often the solution was reused, shifted, partially or fully
+    re-solved is counted in self.stats.
+    """
+
+    def __init__(self, tol=1e-3, samples=200, partial=True, shift=False):
+        self.tol = tol
+        self.samples = samples
+        self.partial = partial
+        self.shift = shift
+
+        self.regulator = None
+        self.stats = {'reused': 0, 'shifted': 0, 'partial': 0, 'solved': 0}
+
+    def _linearization(self, tlims, A, B):
+        tlist = np.linspace(tlims[0], tlims[1], self.samples)
+        return (tlist, _sample(A, tlist), _sample(B, tlist))
+
+    def _changed(self, lin, old=None):
+        # per sample time, whether A or B moved by more than tol
+        (t, A, B), (t0, A0, B0) = lin, self._lin if old is None else old
+        scale = max(1.0, np.abs(A0).max(), np.abs(B0).max())
+        dA = np.abs(A - A0).reshape(len(t), -1).max(axis=1)
+        dB = np.abs(B - B0).reshape(len(t), -1).max(axis=1)
+        return np.maximum(dA, dB) > self.tol * scale
+
+    def riccati(self, tlims, A, B, **kwargs):
+        lin = self._linearization(tlims, A, B)
+        reg = self.regulator
+
+        if self.shift and reg is not None and \
+                reg.ta < tlims[0] < reg.tb < tlims[1]:
+            shifted = self._shifted(tlims, A, B, lin, **kwargs)
+            if shifted is not None:
+                return shifted
+
+        if reg is None or tuple(reg.tlims) != tuple(tlims) or \
+                lin[1].shape != self._lin[1].shape:
+            return self._solve(tlims, A, B, lin, **kwargs)
+
+        changed = self._changed(lin)
+        if not changed.any():
+            self.stats['reused'] += 1
+            return reg
+
+        # the Riccati equation runs backwards, so everything after the
+        # last changed window is still valid
+        last = np.flatnonzero(changed)[-1]
+        if not self.partial or last + 1 >= len(changed):
+            return self._solve(tlims, A, B, lin, **kwargs)
+
+        ts = lin[0][last + 1]
+        kw = dict(kwargs, Pb=reg.P(ts))
+        head = LQR((tlims[0], ts), A, B, **kw)
+        head.solve()
+
+        # splice the new head onto the stored tail
+        old = reg._Ptj._t
+        tail = [i for i in range(len(old)) if old[i] > head._Ptj._t[-1]]
+        head._Ptj.addpoints([old[i] for i in tail],
+                            P=[reg._Ptj._P[i] for i in tail])
+        head._Kt.addpoints([old[i] for i in tail],
+                           K=[reg._Kt._K[i] for i in tail])
+        head._Ptj.interpolate()
+        head._Kt.interpolate()
+        head.tlims = tuple(tlims)
+        head.ta, head.tb = head.tlims
+
+        # keep comparing the tail against what it was solved with
+        (t, A, B), (t0, A0, B0) = lin, self._lin
+        A, B = A.copy(), B.copy()
+        A[last + 1:], B[last + 1:] = A0[last + 1:], B0[last + 1:]
+
+        self.regulator, self._lin = head, (t, A, B)
+        self.stats['partial'] += 1
+        return head
+
+    def _shifted(self, tlims, A, B, lin, **kwargs):
+        reg = self.regulator
+        (t0, A0, B0) = self._lin
+
+        overlap = t0 >= tlims[0]
+        if overlap.sum() < 2:
+            return None
+        old = (t0[overlap], A0[overlap], B0[overlap])
+        new = (old[0], _sample(A, old[0]), _sample(B, old[0]))
+        if self._changed(new, old).any():
+            return None
+
+        tail = LQR((reg.tb, tlims[1]), A, B, **kwargs)
+        tail.solve()
+
+        # the stored solution ends in Pb at reg.tb where the new one
+        # goes on; re-solve the overlap from the tail's P(reg.tb) over
+        # a stretch that doubles until it meets the stored P
+        kw = dict(kwargs, Pb=tail.P(reg.tb))
+        h = (reg.tb - tlims[0]) / 8.0
+        while True:
+            ts = max(reg.tb - h, tlims[0])
+            mid = LQR((ts, reg.tb), A, B, **kw)
+            mid.solve()
+            Pm, Po = mid.P(ts), reg.P(ts)
+            if ts <= tlims[0] or np.abs(Pm - Po).max() <= \
+                    self.tol * max(1.0, np.abs(Po).max()):
+                break
+            h *= 2
+
+        # stored points before ts (from the one before ta, so that
+        # K(ta) interpolates), then the re-solved stretch and the tail
+        told = reg._Ptj._t
+        first = max(np.searchsorted(told, tlims[0]) - 1, 0)
+        keep = [i for i in range(first, len(told)) if told[i] < ts] \
+            if ts > tlims[0] else []
+        tmid = mid._Ptj._t
+        fresh = [i for i in range(len(tmid)) if tmid[i] < reg.tb and
+                 (tmid[i] >= ts or not keep)]
+        ttail = tail._Ptj._t
+        after = [i for i in range(len(ttail)) if ttail[i] >= reg.tb]
+
+        Ptj, Kt = Trajectory('P'), Trajectory('K')
+        for (src, idx) in ((reg, keep), (mid, fresh), (tail, after)):
+            Ptj.addpoints([src._Ptj._t[i] for i in idx],
+                          P=[src._Ptj._P[i] for i in idx])
+            Kt.addpoints([src._Kt._t[i] for i in idx],
+                         K=[src._Kt._K[i] for i in idx])
+        Ptj.interpolate()
+        Kt.interpolate()
+
+        tail._Ptj, tail._Kt = Ptj, Kt
+        tail.tlims = tuple(tlims)
+        tail.ta, tail.tb = tail.tlims
+
+        self.regulator, self._lin = tail, lin
+        self.stats['shifted'] += 1
+        return tail
+
+    def _solve(self, tlims, A, B, lin, **kwargs):
+        reg = LQR(tlims, A, B, **kwargs)
+        reg.solve()
+        self.regulator, self._lin = reg, lin
+        self.stats['solved'] += 1
+        return reg
+
+    def report(self):
+        return "reused %(reused)d, shifted %(shifted)d, " \
+            "partially re-solved %(partial)d, solved %(solved)d" % self.stats
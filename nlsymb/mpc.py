@@ -0,0 +1,131 @@
+from nlsymb import np, time, Trajectory
+
+from .sys import System
+from .lqr import Controller, WarmStart
+from .optim import TrajectoryOptimizer
+
+
+class RecedingHorizon(object):
+# receding horizon (MPC) use of the projection based optimizer
+
+    """
+    every tick re-optimizes over the window (t0, t0 + horizon) starting
+    from the measured state x0, with a capped number of iterations, and
+    returns the control law for the next dt seconds.
+
+    what we need:
+     s, ref, R(t), Q(t), PT : as for TrajectoryOptimizer; ref has to
+            cover every window, i.e. the run plus one horizon
+     horizon : length of the optimization window
+     dt : how far the window moves every tick
+     maxiter : optional, iterations per tick, defaults to 2
+     warmstart : optional, lqr.WarmStart shared by all ticks, defaults
+            to one with shift=True so the Riccati solution is reused
+            where consecutive windows overlap
+    other keyword arguments go to TrajectoryOptimizer.
+
+    windows end anywhere on the reference, also just before an impact,
+    so the projections and the plant integrate exactly up to the end
+    of their window (System(exact=True)) and leave an impact just past
+    it to the next window.
+
+    the previous solution, shifted forward and started at x0, is the
+    initial guess of the next tick; where it runs out the reference is
+    used. wall time of every tick is kept in self.latencies.
+    """
+
+    def __init__(self, s, ref, R, Q, PT, horizon, dt, **kwargs):
+        self.s, self.ref = s, ref
+        self.horizon = horizon
+        self.dt = dt
+
+        kwargs.setdefault('maxiter', 2)
+        kwargs.setdefault('verbose', False)
+        projection = {'exact': True}
+        projection.update(kwargs.get('projection', {}))
+        kwargs['projection'] = projection
+        if 'warmstart' not in kwargs:
+            kwargs['warmstart'] = WarmStart(shift=True)
+        self.warmstart = kwargs['warmstart']
+
+        self.opt = TrajectoryOptimizer(s, ref, R, Q, PT,
+                                       tlims=(0, horizon), **kwargs)
+        self.prev = None
+        self.latencies = []
+
+    def guess(self, t0, x0):
+        # previous solution over the part of the new window it covers,
+        # the reference after that
+        ta, tb = t0, t0 + self.horizon
+        ref, prev = self.ref, self.prev
+
+        itj = Trajectory('x', 'u')
+        u0 = ref.u(ta) if prev is None else prev.u(ta)
+        itj.addpoint(ta, x=np.array(x0), u=u0)
+
+        tend = ta
+        if prev is not None:
+            for (t, x, u) in zip(prev._t, prev._x, prev._u):
+                if ta < t <= min(tb, prev.tlims[1]):
+                    itj.addpoint(t, x=x, u=u)
+                    tend = t
+
+        if tend < tb - 1e-9:
+            for t in np.linspace(tend, tb, 10)[1:]:
+                itj.addpoint(t, x=ref.x(t), u=ref.u(t))
+
+        itj.interpolate()
+        itj.tlims = (ta, tb)
+        return itj
+
+    def tick(self, t0, x0):
+        start = time.time()
+
+        opt = self.opt
+        opt.tlims = (t0, t0 + self.horizon)
+        if not opt.start(self.guess(t0, x0)):
+            opt.run()
+        self.prev = opt.tj
+
+        self.latencies.append(time.time() - start)
+
+        # the same feedback law the projection uses
+        return Controller(reference=opt.tj, K=opt.nlsys.regulator.K)
+
+    def run(self, x0, tlims):
+        # closed loop simulation of the plant (the same model) over
+        # tlims, re-optimizing every dt; returns what the plant did
+        s = self.s
+        out = Trajectory('x', 'u')
+        t0, x = tlims[0], np.array(x0)
+
+        while t0 < tlims[1] - 1e-9:
+            t1 = min(t0 + self.dt, tlims[1])
+            control = self.tick(t0, x)
+
+            plant = System(s.f, tlims=(t0, t1), xinit=x,
+                           dfdx=s.dfdx, dfdu=s.dfdu, exact=True)
+            plant.phi = s.phi
+            plant.delf = s.delf
+            plant.set_u(control)
+            tj = plant.integrate(linearize=False)
+
+            for (t, xx, uu) in zip(tj._t, tj._x, tj._u):
+                if t0 <= t < t1:
+                    out.addpoint(t, x=xx, u=uu)
+            x = tj.x(t1)
+            t0 = t1
+
+        out.addpoint(t0, x=x, u=out._u[-1])
+        out.interpolate()
+        out.tlims = tlims
+        return out
+
+    def latency(self, percentiles=(50, 90, 99)):
+        # tick wall times: the given percentiles, max, and the worst
+        # tick as a fraction of dt (above 1 is not real-time)
+        lat = np.array(self.latencies)
+        out = {'p%d' % p: np.percentile(lat, p) for p in percentiles}
+        out['max'] = lat.max()
+        out['realtime'] = lat.max() / self.dt
+        return out
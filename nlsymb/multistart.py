@@ -0,0 +1,173 @@
+import multiprocessing
+
+from nlsymb import np
+
+from .optim import TrajectoryOptimizer
+from .shared import share, SharedTrajectory
+
+
+# everything the workers need but cannot be pickled (the SymSys with
+# its lambdified expressions, cost callables); set before the pool is
+# created so that forked workers inherit it instead of rebuilding it
+_shared = {}
+
+
+class MultiStart(object):
+# runs independent trajectory optimizations from many initial guesses
+
+    """
+    every initial guess is optimized by its own TrajectoryOptimizer in a
+    pool of worker processes. the workers are forked after the symbolic
+    system has been built, so they share that build instead of redoing
+    it (this relies on the fork start method, i.e. a unix system).
+
+    what we need:
+     s, ref, R(t), Q(t), PT, tlims : as for TrajectoryOptimizer
+     processes : optional, number of workers, defaults to the number
+            of cpus; 1 runs the starts in this process
+     prune : optional, a start is stopped once its cost is more than
+            prune times the best cost any start has reached so far,
+            defaults to 2.0; None never prunes
+     minprune : optional, iterations a start runs before it can be
+            pruned, defaults to 2
+    other keyword arguments (tol, maxiter, direction, ...) are passed
+    on to TrajectoryOptimizer.
+
+    run(starts) returns one result dict per start, ranked by final cost
+    with pruned and failed starts last. a result holds 'index' (position
+    in starts), 'cost', 'costs', 'gradcosts', 'iterations', 'reason'
+    ('tol', 'maxiter', 'pruned' or 'error'), 'timings' and 'tj'.
+    """
+
+    def __init__(self, s, ref, R, Q, PT, tlims=None, **kwargs):
+        self.processes = kwargs.pop('processes', None)
+        self.prune = kwargs.pop('prune', 2.0)
+        self.minprune = kwargs.pop('minprune', 2)
+
+        self.s, self.ref = s, ref
+        self.R, self.Q, self.PT = R, Q, PT
+        self.tlims = ref.tlims if tlims is None else tlims
+        self.optkw = kwargs
+        self.optkw.setdefault('verbose', False)
+
+    def run(self, starts):
+        _shared.clear()
+        _shared.update(ms=self, best=multiprocessing.Value('d', np.inf))
+
+        if self.processes == 1:
+            results = [_run_start(i, itj) for (i, itj) in enumerate(starts)]
+        else:
+            # starts and results travel as shared memory handles, only
+            # their names and layouts are pickled. every handle, the
+            # results' included, is unlinked here whatever fails
+            handles = []
+            try:
+                for itj in starts:
+                    handles.append(share(itj))
+                results = self._map(handles)
+                for res in results:
+                    if isinstance(res, Exception):
+                        raise res
+                    if isinstance(res['tj'], SharedTrajectory):
+                        res['tj'] = res['tj'].attach()
+                    elif res['tj'] is not None:
+                        # share() failed in the worker, so this one was
+                        # pickled without its interpolants
+                        res['tj'].interpolate()
+                        res['tj'].tlims = self.tlims
+                        res['tj'].jumps = res.pop('jumps')
+            finally:
+                for h in handles:
+                    h.unlink()
+
+        self.best = _shared['best'].value
+        _shared.clear()
+
+        rank = lambda res: (res['reason'] in ('pruned', 'error'),
+                            res['cost'])
+        self.results = sorted(results, key=rank)
+        return self.results
+
+    def _map(self, handles):
+        # _run_shared on every start in a pool; a start that raised is
+        # returned as its exception, after the handles of all the others
+        # have been added to handles
+        pool = multiprocessing.Pool(self.processes)
+        try:
+            pending = [pool.apply_async(_run_shared, (i, h))
+                       for (i, h) in enumerate(handles)]
+            results = []
+            for p in pending:
+                try:
+                    res = p.get()
+                except Exception as e:
+                    res = e
+                else:
+                    if isinstance(res['tj'], SharedTrajectory):
+                        handles.append(res['tj'])
+                results.append(res)
+        finally:
+            pool.close()
+            pool.join()
+        return results
+
+
+def _pruner(opt):
+    # optimizer callback: share the cost reached and stop the start if
+    # it fell too far behind the best one
+    ms, best = _shared['ms'], _shared['best']
+    cost = opt.costs[-1]
+
+    with best.get_lock():
+        if cost < best.value:
+            best.value = cost
+        behind = ms.prune is not None and opt.index >= ms.minprune and \
+            cost > ms.prune * best.value
+
+    if behind:
+        opt.pruned = True
+    return behind
+
+
+def _run_start(index, itj):
+    ms = _shared['ms']
+    if 'x' not in itj.__dict__:
+        itj.interpolate()
+
+    opt = TrajectoryOptimizer(ms.s, ms.ref, ms.R, ms.Q, ms.PT,
+                              tlims=ms.tlims, callbacks=[_pruner],
+                              **ms.optkw)
+    opt.pruned = False
+    res = {'index': index}
+    try:
+        opt.run(itj)
+        reason = 'pruned' if opt.pruned else opt.reason
+    except Exception as e:
+        reason = 'error'
+        res['error'] = repr(e)
+
+    tj = opt.tj
+    res.update({
+        'reason': reason,
+        'cost': opt.costs[-1] if opt.costs else np.inf,
+        'costs': opt.costs,
+        'gradcosts': opt.gradcosts,
+        'iterations': opt.index,
+        'timings': opt.timings,
+        'tj': tj,
+    })
+    return res
+
+
+def _run_shared(index, handle):
+    # _run_start in a worker: the start is attached from shared memory
+    # and the resulting trajectory handed back the same way, or pickled
+    # if it cannot be shared (with its jumps, which do not pickle)
+    res = _run_start(index, handle.attach())
+    tj = res['tj']
+    if tj is not None:
+        try:
+            res['tj'] = share(tj)
+        except Exception:
+            res['jumps'] = tj.jumps
+    return res
@@ -0,0 +1,380 @@
+import os
+import pickle
+
+from nlsymb import np, time, matmult, colored, LineSearch, profiling
+
+from .sys import System
+from .lqr import GradDirection, NewtonDirection
+from . import export
+
+
+class TrajectoryOptimizer(object):
+# projection based trajectory optimization of a hybrid system
+
+    """
+    owns the loop project -> GradDirection -> LineSearch -> project
+    that sin_optim.py and flat_optim.py used to carry in __main__.
+
+    what we need:
+     s : a SymSys (or anything with f, dfdx, dfdu, phi and delf)
+     ref : reference Trajectory with x and u
+     tlims : optional, time interval, defaults to ref.tlims
+     R(t), Q(t), PT : cost function matrices
+     tol : optional, stop when the cost of the descent direction
+            drops below tol, defaults to 1e-7
+     maxiter : optional, stop after this many iterations
+     callbacks : optional, list of callables cb(opt) called after the
+            initial projection and after every iteration; a callback
+            returning True stops the optimization
+     method : optional, 'grad' (default) for steepest descent
+            directions, 'gauss-newton' to weight the LQ model with the
+            cost matrices, or 'newton' to also add the curvature of the
+            dynamics (needs s.dfdxx); the newton methods try a unit
+            step first in every line search
+     direction : optional, dict of extra keyword arguments for
+            GradDirection (e.g. discrete=True, exact=True)
+     warmstart : optional, lqr.WarmStart for the projection regulator
+     projection : optional, dict of extra keyword arguments for the
+            System that projects (e.g. segments=4 for multiple shooting
+            over 4 worker processes, see nlsymb.shooting)
+     verbose : optional, print costs as the scripts did
+     checkpoint : optional, file to write a checkpoint to after every
+            accepted iterate; resume(checkpoint) picks the run up again.
+            the checkpoint does not hold s itself, only the path of the
+            module s was loaded from if it is a CompiledSys, so that
+            load_system(checkpoint) gets it back without rebuilding it;
+            any other s has to be built again before resuming
+     keep : optional, keep only the last keep trajectories in
+            self.trajectories (costs are always kept), defaults to all
+     memory : optional, if True record the bytes held per Trajectory
+            field and per solver after every stage in self.memory,
+            see memory_report()
+
+    after run(itj) the result is in self.tj, and the history in
+    self.trajectories, self.costs and self.gradcosts. time spent per
+    stage is accumulated in self.timings as {stage: [calls, seconds]};
+    with nlsymb.profiling enabled every accepted iterate is also marked,
+    so profiling.iterations() breaks the hot paths down per iteration.
+    """
+
+    stages = ('project', 'cost', 'direction', 'linesearch')
+
+    def __init__(self, s, ref, R, Q, PT, tlims=None, **kwargs):
+        self.s = s
+        self.ref = ref
+        self.tlims = ref.tlims if tlims is None else tlims
+        self.R, self.Q, self.PT = R, Q, PT
+
+        self.tol = kwargs['tol'] if 'tol' in kwargs else 1e-7
+        self.maxiter = kwargs['maxiter'] if 'maxiter' in kwargs else None
+        self.callbacks = list(kwargs['callbacks']) if 'callbacks' in kwargs \
+            else []
+        self.method = kwargs['method'] if 'method' in kwargs else 'grad'
+        self.dirkw = kwargs['direction'] if 'direction' in kwargs else {}
+        self.projkw = kwargs['projection'] if 'projection' in kwargs \
+            else {}
+        self.warmstart = kwargs['warmstart'] if 'warmstart' in kwargs \
+            else None
+        self.verbose = kwargs['verbose'] if 'verbose' in kwargs else True
+        self.checkpoint = kwargs['checkpoint'] if 'checkpoint' in kwargs \
+            else None
+        self.keep = kwargs['keep'] if 'keep' in kwargs else None
+        self.trackmemory = kwargs['memory'] if 'memory' in kwargs else False
+
+        self.timings = {k: [0, 0.0] for k in self.stages}
+        self.reset()
+
+    def reset(self):
+        self.close()
+        self.nlsys = None
+        self.tj = None
+        self.descdir = None
+        self.ls = None
+        self.index = 0
+        self.reason = None
+
+        self.trajectories = []
+        self.costs = []
+        self.gradcosts = []
+        self.memory = []
+
+    def _stage(self, name):
+        return _Stage(self.timings[name])
+
+    def _say(self, label, value, color):
+        if self.verbose:
+            print(label + colored("%f" % value, color))
+
+    def build_system(self, xinit):
+        s = self.s
+        kw = {'warmstart': self.warmstart} if self.warmstart else {}
+        kw.update(self._patterns())
+        if hasattr(s, 'dfdx_batch'):
+            kw['batch'] = s
+        kw.update(self.projkw)
+        nlsys = System(s.f, tlims=self.tlims, xinit=xinit,
+                       dfdx=s.dfdx, dfdu=s.dfdu, **kw)
+        nlsys.phi = s.phi
+        nlsys.ref = self.ref
+        nlsys.delf = s.delf
+        return nlsys
+
+    def _patterns(self):
+        # jacobian sparsity of the system, if it records one
+        s = self.s
+        if getattr(s, 'dfdx_pattern', None) is None:
+            return {}
+        return {'Apattern': s.dfdx_pattern, 'Bpattern': s.dfdu_pattern}
+
+    def project(self, tj):
+        with self._stage('project'):
+            return self.nlsys.project(tj, tlims=self.tlims, lin=True)
+
+    def direction(self, tj):
+        # descent direction for the quadratic model around tj
+        ref, Q, R, PT = self.ref, self.Q, self.R, self.PT
+        tb = self.tlims[1]
+
+        q = lambda t: matmult(tj.x(t) - ref.x(t), Q(t))
+        r = lambda t: matmult(tj.u(t) - ref.u(t), R(t))
+        qf = matmult(tj.x(tb) - ref.x(tb), PT)
+
+        kw = dict(self._patterns(), **self.dirkw)
+        kw.update(jumps=tj.jumps, q=q, r=r, qf=qf)
+        if self.method == 'grad':
+            Direction = GradDirection
+        else:
+            Direction = NewtonDirection
+            kw.update(Q=Q, R=R, PT=PT)
+        if self.method == 'newton':
+            s = self.s
+            kw['fxx'] = lambda t: s.dfdxx(t, tj.x(t), tj.u(t))
+
+        with self._stage('direction'):
+            descdir = Direction(self.tlims, tj.A, tj.B, **kw)
+            descdir.solve()
+        return descdir
+
+    def _accept(self, tj):
+        # tj is the new (projected) iterate: cost it and get a direction
+        self.tj = tj
+        self.trajectories.append(tj)
+        if self.keep is not None:
+            del self.trajectories[:max(len(self.trajectories) - self.keep, 0)]
+        self._memory('project')
+
+        self.cost = self.nlsys.build_cost(R=self.R, Q=self.Q, PT=self.PT)
+        with self._stage('cost'):
+            self.costs.append(self.cost(tj))
+        self._say("[cost]\t\t", self.costs[-1], 'blue')
+
+        self.descdir = self.direction(tj)
+        self._memory('direction')
+        with self._stage('cost'):
+            self.gradcosts.append(self.cost(self.descdir.direction,
+                                             tspace=True))
+        self._say("[descent direction]\t", self.gradcosts[-1], 'yellow')
+        profiling.mark(self.index)
+
+    def start(self, itj):
+        self.reset()
+        self.nlsys = self.build_system(itj.x(self.tlims[0]))
+        self._accept(self.project(itj))
+        self._checkpoint()
+        return self._notify()
+
+    def step(self):
+        # one line search along the current direction and projection
+        ddir = self.descdir.direction
+        if self.method != 'grad':
+            alpha = 1.0
+        elif self.ls is None:
+            alpha = 100 / self.gradcosts[-1]
+        else:
+            alpha = self.ls.gamma * 10
+
+        with self._stage('linesearch'):
+            ls = LineSearch(self.cost, self.cost.grad, alpha=alpha, beta=1e-8)
+            ls.x = self.tj
+            ls.p = ddir
+            ls.search()
+        self.ls = ls
+
+        self.index += 1
+        self._accept(self.project(self.tj + ls.gamma * ddir))
+        self._checkpoint()
+        return self._notify()
+
+    def _notify(self):
+        # run the callbacks, True if any of them asks to stop
+        stop = False
+        for cb in self.callbacks:
+            stop = bool(cb(self)) or stop
+        if stop:
+            self.reason = 'callback'
+        return stop
+
+    def converged(self):
+        if self.gradcosts and self.gradcosts[-1] <= self.tol:
+            self.reason = 'tol'
+        elif self.maxiter is not None and self.index >= self.maxiter:
+            self.reason = 'maxiter'
+        return self.reason is not None
+
+    def run(self, itj=None):
+        try:
+            if itj is not None and self.start(itj):
+                return self.tj
+
+            while not self.converged():
+                if self.step():
+                    break
+
+            return self.tj
+        finally:
+            self.close()
+
+    def close(self):
+        # shuts down the shooting workers of the system, if any; they
+        # are forked again if the optimization is stepped on
+        if getattr(self, 'nlsys', None) is not None:
+            self.nlsys.close()
+
+    def _checkpoint(self):
+        if self.checkpoint is not None:
+            self.save(self.checkpoint)
+
+    def save(self, path):
+        # Trajectory pickles without its interpolation objects, so this
+        # holds the per-point data of the iterate, its direction and the
+        # projection gains, plus the history of costs
+        tj = self.tj
+        state = {
+            'tlims': self.tlims,
+            'index': self.index,
+            'costs': self.costs,
+            'gradcosts': self.gradcosts,
+            'gamma': None if self.ls is None else self.ls.gamma,
+            'tj': tj,
+            'jumps': tj.jumps,
+            'direction': self.descdir.direction,
+            'gains': self.nlsys.regulator._Kt,
+            'xinit': self.nlsys.xinit,
+            'system': getattr(self.s, 'path', None),
+        }
+
+        # write to a temporary file first so that a crash while
+        # writing never leaves a broken checkpoint behind
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            pickle.dump(state, f, pickle.HIGHEST_PROTOCOL)
+        os.rename(tmp, path)
+
+    def resume(self, path):
+        # restore the state saved by save(), skipping the initial
+        # projection; run() then continues the iterations. self.s is
+        # used as is, see load_system() for getting it from the
+        # checkpoint instead of rebuilding it
+        with open(path, 'rb') as f:
+            state = pickle.load(f)
+
+        self.reset()
+        self.tlims = state['tlims']
+        self.index = state['index']
+        self.costs = state['costs']
+        self.gradcosts = state['gradcosts']
+
+        tj = state['tj']
+        tj.interpolate()
+        tj.tlims = self.tlims
+        tj.jumps = state['jumps']
+        self.tj = tj
+        self.trajectories.append(tj)
+
+        direction = state['direction']
+        direction.interpolate()
+        direction.tlims = self.tlims
+        self.descdir = _Restored(direction=direction)
+
+        nlsys = self.build_system(state['xinit'])
+        nlsys.lintraj = tj
+        gains = state['gains']
+        gains.interpolate()
+        nlsys.regulator = _Restored(_Kt=gains, K=gains.K, tlims=self.tlims)
+        self.nlsys = nlsys
+        self.cost = nlsys.build_cost(R=self.R, Q=self.Q, PT=self.PT)
+
+        if state['gamma'] is not None:
+            self.ls = LineSearch(self.cost, self.cost.grad,
+                                 alpha=state['gamma'])
+            self.ls.gamma = state['gamma']
+
+        return self
+
+    def _memory(self, stage):
+        # bytes held after a stage, by object and field
+        if not self.trackmemory:
+            return
+        if stage == 'project':
+            held = {'tj': profiling.trajectory_memory(self.tj),
+                    'regulator': profiling.solver_memory(
+                        self.nlsys.regulator)}
+        else:
+            held = {'direction': profiling.solver_memory(self.descdir)}
+        held['history'] = {'trajectories': profiling.nbytes(
+            self.trajectories)}
+        self.memory.append((self.index, stage, held))
+
+    def memory_report(self):
+        lines = ["%-5s %-10s %-32s %12s" % ('iter', 'stage', 'object',
+                                            'bytes')]
+        for (index, stage, held) in self.memory:
+            for obj in sorted(held):
+                for field in sorted(held[obj]):
+                    lines.append("%-5d %-10s %-32s %12d" %
+                                 (index, stage, obj + '.' + field,
+                                  held[obj][field]))
+        return "\n".join(lines)
+
+    def report(self):
+        lines = ["%-12s %6s %10s" % ('stage', 'calls', 'seconds')]
+        for k in self.stages:
+            calls, secs = self.timings[k]
+            lines.append("%-12s %6d %10.3f" % (k, calls, secs))
+        return "\n".join(lines)
+
+
+class _Restored(object):
+    # stands in for the solver objects (GradDirection, LQR) whose
+    # results were restored from a checkpoint
+
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+class _Stage(object):
+    # adds one call and its run time to a [calls, seconds] counter
+
+    def __init__(self, counter):
+        self.counter = counter
+
+    def __enter__(self):
+        self.start = time.time()
+
+    def __exit__(self, *args):
+        self.counter[0] += 1
+        self.counter[1] += time.time() - self.start
+
+
+def load_system(path):
+    """
+    the system a checkpoint written by TrajectoryOptimizer was made
+    with, loaded with export.load, or None if it was not a CompiledSys
+    (or its module is gone) and has to be built again
+    """
+    with open(path, 'rb') as f:
+        state = pickle.load(f)
+    module = state.get('system')
+    if module is None or not os.path.exists(module):
+        return None
+    return export.load(module)
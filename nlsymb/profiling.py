@@ -0,0 +1,263 @@
+# absolute, or 'import sys' would find nlsymb/sys.py
+from __future__ import absolute_import
+
+import sys
+import csv
+import json
+import time
+from functools import wraps
+from types import FunctionType, MethodType, BuiltinFunctionType
+
+import numpy as np
+
+# a registry of nested timings and call counts for the hot paths
+# (right hand sides, interpolation, lambdified calls, riccati solves,
+# projections, costs, line search trials).
+#
+# usage:
+#     profiling.enable()
+#     opt.run(itj)               # the optimizer marks every iteration
+#     print(profiling.report())
+#     profiling.dump('prof.json')  # or prof.csv
+#
+# stats are kept flat, keyed by the path of nested sections joined by
+# '/', e.g. 'project/rhs/lambdified.f'. times are inclusive. while
+# disabled (the default) section() hands back a shared no-op context
+# and profiled functions only pay for one flag check.
+#
+# nbytes(), trajectory_memory() and solver_memory() estimate the memory
+# held by trajectories and solvers, see TrajectoryOptimizer(memory=True).
+
+
+class _Registry(object):
+
+    def __init__(self):
+        self.enabled = False
+        self.reset()
+
+    def reset(self):
+        self.stats = {}
+        self.stack = []
+        self.marks = []
+
+
+_reg = _Registry()
+
+
+def enable():
+    _reg.enabled = True
+
+
+def disable():
+    _reg.enabled = False
+
+
+def enabled():
+    return _reg.enabled
+
+
+def reset():
+    _reg.reset()
+
+
+class _Section(object):
+    # adds one call and its run time to the stats of the current path
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        stack = _reg.stack
+        self.path = stack[-1] + '/' + self.name if stack else self.name
+        stack.append(self.path)
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *args):
+        delta = time.time() - self.start
+        _reg.stack.pop()
+        counter = _reg.stats.get(self.path)
+        if counter is None:
+            _reg.stats[self.path] = [1, delta]
+        else:
+            counter[0] += 1
+            counter[1] += delta
+
+
+class _NullSection(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+_null = _NullSection()
+
+
+def section(name):
+    # with section('riccati'): ...
+    return _Section(name) if _reg.enabled else _null
+
+
+def profiled(name):
+    # decorator, profiles every call of the function as section name
+    def decorate(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _reg.enabled:
+                return func(*args, **kwargs)
+            with _Section(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def wrap(name, func):
+    # profiled(name)(func) when enabled, func itself otherwise; for
+    # right hand sides func(t, x, ...) built per run in sysIntegrate,
+    # so that a disabled run pays nothing at all. the two explicit
+    # arguments are needed since f2py callbacks (vode) count them
+    if not _reg.enabled:
+        return func
+
+    def wrapper(t, x, *args):
+        with _Section(name):
+            return func(t, x, *args)
+    return wrapper
+
+
+def mark(label):
+    # snapshot of the totals so far, e.g. at the end of an iteration;
+    # iterations() returns what happened between consecutive marks
+    if _reg.enabled:
+        snap = {k: list(v) for (k, v) in _reg.stats.iteritems()}
+        _reg.marks.append((label, snap))
+
+
+def totals():
+    return {k: list(v) for (k, v) in _reg.stats.iteritems()}
+
+
+def iterations():
+    # [(label, {path: [calls, seconds]}), ...], one entry per mark
+    out = []
+    prev = {}
+    for (label, snap) in _reg.marks:
+        delta = {}
+        for (k, (calls, secs)) in snap.iteritems():
+            pc, ps = prev.get(k, (0, 0.0))
+            if calls > pc:
+                delta[k] = [calls - pc, secs - ps]
+        out.append((label, delta))
+        prev = snap
+    return out
+
+
+def report(stats=None):
+    # the nested sections as an indented table
+    stats = totals() if stats is None else stats
+    lines = ["%-40s %9s %10s %10s" % ('section', 'calls', 'seconds',
+                                      'per call')]
+    for path in sorted(stats, key=lambda p: p.split('/')):
+        calls, secs = stats[path]
+        depth = path.count('/')
+        name = '  ' * depth + path.rsplit('/', 1)[-1]
+        lines.append("%-40s %9d %10.4f %10.2e" %
+                     (name, calls, secs, secs / calls))
+    return "\n".join(lines)
+
+
+def dump(path):
+    # writes the totals and the per iteration breakdown, as csv if path
+    # ends in .csv and json otherwise
+    if path.endswith('.csv'):
+        with open(path, 'wb') as f:
+            writer = csv.writer(f)
+            writer.writerow(['iteration', 'section', 'calls', 'seconds'])
+            for (label, stats) in iterations():
+                for k in sorted(stats):
+                    writer.writerow([label, k] + stats[k])
+            for k in sorted(_reg.stats):
+                writer.writerow(['total', k] + _reg.stats[k])
+    else:
+        out = {'totals': totals(),
+               'iterations': [{'iteration': label, 'sections': stats}
+                              for (label, stats) in iterations()]}
+        with open(path, 'w') as f:
+            json.dump(out, f, indent=1, sort_keys=True)
+
+
+def _base(arr):
+    while isinstance(arr.base, np.ndarray):
+        arr = arr.base
+    return arr
+
+
+def nbytes(obj, seen=None):
+    # estimate of the bytes held by obj and everything it refers to;
+    # arrays sharing a buffer and objects reached twice count once when
+    # the same seen set is passed. functions are not followed since
+    # their closures lead back to the solvers that own them
+    seen = set() if seen is None else seen
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+
+    if isinstance(obj, np.ndarray):
+        base = _base(obj)
+        if base is not obj:
+            if id(base) in seen:
+                return 0
+            seen.add(id(base))
+        return base.nbytes
+    if isinstance(obj, (FunctionType, MethodType, BuiltinFunctionType,
+                        type)):
+        return 0
+
+    size = sys.getsizeof(obj)
+    if isinstance(obj, (list, tuple, set)):
+        size += sum(nbytes(v, seen) for v in obj)
+    elif isinstance(obj, dict):
+        size += sum(nbytes(v, seen) for v in obj.itervalues())
+    elif hasattr(obj, '__dict__'):
+        size += nbytes(obj.__dict__, seen)
+    return size
+
+
+def trajectory_memory(tj):
+    # {field: bytes} for the per point lists of a Trajectory, with the
+    # interpolation objects built from them as 'field.interp'; the two
+    # are counted separately since interpolate() copies the data
+    out = {}
+    for k in tj.__dict__.keys():
+        if k[0] is '_' and isinstance(getattr(tj, k), list):
+            out[k[1:]] = nbytes(getattr(tj, k))
+            if k[1:] in tj.__dict__:
+                out[k[1:] + '.interp'] = nbytes(getattr(tj, k[1:]))
+    return out
+
+
+def solver_memory(obj, seen=None):
+    # {name: bytes} for the Trajectory objects a solver (LQR, LQ,
+    # GradDirection, ...) holds, and its other arrays as 'arrays'
+    from nlsymb import Trajectory
+
+    seen = set() if seen is None else seen
+    seen.add(id(obj))
+    out = {}
+    arrays = 0
+    for (k, v) in obj.__dict__.iteritems():
+        if isinstance(v, Trajectory):
+            out[k] = sum(trajectory_memory(v).values())
+        elif isinstance(v, np.ndarray):
+            arrays += v.nbytes
+        elif hasattr(v, '__dict__') and not callable(v) and \
+                id(v) not in seen:
+            # nested solvers, e.g. the LQ of a descent direction
+            for (kk, vv) in solver_memory(v, seen).iteritems():
+                out[k + '.' + kk] = vv
+    if arrays:
+        out['arrays'] = arrays
+    return out
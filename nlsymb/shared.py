@@ -0,0 +1,137 @@
+import os
+import tempfile
+
+from nlsymb import np, Trajectory, interxpolate
+
+# Trajectory data in shared memory, for handing trajectories (references,
+# gain schedules such as LQR._Kt, results) to and from worker processes.
+#
+#     handle = share(tj)          # copies the points into a buffer once
+#     pool.apply_async(work, (handle,))
+#     ...
+#     def work(handle):
+#         tj = handle.attach()    # maps the buffer, no copy
+#
+# the buffer is a file in SHMDIR (/dev/shm where there is one, so it
+# never touches a disk) mapped with np.memmap; a handle pickles to just
+# the file name and the layout of the arrays in it. attach() makes a
+# Trajectory whose point lists and interpolants are views of the mapped
+# arrays. the interpolants are linear interp1d on the sorted points with
+# copy=False, the same function 'slinear' gives but without the spline
+# coefficients it copies the data into.
+#
+# whoever is done with the buffer last calls unlink(); the processes that
+# already mapped it keep their mapping.
+
+SHMDIR = os.environ['NLSYMB_SHM'] if 'NLSYMB_SHM' in os.environ \
+    else '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+
+# arrays start on multiples of this many bytes in the buffer
+ALIGN = 64
+
+
+def share(tj):
+    # a SharedTrajectory holding the points of tj
+    return SharedTrajectory(tj)
+
+
+def _aligned(nbytes):
+    return -(-nbytes // ALIGN) * ALIGN
+
+
+def _view(buf, offset, shape, dtype):
+    dtype = np.dtype(dtype)
+    size = int(np.prod(shape)) * dtype.itemsize
+    return buf[offset:offset + size].view(dtype).reshape(shape)
+
+
+class SharedTrajectory(object):
+# a handle to the points of a Trajectory in a shared memory buffer
+
+    """
+    what we need:
+     tj : the Trajectory to share; every point list (t, x, u, ...) has
+            to hold values of one shape
+
+    the small attributes of tj (tlims, jumps, feasible, stats, ...) are
+    pickled along with the handle; callables (interpolants, lambdas)
+    are not, attach() rebuilds the interpolants.
+    """
+
+    def __init__(self, tj):
+        names = sorted(k[1:] for (k, v) in tj.__dict__.iteritems()
+                       if k[0] is '_' and isinstance(v, list))
+        t = np.asarray(tj._t, dtype=float)
+        # sorted once here, so that attach() need not copy to sort
+        order = np.argsort(t, kind='mergesort')
+
+        arrays = {}
+        for name in names:
+            arr = np.asarray(getattr(tj, '_' + name))
+            if arr.dtype == object or len(arr) != len(t):
+                raise Exception("cannot share field %s: its points are not "
+                                "arrays of one shape, one per time" % name)
+            arrays[name] = arr[order] if len(arr) else arr
+
+        self.layout = []
+        offset = 0
+        for name in names:
+            arr = arrays[name]
+            self.layout.append((name, offset, arr.shape, arr.dtype.str))
+            offset += _aligned(arr.nbytes)
+
+        fd, self.path = tempfile.mkstemp(prefix='nlsymb_', suffix='.traj',
+                                         dir=SHMDIR)
+        os.close(fd)
+        buf = np.memmap(self.path, dtype=np.uint8, mode='w+',
+                        shape=(max(offset, 1),))
+        for (name, offset, shape, dtype) in self.layout:
+            _view(buf, offset, shape, dtype)[...] = arrays[name]
+        buf.flush()
+        del buf
+
+        self.meta = {k: v for (k, v) in tj.__dict__.iteritems()
+                     if k[0] is not '_' and not callable(v)}
+
+    def attach(self, writable=False):
+        """
+        a Trajectory on the shared arrays, with its interpolants built.
+        read only unless writable, in which case writes to the points
+        are seen by every process that attached the buffer
+        """
+        buf = np.memmap(self.path, dtype=np.uint8,
+                        mode='r+' if writable else 'r')
+        arrays = {name: _view(buf, offset, shape, dtype)
+                  for (name, offset, shape, dtype) in self.layout}
+
+        tj = Trajectory(*[name for name in arrays if name != 't'])
+        for (name, arr) in arrays.iteritems():
+            setattr(tj, '_' + name, list(arr))
+        tj.__dict__.update(self.meta)
+
+        t = arrays['t']
+        if len(t) > 1:
+            for (name, arr) in arrays.iteritems():
+                if name != 't':
+                    setattr(tj, name, interxpolate(t, arr, axis=0,
+                                                   kind='linear', copy=False,
+                                                   assume_sorted=True))
+        return tj
+
+    def nbytes(self):
+        return os.path.getsize(self.path)
+
+    def unlink(self):
+        # removes the buffer; attached trajectories stay valid
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.unlink()
+
+    def __repr__(self):
+        return "SharedTrajectory(%s, %s)" % (
+            self.path, ", ".join(name for (name, o, s, d) in self.layout))
@@ -0,0 +1,260 @@
+import multiprocessing
+
+from nlsymb import np, sysIntegrate, IntegrationStats, profiling, matmult
+
+from .lqr import Controller, _expm
+from .shared import share
+
+# multiple shooting for System.integrate: the horizon is split into
+# segments that are integrated in parallel, each from the state a guess
+# trajectory has at its start. after every pass the starts of all the
+# segments are updated at once, by newton's method on the defects (a
+# segment not starting where the one before it ends): with the
+# transition matrix Phi of the closed loop over each segment, linearized
+# along what was just integrated, the start of segment k moves to
+#     s_k = e_(k-1) + Phi_(k-1) (s_(k-1)' - s_(k-1))
+# where e is the end a segment reached and s' its updated start, from
+# the first segment (whose start is the true initial state) on. every
+# segment whose start moved is integrated again, all in parallel; the
+# number of passes does not grow with the number of segments, two or
+# three do for the line search iterates of an optimization. if defects
+# are left after maxpasses, the segments left are chained one after the
+# other in this process instead.
+#
+# the workers are forked once per System (see System.workers) and keep
+# the copy of it they were forked with; the right hand side closes over
+# the SymSys and cannot be pickled. what changes from one projection to
+# the next is the controller, which is sent as shared trajectories (its
+# reference and gain schedule, see nlsymb.shared) and rebuilt by the
+# workers. a controller that cannot be sent that way is shot serially in
+# this process, and so is everything in a daemonic process (e.g. a
+# MultiStart worker), which may not have children.
+
+# in a worker: the System it was forked with, and the job (by the name
+# of its reference buffer) whose controller it rebuilt last
+_worker = {}
+
+
+def boundaries(tlims, segments):
+    # segments + 1 times splitting tlims into equal segments
+    return np.linspace(tlims[0], tlims[1], segments + 1)
+
+
+def parallel():
+    # False in daemonic processes, which cannot fork workers
+    return not multiprocessing.current_process().daemon
+
+
+class Workers(object):
+# a pool of processes forked with a System, reused by every shoot()
+
+    def __init__(self, system, processes):
+        self.processes = processes
+        self.pool = multiprocessing.Pool(processes, _init, (system,))
+
+    def map(self, func, args):
+        return self.pool.map(func, args)
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+
+
+def _init(system):
+    _worker.clear()
+    _worker['system'] = system
+
+
+def shoot(system, guess, use_jac=False, stats=None, maxpasses=3):
+    """
+    what we need:
+     system : the System to integrate, with its closed loop controller
+            set; its tlims, xinit, segments and shoottol are used
+     guess(t) : a state near the solution at t, e.g. Trajectory.x of
+            the trajectory being projected
+     use_jac : optional, as for System.integrate
+     stats : optional, an IntegrationStats the work of all segments is
+            added to (its wall time is then summed over the segments)
+     maxpasses : optional, parallel passes before the segments still
+            left are integrated serially, defaults to 3
+
+    the segments go to system.workers() if it has any, and are
+    integrated in this process otherwise.
+
+    returns (t, x, jumps, passes): the trajectory over the whole horizon
+    as sysIntegrate returns it, and the number of passes it took.
+    """
+    segments = system.segments
+    tol = system.shoottol
+    bounds = boundaries(system.tlims, segments)
+    starts = [np.array(system.xinit, dtype=float)] + \
+        [np.array(guess(t), dtype=float) for t in bounds[1:-1]]
+
+    local = {'bounds': bounds, 'exact': system.exact,
+             'integrands': system._integrands(use_jac)}
+    jac = _jacobian(system)
+    job, handles = None, []
+    workers = system.workers()
+    if workers is not None:
+        spec = _pack(system.ufun)
+        if spec is not None:
+            handles = [h for h in spec.values() if h is not None]
+            job = dict(spec, bounds=bounds, use_jac=use_jac,
+                       exact=system.exact)
+
+    results = [None] * segments
+    todo = range(segments)
+    passes = 0
+    try:
+        while todo and passes < maxpasses:
+            passes += 1
+            with profiling.section('shooting.pass'):
+                if job is None:
+                    out = [_segment(local, k, starts[k]) for k in todo]
+                else:
+                    out = workers.map(_remote,
+                                      [(job, k, starts[k]) for k in todo])
+            for (k, res) in zip(todo, out):
+                results[k] = res
+                if stats is not None:
+                    stats += res[3]
+
+            # newton update of the starts, redo every segment whose
+            # start moved
+            todo = []
+            delta = None
+            for k in range(1, segments):
+                (tk, xk, jk, sk) = results[k - 1]
+                new = np.array(xk[-1], dtype=float)
+                if delta is not None:
+                    new += matmult(_transition(jac, tk, xk, jk), delta)
+                if np.abs(new - starts[k]).max() > \
+                        tol * (1 + np.abs(new).max()):
+                    delta = new - starts[k]
+                    starts[k] = new
+                    todo.append(k)
+                else:
+                    delta = None
+
+        if todo:
+            # serial from the first segment left, each from the end of
+            # the one before, so that no defects remain
+            passes += 1
+            with profiling.section('shooting.serial'):
+                for k in range(todo[0], segments):
+                    starts[k] = results[k - 1][1][-1]
+                    results[k] = _segment(local, k, starts[k])
+                    if stats is not None:
+                        stats += results[k][3]
+    finally:
+        for h in handles:
+            h.unlink()
+
+    # stitch; the end point of a segment is the start of the next one
+    t, x, jumps = [], [], []
+    for (k, (tk, xk, jk, sk)) in enumerate(results):
+        last = k == segments - 1
+        t.extend(tk if last else tk[:-1])
+        x.extend(xk if last else xk[:-1])
+        jumps.extend(jk)
+    return (t, x, jumps, passes)
+
+
+def _jacobian(system):
+    # the jacobian of the closed loop right hand side, dfdx - dfdu K for
+    # a Controller (or any ufun with a gain K(t)); None if the System
+    # has no dfdx, the transition matrices are the identity then
+    if system.dfdx is None:
+        return None
+    ufun = system.ufun
+    if ufun is None:
+        return lambda t, x: system.dfdx(t, x)
+    K = getattr(ufun, 'K', None)
+
+    def jac(t, x):
+        u = ufun(t, x)
+        A = system.dfdx(t, x, u)
+        if K is not None:
+            A = A - matmult(system.dfdu(t, x, u), K(t))
+        return A
+    return jac
+
+
+def _transition(jac, t, x, jumps):
+    # transition matrix of a segment as integrated, t and x its points:
+    # the closed loop is linearized at them and taken as constant (the
+    # mean of both ends) over every step, the jumps applied at the end
+    # of the step they fall in, as in lqr.GradDirection's exact mode
+    n = len(x[0])
+    if jac is None:
+        return np.eye(n)
+    A = np.array([jac(tt, xx) for (tt, xx) in zip(t, x)])
+    h = np.diff(t)
+    steps = _expm(h[:, None, None] * (A[:-1] + A[1:]) / 2)
+
+    celljumps = {}
+    for (tj, fj) in jumps:
+        k = np.searchsorted(t, tj) - 1
+        if 0 <= k < len(h):
+            celljumps.setdefault(k, []).append(fj)
+
+    Phi = np.eye(n)
+    for k in range(len(h)):
+        Phi = matmult(steps[k], Phi)
+        for fj in celljumps.get(k, []):
+            Phi = Phi + matmult(fj, Phi)
+    return Phi
+
+
+def _pack(ufun):
+    # the controller as shared trajectories, None unless it is a plain
+    # Controller given by its reference and (optionally) gain schedule
+    if type(ufun) is not Controller or ufun.feedforward or \
+            (ufun.feedback and ufun.schedule is None):
+        return None
+
+    spec = {'reference': None, 'schedule': None}
+    try:
+        spec['reference'] = share(ufun.ref)
+        if ufun.schedule is not None:
+            spec['schedule'] = share(ufun.schedule)
+    except Exception:
+        for h in spec.values():
+            if h is not None:
+                h.unlink()
+        return None
+    return spec
+
+
+def _remote(args):
+    # a segment in a worker, rebuilding the controller of a new job
+    job, k, x0 = args
+    name = job['reference'].path
+    if _worker.get('job') != name:
+        system = _worker['system']
+        ref = job['reference'].attach()
+        kw = {'reference': ref}
+        if job['schedule'] is not None:
+            sched = job['schedule'].attach()
+            kw.update(K=sched.K, schedule=sched)
+        system.ufun = Controller(**kw)
+        _worker['integrands'] = system._integrands(job['use_jac'])
+        _worker['job'] = name
+
+    return _segment({'bounds': job['bounds'], 'exact': job['exact'],
+                     'integrands': _worker['integrands']}, k, x0)
+
+
+def _segment(job, k, x0):
+    # integrate segment k from x0; all but the last one end exactly on
+    # the next boundary so that their ends can be compared, the last
+    # one too if the System is exact
+    bounds = job['bounds']
+    func, intkw = job['integrands']
+    last = k == len(bounds) - 2
+
+    stats = IntegrationStats()
+    (t, x, jumps) = sysIntegrate(func, x0, tlims=(bounds[k], bounds[k + 1]),
+                                 exact=job['exact'] or not last,
+                                 stats=stats, **intkw)
+    return (t, [np.asarray(xx) for xx in x], jumps, stats)
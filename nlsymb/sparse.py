@@ -0,0 +1,167 @@
+import numpy as np
+
+# structural sparsity of the jacobians of a SymSys, and the products the
+# riccati solvers and integrators use with it.
+#
+# a Pattern is the mask of entries of a matrix that are not identically
+# zero, e.g. SymSys.dfdx_pattern for A(t) = dfdx(t, x(t), u(t)). products
+# with a matrix that has the pattern only touch its nonzero rows and
+# columns, which pays off once the zero blocks are large (the upper half
+# of B(t) of a mechanical system is zero, and so are the columns of A(t)
+# for cyclic coordinates). rows whose one nonzero is the constant 1, the
+# [0 I] upper half of A(t) = [0 I; * *], are not multiplied at all but
+# copied (or added, for M.T X). for small matrices, and for
+# matrix-vector products of any size, a plain np.dot is faster (the
+# indexing costs a few microseconds), so the structured products are
+# only used for matrix products with matrices above MINSIZE entries.
+#
+# band() and hint() give the band for sysIntegrate(band=...). a band
+# makes vode use newton iterations with a banded jacobian instead of
+# functional iterations, which only pays off for stiff systems; and it
+# has to be the band of the jacobian of what is integrated, for a closed
+# loop A - B K rather than the pattern of A alone.
+
+# smallest matrix, in entries, that the structured products are used for;
+# measured against np.dot for the A^T P and B^T P of the riccati
+# equations of [0 I; * *] systems, where both break even at 2dim = 20
+MINSIZE = 400
+
+# largest fraction of the matrix that the nonzero block may cover for
+# the structured products to be used
+MAXFILL = 0.5
+
+
+class Pattern(object):
+# the structural nonzeros of a matrix
+
+    """
+    what we need:
+     mask : boolean array, True where the matrix may be nonzero
+     unit : optional, boolean array, True where the matrix is the
+            constant 1
+    """
+
+    def __init__(self, mask, unit=None):
+        self.mask = np.array(mask, dtype=bool)
+        self.shape = self.mask.shape
+        self.nnz = int(self.mask.sum())
+        self.unit = np.zeros(self.shape, dtype=bool) if unit is None \
+            else np.array(unit, dtype=bool) & self.mask
+
+        # rows that select one column, M[i] = e_j
+        single = self.mask.sum(axis=1) == 1
+        self.sel = np.flatnonzero(single & self.unit.any(axis=1))
+        self.csel = self.unit[self.sel].argmax(axis=1)
+        self._sel, self._csel = _index(self.sel), _index(self.csel)
+        self._unique = len(set(self.csel)) == len(self.csel)
+
+        # the block of the other rows and the columns with any nonzero
+        # in them
+        rest = self.mask.copy()
+        rest[self.sel] = False
+        self.rows = np.flatnonzero(rest.any(axis=1))
+        self.cols = np.flatnonzero(rest.any(axis=0))
+        # slices where they are contiguous, which is the usual case
+        # (the velocity rows) and much cheaper to index with
+        self._rows, self._cols = _index(self.rows), _index(self.cols)
+        if isinstance(self._rows, slice) and isinstance(self._cols, slice):
+            self._block = (self._rows, self._cols)
+        else:
+            self._block = np.ix_(self.rows, self.cols)
+
+        size = self.mask.size
+        fill = len(self.rows) * len(self.cols) / float(max(size, 1))
+        self.structured = size >= MINSIZE and fill <= MAXFILL
+
+    @classmethod
+    def of(cls, expr):
+        # the pattern of a tensor of sympy expressions; an entry counts
+        # as zero only if it is structurally zero
+        expr = np.array(expr, dtype=object)
+        return cls(np.reshape([e != 0 for e in expr.flat], expr.shape),
+                   np.reshape([e == 1 for e in expr.flat], expr.shape))
+
+    def __or__(self, other):
+        # the pattern of a matrix that is either one
+        return Pattern(self.mask | other.mask, self.unit & other.unit)
+
+    def __eq__(self, other):
+        return isinstance(other, Pattern) and \
+            self.shape == other.shape and (self.mask == other.mask).all() \
+            and (self.unit == other.unit).all()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return "Pattern(%dx%d, nnz=%d)" % (self.shape + (self.nnz,))
+
+    def band(self):
+        # (lband, uband): M[i, j] == 0 unless -lband <= j - i <= uband
+        i, j = np.nonzero(self.mask)
+        if not len(i):
+            return (0, 0)
+        return (max(int((i - j).max()), 0), max(int((j - i).max()), 0))
+
+    def hint(self):
+        # band() if it is narrower than the full matrix, None otherwise
+        n = self.shape[0]
+        lband, uband = self.band()
+        if self.shape[0] != self.shape[1] or lband + uband + 1 >= n:
+            return None
+        return (lband, uband)
+
+    def dot(self, M, X):
+        # M X, for M with this pattern
+        X = np.asarray(X)
+        if not self.structured or X.ndim < 2:
+            return np.dot(M, X)
+        out = np.zeros((self.shape[0],) + X.shape[1:])
+        out[self._rows] = np.dot(M[self._block], X[self._cols])
+        out[self._sel] = X[self._csel]
+        return out
+
+    def tdot(self, M, X):
+        # M.T X, for M with this pattern
+        X = np.asarray(X)
+        if not self.structured or X.ndim < 2:
+            return np.dot(M.T, X)
+        out = np.zeros((self.shape[1],) + X.shape[1:])
+        out[self._cols] = np.dot(M[self._block].T, X[self._rows])
+        if self._unique:
+            out[self._csel] += X[self._sel]
+        else:
+            np.add.at(out, self.csel, X[self.sel])
+        return out
+
+
+def _index(idx):
+    # a slice for a contiguous run of indices, the indices otherwise
+    if len(idx) and idx[-1] - idx[0] + 1 == len(idx):
+        return slice(int(idx[0]), int(idx[-1]) + 1)
+    return idx
+
+
+def dot(pattern, M, X):
+    # M X, structured if a pattern of M is known
+    return np.dot(M, X) if pattern is None else pattern.dot(M, X)
+
+
+def tdot(pattern, M, X):
+    # M.T X, structured if a pattern of M is known
+    return np.dot(M.T, X) if pattern is None else pattern.tdot(M, X)
+
+
+def banded(jac, lband, uband, n):
+    # jac(t, x, ...) returning the full (n, n) jacobian, as the packed
+    # band vode expects once lband/uband are set: J[i - j + uband, j]
+    i, j = np.indices((n, n))
+    keep = (i - j <= lband) & (j - i <= uband)
+    ii, jj = i[keep], j[keep]
+    rows = ii - jj + uband
+
+    def packed(t, x, *args):
+        out = np.zeros((lband + uband + 1, n))
+        out[rows, jj] = np.asarray(jac(t, x, *args))[ii, jj]
+        return out
+    return packed
@@ -1,14 +1,21 @@
 from nlsymb import deepcopy, np, sym, scipy, matmult,\
-        interxpolate, sysIntegrate, Trajectory
+        interxpolate, sysIntegrate, Trajectory, IntegrationStats, \
+        profiling, LazyModule, LazyAttribute, sparse
 
-import tensor as tn
-from sympy import Symbol as S
+import multiprocessing
 from scipy.integrate import trapz
 
 #from nlsymb import matmult, interxpolate, sysIntegrate, Trajectory
 from lqr import LQR, Controller
+import shooting
 from timeout import timeout
-from IPython.core.debugger import Tracer
+
+# symbolic modelling, only loaded once a SymSys is built
+tn = LazyModule('nlsymb.tensor')
+
+
+# sympy.Symbol, as 'from sympy import Symbol as S' gave it
+S = LazyAttribute(sym, 'Symbol')
 
 class System(object):
 
@@ -37,6 +44,38 @@ class System(object):
         self.dfdu = kwargs['dfdu'] if 'dfdu' in keys else None
         self.phi = kwargs['phi'] if 'phi' in keys else None
         self.delf = kwargs['delf'] if 'delf' in kwargs else None
+        # a lqr.WarmStart, to reuse the regulator across projections
+        self.warmstart = kwargs['warmstart'] if 'warmstart' in kwargs \
+            else None
+        # sparse.Pattern of dfdx and dfdu, e.g. SymSys.dfdx_pattern, for
+        # structured riccati products
+        self.Apattern = kwargs['Apattern'] if 'Apattern' in kwargs \
+            else None
+        self.Bpattern = kwargs['Bpattern'] if 'Bpattern' in kwargs \
+            else None
+        # (lband, uband) of the jacobian of the integrated right hand
+        # side, passed on to sysIntegrate. not taken from Apattern: the
+        # closed loop jacobian A - B K is banded only if K is, and a band
+        # switches vode to newton iterations, which only pays off for
+        # stiff systems
+        self.band = kwargs['band'] if 'band' in kwargs else None
+        # end every integration exactly at tlims[1] (see sysIntegrate),
+        # also when the guard is crossed just past it
+        self.exact = kwargs['exact'] if 'exact' in kwargs else False
+        # an object with dfdx_batch and dfdu_batch (a SymSys), to
+        # linearize along a whole trajectory in one call each
+        self.batch = kwargs['batch'] if 'batch' in kwargs else None
+        # multiple shooting, see nlsymb.shooting: with segments > 1 a
+        # projection integrates that many segments in parallel worker
+        # processes (processes, default one per cpu), stitched once
+        # their defects are below shoottol. the workers are forked on
+        # first use and kept until close()
+        self.segments = kwargs['segments'] if 'segments' in kwargs else 1
+        self.processes = kwargs['processes'] if 'processes' in kwargs \
+            else None
+        self.shoottol = kwargs['shoottol'] if 'shoottol' in kwargs \
+            else 1e-6
+        self._workers = None
 
         if self.ufun is None:
             self.dimu = 0
@@ -60,35 +99,72 @@ class System(object):
         else:
             print("Nothing to reset to. Not doing anything.")
 
+    def _integrands(self, use_jac=False):
+        # the right hand side under the current controller, and the rest
+        # of the sysIntegrate arguments
+        if self.ufun is not None:
+            func = lambda t, x: self.f(t, x, self.ufun(t, x))
+            dfdx = lambda t, x: self.dfdx(t, x, self.ufun(t, x))
+        else:
+            func = self.f
+            dfdx = self.dfdx
+
+        intkw = {'phi': self.phi, 'jac': dfdx if use_jac else None,
+                 'band': self.band}
+        if self.delf is not None:
+            intkw['delfunc'] = lambda t, x: self.delf(t, x, self.ufun(t, x))
+        return func, intkw
+
+    def workers(self):
+        # the shooting workers, forked on first use; None if segments
+        # are to be integrated in this process (processes=1, or this is
+        # a daemonic process that may not have children)
+        if self.processes == 1 or not shooting.parallel():
+            return None
+        if self._workers is None:
+            processes = self.processes or multiprocessing.cpu_count()
+            self._workers = shooting.Workers(self,
+                                             min(processes, self.segments))
+        return self._workers
+
+    def close(self):
+        # shuts the shooting workers down, if there are any
+        if self._workers is not None:
+            self._workers.close()
+            self._workers = None
+
     # TODO make sure this works in all combinations of linearization
     # or not, and controlled or not;
     # Major cleanup needed.
+    @profiling.profiled('integrate')
     def integrate(self, use_jac=False, linearize=True,
                   interpolate=True, **kwargs):
         keys = kwargs.keys()
         xinit = kwargs['xinit'] if 'xinit' in keys else self.xinit
+        # guess(t), states near the result to start the shooting
+        # segments from; integrates in one run without it
+        guess = kwargs['guess'] if 'guess' in keys else None
         lin = linearize
         interp = interpolate
 
         if self.ufun is not None:
-            func = lambda t, x: self.f(t, x, self.ufun(t, x))
             dfdx = lambda t, x: self.dfdx(t, x, self.ufun(t, x))
             dfdu = lambda t, x: self.dfdu(t, x, self.ufun(t, x))
         else:
-            func = self.f
             dfdx = self.dfdx
             dfdu = self.dfdu
 
-        jac = dfdx if use_jac else None
-
         #Tracer()()
-        if self.delf is not None:
-            delfunc = lambda t, x: self.delf(t, x, self.ufun(t, x))
-            (t, x, jumps) = sysIntegrate(func, self.xinit, tlims=self.tlims,
-                                     phi=self.phi, jac=jac, delfunc=delfunc)
+        stats = IntegrationStats()
+        passes = None
+        if self.segments > 1 and guess is not None:
+            (t, x, jumps, passes) = shooting.shoot(self, guess, use_jac,
+                                                  stats=stats)
         else:
+            func, intkw = self._integrands(use_jac)
             (t, x, jumps) = sysIntegrate(func, self.xinit, tlims=self.tlims,
-                                     phi=self.phi, jac=jac)
+                                         exact=self.exact, stats=stats,
+                                         **intkw)
 
 
         #Tracer()()
@@ -100,14 +176,21 @@ class System(object):
             components.append('B')
 
         traj = Trajectory(*components)
-        for (tt, xx) in zip(t, x):
+        us = [self.ufun(tt, xx) for (tt, xx) in zip(t, x)] \
+            if 'u' in components else None
+        As = Bs = None
+        if lin and self.batch is not None and us is not None:
+            As = self.batch.dfdx_batch(t, x, us)
+            Bs = self.batch.dfdu_batch(t, x, us)
+
+        for (k, (tt, xx)) in enumerate(zip(t, x)):
             names = {'x': xx}
             if 'u' in components:
-                names['u'] = self.ufun(tt, xx)
+                names['u'] = us[k]
             if 'A' in components:
-                names['A'] = dfdx(tt, xx)
+                names['A'] = As[k] if As is not None else dfdx(tt, xx)
             if 'B' in components:
-                names['B'] = dfdu(tt, xx)
+                names['B'] = Bs[k] if Bs is not None else dfdu(tt, xx)
 
             traj.addpoint(tt, **names)
 
@@ -119,15 +202,25 @@ class System(object):
         if lin:
             print("linearizing...")
             self.lintraj = traj
-            self.regulator = LQR(self.tlims, traj.A, traj.B)
-            self.regulator.solve()
+            patterns = {'Apattern': self.Apattern,
+                        'Bpattern': self.Bpattern}
+            if self.warmstart is not None:
+                self.regulator = self.warmstart.riccati(self.tlims,
+                                                        traj.A, traj.B,
+                                                        **patterns)
+            else:
+                self.regulator = LQR(self.tlims, traj.A, traj.B, **patterns)
+                self.regulator.solve()
 
         traj.feasible = True
         traj.tlims = self.tlims
         traj.jumps = jumps
+        traj.stats = stats
+        traj.passes = passes
         return traj
 
     @timeout(30000)
+    @profiling.profiled('project')
     def project(self, traj, tlims=None, lin=False):
         if traj.feasible:
             return traj
@@ -141,17 +234,18 @@ class System(object):
             # print("regular projection")
             ltj = self.lintraj
             reg = self.regulator
-            control = Controller(reference=traj, K=reg.K)
+            control = Controller(reference=traj, K=reg.K,
+                                 schedule=reg._Kt)
 
             self.set_u(control)
             # print(lin)
-            return self.integrate(linearize=lin)
+            return self.integrate(linearize=lin, guess=traj.x)
         else:
             print("integrating and linearizing for the first time")
             control = Controller(reference=traj)
             
             self.set_u(control)
-            nutraj = self.integrate(linearize=True)
+            nutraj = self.integrate(linearize=True, guess=traj.x)
             
             return self.project(nutraj, tlims=tlims, lin=lin)
 
@@ -168,6 +262,7 @@ class CostFunction(object):
         self.PT = PT
         self.projector = (lambda x: x) if projector is None else projector
 
+    @profiling.profiled('cost')
     def __call__(self, traj, tspace=False):
         tj = traj if traj.feasible or tspace else self.projector(traj) 
         ta, tb = tj.tlims
@@ -206,6 +301,10 @@ class SymSys(object):
     def __init__(self, si=0, **kwargs):
         # this is the special index: z[si] = phi(z)
         self.si = si
+        # invert the (coupled, configuration dependent) blocks of the
+        # mass matrix and of dP numerically when evaluating, see tn.inv,
+        # and keep the projection opaque, see tn.Opaque
+        self.numeric = kwargs['numeric'] if 'numeric' in kwargs else False
         self.t = S('t')
         n = self.dim
 
@@ -219,7 +318,8 @@ class SymSys(object):
         self._dOhm = tn.diff(self._Ohm, self.z)
         self._dPsi = tn.diff(self._Psi, self.q)
         
-        self.Mz = matmult(self._dOhm.T, self.Mq, self._dOhm)
+        self.Mz = tn.einsum('ji,jk,kl->il', self._dOhm,
+                            tn.subs(self.Mq, self.qtoz), self._dOhm)
         self.Mzi = self._Mzi() 
 
         self.dMq = tn.diff(self.Mq, self.q)
@@ -232,8 +332,12 @@ class SymSys(object):
         self.dVz = tn.diff(self.Vz, self.z)
 
         self._P = self._makeP(self.k)
+        if self.numeric:
+            # composed into the minus field (through ztozz) and
+            # differentiated there, so kept as calls
+            self._P = tn.Opaque(self._P, self.z).expr
         self._dP = tn.diff(self._P, self.z)
-        self._dPi = np.array(sym.Matrix(self._dP).inv())
+        self._dPi = tn.inv(self._dP, self.z if self.numeric else None)
 
         self.ztozz = {self.z[i]: self._P[i] for i in range(self.dim)}
         self.Mzzi = tn.subs(self.Mzi, self.ztozz)
@@ -255,6 +359,12 @@ class SymSys(object):
         self._dfum = tn.SymExpr(self._fmins.diff(self.u))
         self._dfum.callable(*params)
 
+        # structural nonzeros of the jacobians, over both fields
+        self.dfdx_pattern = sparse.Pattern.of(self._dfxp.expr) | \
+            sparse.Pattern.of(self._dfxm.expr)
+        self.dfdu_pattern = sparse.Pattern.of(self._dfup.expr) | \
+            sparse.Pattern.of(self._dfum.expr)
+
         self._ohm = tn.lambdify(self.z, self._Ohm)
         self._psi = tn.lambdify(self.q, self._Psi)
 
@@ -284,26 +394,23 @@ class SymSys(object):
 
     # Mz inverse
     def _Mzi(self):
-        dpsi = np.empty_like(self._dPsi)
-        for i in range(self.dim):
-            for j in range(self.dim):
-                dpsi[i, j] = self._dPsi[i, j].subs(self.alltoz,
-                                                   simultaneous=True)
-        return matmult(dpsi, self.Mqi, dpsi.T)
+        dpsi = tn.subs(self._dPsi, self.alltoz)
+        return tn.einsum('ij,jk,lk->il', dpsi, tn.subs(self.Mqi, self.qtoz),
+                         dpsi)
 
     # \dot{x}=f(x)
     def _makefp(self, params):
         zdot = self.x[self.dim:]
         out = np.concatenate((zdot,
-                              np.dot(self.Mzi,
+                              tn.einsum('ij,j->i', self.Mzi,
                                      - tn.einsum(
                                          'i,ijk,k', zdot, self.dMz, zdot)
                                      + tn.einsum(
                                          'i,ikl,k', zdot, self.dMz, zdot) / 2
                                      + self.dVz)
-                              + matmult(
+                              + tn.einsum('ij,jk,k->i',
                                   tn.subs(self._dPsi, self.qtoz),
-                                  self.Mqi,  # here we might need subs
+                                  tn.subs(self.Mqi, self.qtoz),
                                   self.u)
                               ))
 
@@ -317,16 +424,26 @@ class SymSys(object):
         OhmI = tn.subs(self._dPsi, zip(self.q, OhmP))
 
         zz = self._P
-        zzdot = np.dot(self._dP, zdot)
-
-        out = -tn.einsum('i,ijk,k', zzdot, self.dMzz, zzdot) \
-            + tn.einsum('i,ikj,k', zzdot, self.dMzz, zzdot) / 2
-        out = np.dot(self.Mzzi, out + self.dVzz)
+        zzdot = tn.einsum('ij,j->i', self._dP, zdot)
+
+        if self.numeric:
+            # this is the plus field's acceleration at (zz, zzdot), kept
+            # as calls instead of expanded in the composition
+            acc = tn.Opaque(self._fplus.expr[self.dim:],
+                            list(self.x) + list(self.u)).expr
+            xx = tn.Opaque(tn.subs(np.concatenate((zz, zzdot)), self.ztox),
+                           self.x).expr
+            out = tn.subs(acc, zip(self.x, xx))
+        else:
+            out = -tn.einsum('i,ijk,k', zzdot, self.dMzz, zzdot) \
+                + tn.einsum('i,ikj,k', zzdot, self.dMzz, zzdot) / 2
+            out = tn.einsum('ij,j->i', self.Mzzi, out + self.dVzz)
+            out = out + tn.einsum('ij,jk,k->i', OhmI,
+                                  tn.subs(self.Mqi, zip(self.q, OhmP)),
+                                  self.u)
         out = out - tn.einsum('ijk,j,k',
                               tn.diff(self._dP, self.z), zdot, zdot)
-        out = out + matmult(OhmI, self.Mqi, self.u)
-                            # in general, there should be a subs here
-        out = matmult(self._dPi, out)
+        out = tn.einsum('ij,j->i', self._dPi, out)
         out = np.concatenate((zdot, out))
 
         out = tn.SymExpr(tn.subs(out, self.ztox))
@@ -351,6 +468,7 @@ class SymSys(object):
 
     # can i conflate these three functions into one somehow?
     # probably, will have to think on it
+    @profiling.profiled('lambdified.f')
     def f(self, t, xval, uval=[0, 0], ctrl=None):
         # choose between _fplus and _fmins
         # depending on the configuration
@@ -364,6 +482,7 @@ class SymSys(object):
 
         return func(*vals)
 
+    @profiling.profiled('lambdified.dfdx')
     def dfdx(self, t, xval, uval=[0, 0]):
         # choose between dfxm and dfxp
         if xval[self.si] > 0:
@@ -373,6 +492,7 @@ class SymSys(object):
         vals = np.concatenate([[t], xval, uval])
         return func(*vals)
 
+    @profiling.profiled('lambdified.dfdu')
     def dfdu(self, t, xval, uval=[0, 0]):
         # choose between dfxm and dfxp
         if xval[self.si] > 0:
@@ -382,6 +502,88 @@ class SymSys(object):
         vals = np.concatenate([[t], xval, uval])
         return func(*vals)
 
+    def _columns(self, t, xvals, uvals):
+        # the states as an (N, 2dim) array, and the parameters of the
+        # lambdified functions as N-vectors [t, x0, x1, ..., u0, ...]
+        X = np.atleast_2d(np.asarray(xvals, dtype=float))
+        n = len(X)
+        T = np.broadcast_to(np.asarray(t, dtype=float), (n,))
+        U = np.asarray(uvals, dtype=float)
+        U = np.broadcast_to(U, (n, U.shape[-1]))
+        return X, [T] + list(X.T) + list(U.T)
+
+    def _batch(self, plus, minus, t, xvals, uvals, strict):
+        # plus or minus evaluated per point, each branch in one batched
+        # call over the points it applies to; the branch is chosen as
+        # in f (x[si] >= 0, strict=False) or dfdx (x[si] > 0)
+        X, cols = self._columns(t, xvals, uvals)
+        n = len(X)
+
+        up = X[:, self.si] > 0 if strict else X[:, self.si] >= 0
+        out = None
+        for (mask, expr) in ((up, plus), (~up, minus)):
+            if not mask.any():
+                continue
+            vals = expr.batch(*[c[mask] for c in cols])
+            if out is None:
+                out = np.empty((n,) + vals.shape[1:])
+            out[mask] = vals
+        return out
+
+    @profiling.profiled('lambdified.f_batch')
+    def f_batch(self, t, xvals, uvals):
+        """
+        f at N points at once: t is a scalar or N times, xvals (N, 2dim),
+        uvals (N, dim) or one u for all points; returns (N, 2dim)
+        """
+        return self._batch(self._fplus, self._fmins, t, xvals, uvals, False)
+
+    @profiling.profiled('lambdified.dfdx_batch')
+    def dfdx_batch(self, t, xvals, uvals):
+        # dfdx at N points at once, (N, 2dim, 2dim); see f_batch
+        return self._batch(self._dfxp, self._dfxm, t, xvals, uvals, True)
+
+    @profiling.profiled('lambdified.dfdu_batch')
+    def dfdu_batch(self, t, xvals, uvals):
+        # dfdu at N points at once, (N, 2dim, dim); see f_batch
+        return self._batch(self._dfup, self._dfum, t, xvals, uvals, True)
+
+    def _makehess(self):
+        # second derivatives of both fields, only built when first
+        # asked for since they are not needed by first order methods
+        params = [self.t, self.x, self.u]
+
+        self._dfxxp = tn.SymExpr(self._dfxp.diff(self.x))
+        self._dfxxp.callable(*params)
+        self._dfxxm = tn.SymExpr(self._dfxm.diff(self.x))
+        self._dfxxm.callable(*params)
+        self._dfxup = tn.SymExpr(self._dfxp.diff(self.u))
+        self._dfxup.callable(*params)
+        self._dfxum = tn.SymExpr(self._dfxm.diff(self.u))
+        self._dfxum.callable(*params)
+
+    def dfdxx(self, t, xval, uval=[0, 0]):
+        # out[i, j, k] = d^2 f_i / dx_j dx_k, same branch choice as dfdx
+        if '_dfxxp' not in self.__dict__:
+            self._makehess()
+        if xval[self.si] > 0:
+            func = self._dfxxp.func
+        else:
+            func = self._dfxxm.func
+        vals = np.concatenate([[t], xval, uval])
+        return func(*vals)
+
+    def dfdxu(self, t, xval, uval=[0, 0]):
+        # out[i, j, k] = d^2 f_i / dx_j du_k
+        if '_dfxxp' not in self.__dict__:
+            self._makehess()
+        if xval[self.si] > 0:
+            func = self._dfxup.func
+        else:
+            func = self._dfxum.func
+        vals = np.concatenate([[t], xval, uval])
+        return func(*vals)
+
     def P(self, zval):
         # choose between identity and fancy projection
         if zval[self.si] > 0:
@@ -404,6 +606,7 @@ class SymSys(object):
         dphi[self.si] = 1
         return dphi
 
+    @profiling.profiled('lambdified.delf')
     def _delf(self, t, xval, uval):
         # calculates the jump term assuming the field switches
         # between fplus and fminus at (t, x)
@@ -412,11 +615,6 @@ class SymSys(object):
         fp = self._fplus.func(*params)
         fm = self._fmins.func(*params)
         dphi = self.dphi(xval)
-        
-        # this assumes x = [z, zdot]
-        M = tn.eval(self.Mz, self.z, xval[:self.dim])
-        M = scipy.linalg.block_diag(M, np.eye(self.dim))
-        #dphi = matmult(M, dphi)
 
         out = -np.outer(fp-fm, dphi)/np.abs(np.inner(fp, dphi))
         
@@ -426,6 +624,24 @@ class SymSys(object):
         #    out[self.si, i] = -M[self.si, i]
         return out
 
+    @profiling.profiled('lambdified.delf_batch')
+    def delf_batch(self, t, xvals, uvals):
+        """
+        jump terms delf for N crossing events at once, (N, 2dim, 2dim);
+        arguments as for f_batch. both fields are evaluated at every
+        event, in one batched call each
+        """
+        X, cols = self._columns(t, xvals, uvals)
+        n = len(X)
+
+        fp = self._fplus.batch(*cols)
+        fm = self._fmins.batch(*cols)
+
+        # dphi is the unit vector e_si, so only column si is nonzero
+        out = np.zeros((n, X.shape[1], X.shape[1]))
+        out[:, :, self.si] = -(fp - fm) / np.abs(fp[:, [self.si]])
+        return out
+
 
 class SinFloor2D(SymSys):
     # two dimensional point mass, sinusoidal floor
@@ -478,6 +694,58 @@ class FlatFloor2D(SymSys):
         super(FlatFloor2D, self).__init__(si=1) 
 
 
+class GenericSys(SymSys):
+    # a hybrid system of any dimension, built from its pieces instead of
+    # a hand written subclass
+
+    """
+    what we need:
+     dim : number of configuration coordinates q
+     Mq(q) : mass matrix, a (dim, dim) array of expressions in q (or
+            numbers); q is passed in as an array of symbols
+     Vq(q) : potential energy, an expression in q
+     Ohm(z), Psi(q) : optional, the maps from the guard coordinates z
+            (in which the guard is z[si] = 0) to q and back, default to
+            the identity
+     Mqi(q) : optional, inverse of Mq, otherwise inverted blockwise
+            over the sparsity pattern of Mq: symbolically for single
+            entries and constant blocks, numerically at evaluation time
+            for the coupled blocks that depend on q (tn.NumInv), as is
+            the jacobian of the projection
+     si : optional, special index, defaults to 0
+     k : optional, parameter of the projection, defaults to 50.0
+    the control u enters as a generalized force, one per coordinate.
+
+    zero entries of Mq and of the coordinate maps stay zero through
+    the derivatives, products (tn.einsum) and inverses (tn.inv), and
+    are not lambdified, so the cost follows the nonzeros.
+    """
+
+    def __init__(self, dim, Mq, Vq, Ohm=None, Psi=None, Mqi=None, si=0,
+                 k=50.0):
+        self.k = k
+        self.dim = dim
+
+        names = lambda c, n: map(S, ['%s%d' % (c, i) for i in range(n)])
+        self.z = names('z', dim)
+        self.p = names('p', dim)
+        self.q = names('q', dim)
+        self.x = names('x', 2 * dim)
+        self.u = names('u', dim)
+
+        q = np.array(self.q, dtype=object)
+        self.Mq = np.array(Mq(q), dtype=object)
+        self.Mqi = tn.inv(self.Mq, self.q) if Mqi is None \
+            else np.array(Mqi(q), dtype=object)
+        self.Vq = sym.sympify(Vq(q))
+
+        self._Ohm = np.array(self.z if Ohm is None
+                             else Ohm(np.array(self.z, dtype=object)),
+                             dtype=object)
+        self._Psi = np.array(self.q if Psi is None else Psi(q), dtype=object)
+
+        super(GenericSys, self).__init__(si=si, numeric=True)
+
 
 if __name__ == "__main__":
     pass
@@ -3,89 +3,316 @@ import numpy as np
 # import sympy.core
 # import sympy.core.symbol
 from sympy.utilities.lambdify import lambdify as slambdify
+from sympy import sympify, Integer, Add
 from compiler.ast import flatten
+import os
+import warnings
+
+# default backend of SymExpr.callable, 'numpy' or 'c'
+BACKEND = os.environ['NLSYMB_BACKEND'] if 'NLSYMB_BACKEND' in os.environ \
+    else 'numpy'
+
+# set once the C backend failed and that was reported
+_cfailed = []
 
 
 # tensor lambdify
 # returns a callable that returns a tensor
 def lambdify(vars, expr):
-    flags = ['buffered', 'delay_bufalloc', 'refs_ok']
-    op_flags = [('readonly',), ('writeonly', 'allocate')]
+    # only the entries that depend on vars are lambdified and evaluated,
+    # constant ones (mostly structural zeros) are copied from a template.
+    # vars are plain symbols, so sympy need not swap them for dummies
+    # (an xreplace through every entry) first
+    expr = np.array(expr, dtype=object)
+    const = np.zeros(expr.shape)
+    funcs = []
+    terms = []
+    for (i, el) in np.ndenumerate(expr):
+        el = sympify(el)
+        if el.free_symbols:
+            funcs.append((i, slambdify(vars, el, dummify=False)))
+            terms.append((i, el))
+        else:
+            const[i] = float(el)
 
-    it = np.nditer([expr, None], flags=flags, op_flags=op_flags)
-    it.reset()
+    def thread(*args):
+        out = const.copy()
+        for (i, func) in funcs:
+            out[i] = func(*args)
+        return out
+
+    # sympy's default modules put math before numpy, whose functions
+    # take single numbers only; the batched ones are lambdified for
+    # numpy, when first used
+    vectorized = []
+
+    def batch(*args):
+        # args are arrays of N values each, out[k] = thread(*args[:][k])
+        if not vectorized:
+            vectorized.extend(
+                (i, slambdify(vars, el, 'numpy', dummify=False))
+                for (i, el) in terms)
+        n = len(args[0]) if args else 1
+        out = np.empty((n,) + expr.shape)
+        out[:] = const
+        for (i, func) in vectorized:
+            out[(slice(None),) + i] = func(*args)
+        return out
+
+    thread.batch = batch
+    return thread
 
-    for (x, func) in it:
-        func[...] = slambdify(vars, x)
 
-    tensor_of_lambdas = it.operands[-1]
+# memo caches shared by diff, subs and eval: SymSys differentiates and
+# substitutes the same expressions many times over (dMz through ztozz
+# for the minus field, _dP again in _makefm, ...). expressions are
+# immutable and hashable, so results are keyed on the expression itself
+_diffs = {}
+_subs = {}
+_evals = {}
 
-    def thread(*args):
-        it = np.nditer([tensor_of_lambdas, None],
-                       flags=flags, op_flags=op_flags,
-                       op_dtypes=[np.object_, float])
-        it.reset()
 
-        for (func, out) in it:
-            out[...] = func.item()(*args)
+def clear_cache():
+    _diffs.clear()
+    _subs.clear()
+    _evals.clear()
 
-        return it.operands[-1]
 
-    return thread
+def cache_info():
+    return {'diff': len(_diffs), 'subs': len(_subs), 'eval': len(_evals)}
+
+
+def _diff(expr, var):
+    # d expr / d var, memoized; zero without calling sympy if expr does
+    # not depend on var
+    expr = sympify(expr)
+    if var not in expr.free_symbols:
+        return Integer(0)
+    key = (expr, var)
+    if key not in _diffs:
+        _diffs[key] = expr.diff(var)
+    return _diffs[key]
 
 
 def diff(func, vars, out=None):
-    func = np.array(func)
-    vars = np.array(vars)
-    flags = ['buffered', 'delay_bufalloc', 'reduce_ok', 'growinner', 'refs_ok']
-    dtypes = [np.object_] * 3
-    op_flags = [('readonly',)] * 2 + [('writeonly', 'allocate')]
-    op_axes = [range(func.ndim) + [-1] * (vars.ndim),
-               [-1] * (func.ndim) + range(vars.ndim), None]
+    # out[i..., j...] = d func[i...] / d vars[j...]
+    func = np.array(func, dtype=object)
+    vars = np.array(vars, dtype=object)
+    out = np.empty(func.shape + vars.shape, dtype=object)
+
+    for (i, f) in np.ndenumerate(func):
+        for (j, v) in np.ndenumerate(vars):
+            out[i + j] = _diff(f, v)
+
+    return out
+
+
+def inv(M, vars=None):
+    # inverse of a square object matrix, block by block: the connected
+    # components of its sparsity pattern are inverted separately, so a
+    # diagonal (or block diagonal) matrix never goes through a full
+    # symbolic inverse. with vars, blocks larger than one entry that
+    # depend on vars are not inverted symbolically (the expressions grow
+    # too fast with the size of the block) but numerically, when they
+    # are evaluated, see NumInv
+    M = np.array(M, dtype=object)
+    n = M.shape[0]
+    linked = [[j for j in range(n) if not (_zero(M[i, j]) and
+                                           _zero(M[j, i]))]
+              for i in range(n)]
+
+    out = np.empty((n, n), dtype=object)
+    out[...] = Integer(0)
+    seen = set()
+    for i in range(n):
+        if i in seen:
+            continue
+        block, stack = [], [i]
+        while stack:
+            j = stack.pop()
+            if j not in seen:
+                seen.add(j)
+                block.append(j)
+                stack.extend(linked[j])
+        block.sort()
+        B = M[np.ix_(block, block)]
+
+        if len(block) == 1:
+            out[i, i] = 1 / sympify(M[i, i])
+            continue
+        if vars is not None and any(sympify(el).free_symbols & set(vars)
+                                    for el in B.flat):
+            Bi = NumInv(B, vars).expr
+        else:
+            from sympy import Matrix
+            Bi = np.array(Matrix(B).inv())
+        for (a, ia) in enumerate(block):
+            for (b, ib) in enumerate(block):
+                out[ia, ib] = Bi[a, b]
+    return out
+
+
+class Opaque(object):
+
+    """
+    a tensor of expressions in vars, kept opaque to sympy
+
+    expr holds its entries as sympy functions of vars, E_i(*vars), that
+    go through diff, subs and lambdify like any other expression, but
+    print (and grow) as a call: substituting a long expression for vars
+    does not copy the source into every entry. lambdify calls them with
+    numbers (or with arrays of N points, for batch). their derivatives
+    are functions of the same kind, of the derivatives of the source.
+    the values at the last few points are kept, as the entries of one
+    tensor are evaluated one after the other at the same point.
+    """
 
-    nditer = np.nditer([func, vars, None], flags=flags,
-                       op_dtypes=dtypes, op_flags=op_flags, op_axes=op_axes)
+    count = [0]
+
+    def __init__(self, source, vars):
+        self.source = np.array(source, dtype=object)
+        self.vars = tuple(vars)
+        Opaque.count[0] += 1
+        self.name = '%s%d' % (type(self).__name__.lower(), Opaque.count[0])
+
+        self._symbolic = {(): self.source}
+        self._lambdified = {}
+        self._funcs = {}
+        self._values = {}
+        self.expr = np.empty(self.source.shape, dtype=object)
+        for i in np.ndindex(self.source.shape):
+            self.expr[i] = self.term(i, (), self.vars)
+
+    def term(self, i, alpha, args):
+        # entry i of D^alpha, applied to args
+        if not self._nonzero(i, alpha):
+            return Integer(0)
+        key = (i, alpha)
+        if key not in self._funcs:
+            from sympy.core.function import UndefinedFunction
+            name = self.name + ''.join('_%d' % k for k in i) + \
+                ''.join('_d%d' % k for k in alpha)
+            opaque = self
+
+            def fdiff(self, argindex=1):
+                beta = tuple(sorted(alpha + (argindex - 1,)))
+                return opaque.term(i, beta, self.args)
+
+            def imp(*args):
+                return opaque.value(alpha, args)[(Ellipsis,) + i]
+
+            self._funcs[key] = UndefinedFunction(name, fdiff=fdiff,
+                                                 _imp_=staticmethod(imp))
+        return self._funcs[key](*args)
+
+    def _nonzero(self, i, alpha):
+        return not _zero(self.symbolic(alpha)[i])
+
+    def symbolic(self, alpha):
+        # D^alpha of the source, alpha sorted
+        for k in range(1, len(alpha) + 1):
+            if alpha[:k] not in self._symbolic:
+                self._symbolic[alpha[:k]] = diff(self._symbolic[alpha[:k - 1]],
+                                                 self.vars[alpha[k - 1]])
+        return self._symbolic[alpha]
+
+    def evaluate(self, alpha, args):
+        # D^alpha of the source at args, shape or (N,) + shape
+        if alpha not in self._lambdified:
+            self._lambdified[alpha] = lambdify(self.vars,
+                                               self.symbolic(alpha))
+        func = self._lambdified[alpha]
+        if any(np.ndim(a) for a in args):
+            return func.batch(*np.broadcast_arrays(*args))
+        return func(*args)
+
+    def value(self, alpha, args):
+        key = tuple(np.asarray(a, dtype=float).tobytes() for a in args)
+        if key not in self._values:
+            if len(self._values) > 8:
+                self._values.clear()
+            self._values[key] = {}
+        values = self._values[key]
+        if alpha not in values:
+            values[alpha] = self._compute(alpha, args)
+        return values[alpha]
+
+    def _compute(self, alpha, args):
+        return self.evaluate(alpha, args)
+
+
+class NumInv(Opaque):
 
-    # why is this needed?
-    nditer.reset()
+    """
+    inverse of a matrix M(vars) of expressions, evaluated numerically
+
+    an Opaque whose entries are those of W = M^-1, solved with the
+    lambdified M where they are evaluated; the derivatives follow from
+    M W = 1,
+        D^a W = - W sum_{b in a, b != 0} D^b M D^(a-b) W
+    over the subsets b of the multi index a.
+    """
 
-    for (x, y, out) in nditer:
-        from sympy import diff
-        out[...] = diff(x, y)
+    def _nonzero(self, i, alpha):
+        # the blocks tn.inv hands over are connected, so W is dense
+        return True
 
-    return nditer.operands[-1]
+    def _compute(self, alpha, args):
+        if not alpha:
+            return np.linalg.inv(self.evaluate((), args))
+        acc = 0
+        pos = range(len(alpha))
+        for mask in range(1, 2 ** len(alpha)):
+            beta = tuple(alpha[k] for k in pos if mask >> k & 1)
+            rest = tuple(alpha[k] for k in pos if not mask >> k & 1)
+            acc = acc + np.matmul(self.evaluate(beta, args),
+                                  self.value(rest, args))
+        return -np.matmul(self.value((), args), acc)
 
 
 # a function to numerically evaluate numpy arrays
 # containing sympy params using the corresponding values
 # TODO might want to change the call to take a dict instead of params/vals
 def eval(symb, params, vals):
-    rule = {params[i]: vals[i] for i in range(len(vals))}
+    # the tensor is lambdified once per (expressions, params) and the
+    # function reused, instead of substituting into every element on
+    # every call
+    symb = np.array(symb, dtype=object)
+    params = tuple(params[i] for i in range(len(vals)))
+    key = (symb.shape, tuple(symb.flat), params)
+    if key not in _evals:
+        _evals[key] = lambdify(params, symb)
 
-    flags = ['buffered', 'delay_bufalloc', 'refs_ok']
-    it = np.nditer([symb, None], flags=flags, op_dtypes=[np.object_, float])
-    it.operands[-1][...] = 0.0
-    it.reset()
-
-    for (el, out) in it:
-        out[...] = el.item().subs(rule)
-
-    return np.array(it.operands[-1])
+    return np.array(_evals[key](*vals), dtype=float)
 
 # a function to perform symbolic substitutions on numpy arrays of
 # sympy symbols
 
 
 def subs(expr, rule):
-    flags = ['buffered', 'delay_bufalloc', 'refs_ok']
-    it = np.nditer([expr, None], flags=flags)
-    it.operands[-1][...] = 0
-    it.reset()
-
-    for (el, out) in it:
-        out[...] = el.item().subs(rule, simultaneous=True)
-
-    return np.array(it.operands[-1])
+    # simultaneous substitution, memoized per element; elements without
+    # any of the symbols being replaced are passed through. a rule that
+    # only replaces symbols (all of SymSys') needs no matching, xreplace
+    # swaps them in one pass over the tree
+    rule = dict((sympify(k), sympify(v)) for (k, v) in dict(rule).items())
+    keys = set(rule)
+    plain = all(k.is_Symbol for k in keys)
+    rkey = frozenset(rule.iteritems())
+
+    expr = np.array(expr, dtype=object)
+    out = np.empty(expr.shape, dtype=object)
+    for (i, el) in np.ndenumerate(expr):
+        el = sympify(el)
+        if not (el.free_symbols & keys):
+            out[i] = el
+            continue
+        key = (el, rkey)
+        if key not in _subs:
+            _subs[key] = el.xreplace(rule) if plain \
+                else el.subs(rule, simultaneous=True)
+        out[i] = _subs[key]
+
+    return out
 
 
 class SymExpr():
@@ -99,10 +326,38 @@ class SymExpr():
         self.expr = np.array(expr)
         self.dims = self.expr.shape
 
-    def callable(self, *args):
-        self.func = lambdify(tuple(flatten(args)), self.expr)
-        # thinking of adding cse compressed version of
-        # expression here
+    def callable(self, *args, **kwargs):
+        # backend is 'numpy' (lambdify) or 'c' (ccode.compiled, which
+        # falls back to numpy if the expression cannot be compiled or
+        # loaded, with a warning the first time); defaults to BACKEND
+        backend = kwargs['backend'] if 'backend' in kwargs else BACKEND
+        params = tuple(flatten(args))
+        self.params = params
+
+        self.func = None
+        if backend == 'c':
+            from nlsymb import ccode
+            try:
+                self.func = ccode.compiled(params, self.expr)
+            except ccode.ERRORS as e:
+                if not _cfailed:
+                    warnings.warn("C backend unavailable (%s: %s), using "
+                                  "numpy" % (type(e).__name__, e))
+                    _cfailed.append(e)
+        if self.func is None:
+            self.func = lambdify(params, self.expr)
+
+    def batch(self, *args):
+        # func evaluated at N points in one call: args are the flattened
+        # parameters as arrays of length N, the result has shape
+        # (N,) + dims. the C backend has no batched form, so a numpy
+        # one is lambdified for it on first use
+        batch = getattr(self.func, 'batch', None)
+        if batch is None:
+            if '_batch' not in self.__dict__:
+                self._batch = lambdify(self.params, self.expr).batch
+            batch = self._batch
+        return batch(*args)
 
     def subs(self, rule):
         return tensorSubs(self.expr, rule)
@@ -111,14 +366,17 @@ class SymExpr():
         return diff(self.expr, params)
 
 
-def einsum(string, *arrays):
-    """Simplified object einsum, not as much error checking
+def einsum(string, *arrays, **kwargs):
+    """Object einsum for tensors of sympy expressions
 
     does not support "..." or list input and will see "...", etc. as three
     times an axes identifier, tries normal einsum first!
 
-    NOTE: This is untested, and not fast, but object type is
-    never really fast anyway...
+    the operands are contracted pairwise, the pair giving the smallest
+    result first (as np.einsum_path does), and only over their nonzero
+    entries; every output entry is built as one sympy Add of its terms.
+    canon : optional, a callable applied to every output entry, or
+            True for sympy's factor_terms
     """
     try:
         return np.einsum(string, *arrays)
@@ -126,57 +384,151 @@ def einsum(string, *arrays):
         pass
 
     s = string.split('->')
-    in_op = s[0].split(',')
-    out_op = None if len(s) == 1 else s[1].replace(' ', '')
-
-    in_op = [axes.replace(' ', '') for axes in in_op]
-    all_axes = set()
-
-    for axes in in_op:
-        all_axes.update(axes)
-
-    if out_op is None:
-        out_op = set()
-        for axes in in_op:
-            for ax in axes:
-                if ax in out_op:
-                    out_op.remove(ax)
-                else:
-                    out_op.add(ax)
+    in_op = [axes.replace(' ', '') for axes in s[0].split(',')]
+    if len(s) == 1:
+        # implicit output: the axes appearing once, in alphabetical order
+        letters = ''.join(in_op)
+        out_op = ''.join(sorted(ax for ax in set(letters)
+                                if letters.count(ax) == 1))
     else:
-        all_axes.update(out_op)
-
-    perm_dict = {_[1]: _[0] for _ in enumerate(all_axes)}
-
-    dims = len(perm_dict)
-    op_axes = []
-    for axes in (in_op + list((out_op,))):
-        op = [-1] * dims
-        for i, ax in enumerate(axes):
-            op[perm_dict[ax]] = i
-        op_axes.append(op)
-
-    op_flags = [('readonly',)] * len(in_op) + [('readwrite', 'allocate')]
-    dtypes = [np.object_] * (len(in_op) + 1)  # cast all to object
-
-    nditer = np.nditer(arrays + (None,),
-                       op_axes=op_axes,
-                       flags=['buffered', 'delay_bufalloc', 'reduce_ok',
-                              'growinner', 'refs_ok'],
-                       op_dtypes=dtypes,
-                       op_flags=op_flags)
-
-    nditer.operands[-1][...] = 0
-    nditer.reset()
-
-    for vals in nditer:
-        out = vals[-1]
-        prod = 1
-        for value in vals[0:-1]:
-            prod *= value
-        out[...] += prod
-
-    return nditer.operands[-1]
+        out_op = s[1].replace(' ', '')
+
+    ops = []
+    for (axes, arr) in zip(in_op, arrays):
+        arr = np.array(arr, dtype=object)
+        ops.append(_Sparse(axes, arr.shape, arr))
+
+    # sum out the axes only one operand has, then contract pairwise
+    ops = [op.reduce(_keep(op, ops, out_op)) for op in ops]
+    while len(ops) > 1:
+        (i, j) = _plan(ops, out_op)
+        a, b = ops[i], ops[j]
+        rest = [op for (k, op) in enumerate(ops) if k not in (i, j)]
+        ops = rest + [a.contract(b, _keep(None, rest, out_op))]
+
+    out = ops[0].dense(out_op)
+
+    canon = kwargs['canon'] if 'canon' in kwargs else None
+    if canon is True:
+        from sympy import factor_terms as canon
+    if canon is not None:
+        for (i, el) in np.ndenumerate(out):
+            out[i] = canon(el)
+    return out
+
+
+def _keep(op, ops, out_op):
+    # axes of op still needed by the output or by the other operands
+    keep = set(out_op)
+    for other in ops:
+        if other is not op:
+            keep.update(other.axes)
+    return keep
+
+
+def _plan(ops, out_op):
+    # the pair of operands whose contraction is smallest
+    best = None
+    for i in range(len(ops)):
+        for j in range(i + 1, len(ops)):
+            rest = [op for (k, op) in enumerate(ops) if k not in (i, j)]
+            keep = _keep(None, rest, out_op)
+            axes = set(ops[i].axes) | set(ops[j].axes)
+            size = 1
+            for ax in axes & keep:
+                size *= ops[i].dims.get(ax, ops[j].dims.get(ax))
+            cost = len(ops[i].entries) * len(ops[j].entries)
+            if best is None or (size, cost) < best[0]:
+                best = ((size, cost), (i, j))
+    return best[1]
+
+
+class _Sparse(object):
+    # the nonzero entries of an object tensor, {index: expr}, with a
+    # letter per axis
+
+    def __init__(self, axes, shape, arr=None, entries=None):
+        self.dims = dict(zip(axes, shape))
+        if entries is None:
+            # a letter repeated within the operand takes the diagonal
+            first = [axes.index(ax) for ax in axes]
+            entries = {}
+            for (i, el) in np.ndenumerate(arr):
+                if _zero(el) or any(i[n] != i[f] for (n, f) in
+                                    enumerate(first)):
+                    continue
+                entries[tuple(i[n] for (n, f) in enumerate(first)
+                              if n == f)] = el
+            axes = ''.join(ax for (n, ax) in enumerate(axes)
+                           if axes.index(ax) == n)
+        self.axes = axes
+        self.entries = entries
+
+    def reduce(self, keep):
+        # sum over the axes not in keep
+        drop = [ax for ax in self.axes if ax not in keep]
+        if not drop:
+            return self
+        pos = [n for (n, ax) in enumerate(self.axes) if ax in keep]
+        terms = {}
+        for (i, el) in self.entries.iteritems():
+            terms.setdefault(tuple(i[n] for n in pos), []).append(el)
+        axes = ''.join(self.axes[n] for n in pos)
+        return _Sparse(axes, [self.dims[ax] for ax in axes],
+                       entries=_sum(terms))
+
+    def contract(self, other, keep):
+        # multiply with other, summing over the common axes not in keep
+        common = [ax for ax in self.axes if ax in other.axes]
+        summed = [ax for ax in common if ax not in keep]
+        axes = ''.join([ax for ax in self.axes if ax not in summed] +
+                       [ax for ax in other.axes if ax not in common])
+
+        # group the entries of other by their common index
+        opos = [other.axes.index(ax) for ax in common]
+        rest = [n for (n, ax) in enumerate(other.axes) if ax not in common]
+        groups = {}
+        for (i, el) in other.entries.iteritems():
+            groups.setdefault(tuple(i[n] for n in opos), []).append(
+                (tuple(i[n] for n in rest), el))
+
+        spos = [self.axes.index(ax) for ax in common]
+        kpos = [n for (n, ax) in enumerate(self.axes) if ax not in summed]
+        terms = {}
+        for (i, el) in self.entries.iteritems():
+            match = groups.get(tuple(i[n] for n in spos))
+            if match is None:
+                continue
+            head = tuple(i[n] for n in kpos)
+            for (tail, oel) in match:
+                terms.setdefault(head + tail, []).append(el * oel)
+
+        dims = dict(self.dims, **other.dims)
+        out = _Sparse(axes, [dims[ax] for ax in axes], entries=_sum(terms))
+        return out.reduce(keep)
+
+    def dense(self, axes):
+        # an object array with the given axis order, zeros filled in
+        out = np.empty(tuple(self.dims[ax] for ax in axes), dtype=object)
+        out[...] = Integer(0)
+        perm = [self.axes.index(ax) for ax in axes]
+        for (i, el) in self.entries.iteritems():
+            out[tuple(i[n] for n in perm)] = el
+        return out
+
+
+def _zero(el):
+    return el == 0
+
+
+def _sum(terms):
+    # {index: [terms]} -> {index: Add(*terms)}, dropping zeros
+    out = {}
+    for (i, ts) in terms.iteritems():
+        el = Add(*ts) if len(ts) > 1 else ts[0]
+        if not _zero(el):
+            out[i] = el
+    return out
 
 
 if __name__ == "__main__":
@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+
+from nlsymb import export
+from nlsymb.sys import FlatFloor2D
+
+N = 50
+
+
+@pytest.fixture(scope='module')
+def s():
+    return FlatFloor2D(k=3)
+
+
+@pytest.fixture(scope='module')
+def points():
+    # states on both sides of the guard, and some exactly on it
+    rng = np.random.RandomState(0)
+    X = rng.randn(N, 4)
+    X[:5, 1] = 0.0
+    U = rng.randn(N, 2)
+    T = np.linspace(0.0, 1.0, N)
+    return T, X, U
+
+
+def pointwise(func, T, X, U):
+    return np.array([func(T[k], X[k], U[k]) for k in range(len(T))])
+
+
+@pytest.mark.parametrize('name', ['f', 'dfdx', 'dfdu', 'delf'])
+def test_batch_matches_pointwise(s, points, name):
+    T, X, U = points
+    got = getattr(s, name + '_batch')(T, X, U)
+    want = pointwise(getattr(s, name), T, X, U)
+    assert got.shape == want.shape
+    assert np.allclose(got, want, rtol=1e-12, atol=1e-12)
+
+
+def test_batch_broadcasts_t_and_u(s, points):
+    T, X, U = points
+    got = s.f_batch(0.3, X, U[0])
+    want = np.array([s.f(0.3, x, U[0]) for x in X])
+    assert np.allclose(got, want, rtol=1e-12, atol=1e-12)
+
+
+def test_batch_one_branch(s, points):
+    T, X, U = points
+    X = X.copy()
+    X[:, 1] = np.abs(X[:, 1]) + 0.1
+    for name in ('f', 'dfdx'):
+        got = getattr(s, name + '_batch')(T, X, U)
+        want = pointwise(getattr(s, name), T, X, U)
+        assert np.allclose(got, want, rtol=1e-12, atol=1e-12)
+
+
+def test_compiled_batch(s, points, tmpdir):
+    T, X, U = points
+    c = export.load(export.export(s, str(tmpdir.join('flat.py'))))
+    for name in ('f', 'dfdx', 'dfdu', 'delf'):
+        got = getattr(c, name + '_batch')(T, X, U)
+        want = getattr(s, name + '_batch')(T, X, U)
+        assert np.allclose(got, want, rtol=1e-10, atol=1e-12), name
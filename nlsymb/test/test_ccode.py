@@ -0,0 +1,75 @@
+import warnings
+from distutils.spawn import find_executable
+
+import numpy as np
+import pytest
+import sympy as sym
+
+from nlsymb import ccode
+from nlsymb import tensor as tn
+
+x1, x2, y = sym.symbols('x1 x2 y')
+F = np.array([[x1 * sym.sin(x2) + sym.exp(-y), x2 ** 2 / (1 + x1 ** 2)],
+              [sym.atan2(x1, x2) * sym.cos(y), 3.0],
+              [sym.sqrt(1 + y ** 2) * sym.sin(x2), 0]], dtype=object)
+
+needs_cc = pytest.mark.skipif(find_executable(ccode.CC) is None,
+                              reason="no C compiler")
+
+
+@pytest.fixture(autouse=True)
+def cache(tmpdir, monkeypatch):
+    # a fresh library cache, and the failure not yet reported
+    monkeypatch.setattr(ccode, 'CACHE', str(tmpdir))
+    monkeypatch.setattr(tn, '_cfailed', [])
+
+
+def callables():
+    c = tn.SymExpr(F)
+    c.callable(x1, [x2, y], backend='c')
+    n = tn.SymExpr(F)
+    n.callable(x1, [x2, y], backend='numpy')
+    return c, n
+
+
+@needs_cc
+def test_c_matches_numpy():
+    c, n = callables()
+    # the compiled function, not the numpy fallback
+    assert not hasattr(c.func, 'batch')
+    assert c.func.shape == F.shape
+    rng = np.random.RandomState(0)
+    out = np.empty(F.shape)
+    for v in rng.randn(20, 3):
+        want = n.func(*v)
+        assert np.allclose(c.func(*v), want, rtol=1e-12, atol=1e-12)
+        assert c.func(*v, out=out) is out
+        assert np.allclose(out, want, rtol=1e-12, atol=1e-12)
+    # the batched form is lambdified on the side
+    V = rng.randn(20, 3)
+    assert np.allclose(c.batch(*V.T), n.batch(*V.T), rtol=1e-12, atol=1e-12)
+
+
+@needs_cc
+def test_library_is_cached(tmpdir):
+    callables()
+    libs = tmpdir.listdir(lambda p: p.ext == '.so')
+    assert len(libs) == 1
+    mtime = libs[0].mtime()
+    callables()
+    assert tmpdir.listdir(lambda p: p.ext == '.so')[0].mtime() == mtime
+
+
+@pytest.mark.parametrize('cc', ['nlsymb-no-such-cc', 'false'])
+def test_failed_compile_falls_back_and_warns_once(monkeypatch, cc):
+    # no compiler (OSError), a compiler that fails (CalledProcessError)
+    monkeypatch.setattr(ccode, 'CC', cc)
+    with warnings.catch_warnings(record=True) as w:
+        warnings.simplefilter('always')
+        c, n = callables()
+        c2, _ = callables()
+    assert len(w) == 1 and 'C backend unavailable' in str(w[0].message)
+    assert len(tn._cfailed) == 1
+    for v in np.random.RandomState(1).randn(5, 3):
+        assert np.allclose(c.func(*v), n.func(*v), rtol=1e-14)
+        assert np.allclose(c2.func(*v), n.func(*v), rtol=1e-14)
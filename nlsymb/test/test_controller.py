@@ -0,0 +1,63 @@
+import numpy as np
+
+from nlsymb import Trajectory
+from nlsymb.lqr import Controller, TableController
+
+tlims = (0.0, 1.0)
+
+
+def reference():
+    ref = Trajectory('x', 'u')
+    for t in np.linspace(0.0, 1.0, 201):
+        ref.addpoint(t, x=np.array([np.sin(t), 1.0 - t, np.cos(t), -1.0]),
+                     u=np.array([0.5 * t, 9.8 - t ** 2]))
+    ref.interpolate()
+    ref.tlims = tlims
+    return ref
+
+
+def kwargs():
+    K = lambda t: np.array([[10.0 + np.sin(3 * t), 0.0, 5.0, 0.1 * t],
+                            [0.0, 10.0, np.cos(t), 5.0]])
+    C = lambda t: np.array([0.2 * t, -np.sin(2 * t)])
+    return dict(reference=reference(), K=K, C=C)
+
+
+def states(rng, num):
+    return rng.randn(num, 4)
+
+
+def test_matches_controller():
+    kw = kwargs()
+    ctrl = Controller(**kw)
+    table = TableController(dt=1e-4, **kw)
+    rng = np.random.RandomState(0)
+    err = 0.0
+    for (t, x) in zip(rng.uniform(0.0, 1.0, 200), states(rng, 200)):
+        err = max(err, np.abs(table(t, x) - ctrl(t, x)).max())
+    # linear interpolation between rows, second order in dt
+    assert err < 1e-7
+    # on the grid the rows are exact
+    for (t, x) in zip(table.t[::997], states(rng, 11)):
+        assert np.allclose(table(t, x), ctrl(t, x), rtol=1e-12, atol=1e-12)
+
+
+def test_batch_matches_scalar():
+    table = TableController(dt=1e-3, **kwargs())
+    rng = np.random.RandomState(1)
+    # out of the table on both ends too
+    T = np.concatenate((rng.uniform(0.0, 1.0, 50), [-0.5, 0.0, 1.0, 1.5]))
+    X = states(rng, len(T))
+    U = table(T, X)
+    assert U.shape == (len(T), 2)
+    for (t, x, u) in zip(T, X, U):
+        assert np.allclose(u, table(t, x), rtol=1e-14, atol=1e-14)
+
+
+def test_clamped_to_the_table():
+    kw = kwargs()
+    table = TableController(dt=1e-3, **kw)
+    x = np.array([0.1, 0.2, 0.3, 0.4])
+    assert np.allclose(table(-1.0, x), table(0.0, x), rtol=1e-14)
+    assert np.allclose(table(2.0, x), table(1.0, x), rtol=1e-14)
+    assert np.allclose(table(1.0, x), Controller(**kw)(1.0, x), rtol=1e-12)
@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+import sympy as sym
+
+from nlsymb import export
+from nlsymb.sys import SinFloor2D, GenericSys
+
+N = 30
+
+
+@pytest.fixture(scope='module')
+def s():
+    # sin and cos in every field, and the hessians built
+    s = SinFloor2D(k=3)
+    s.dfdxx(0.0, np.zeros(4), np.zeros(2))
+    return s
+
+
+@pytest.fixture(scope='module')
+def c(s, tmpdir_factory):
+    path = str(tmpdir_factory.mktemp('export').join('sinfloor.py'))
+    return export.load(export.export(s, path))
+
+
+@pytest.fixture(scope='module')
+def points():
+    rng = np.random.RandomState(0)
+    X = rng.randn(N, 4)
+    X[::2, 1] = -np.abs(X[::2, 1])
+    return np.linspace(0.0, 1.0, N), X, rng.randn(N, 2)
+
+
+def test_module_uses_numpy(c):
+    src = open(c.path).read()
+    assert 'from numpy import *' in src and 'math' not in src
+
+
+@pytest.mark.parametrize('name', ['f', 'dfdx', 'dfdu', 'delf', 'dfdxx',
+                                  'dfdxu'])
+def test_round_trip(s, c, points, name):
+    T, X, U = points
+    for k in range(N):
+        got = getattr(c, name)(T[k], X[k], U[k])
+        want = getattr(s, name)(T[k], X[k], U[k])
+        assert np.allclose(got, want, rtol=1e-12, atol=1e-12), k
+
+
+def test_maps_round_trip(s, c, points):
+    for x in points[1]:
+        z = x[:2]
+        for name in ('P', 'dP', 'Ohm', 'dOhm', 'Psi', 'dPsi'):
+            assert np.allclose(getattr(c, name)(z), getattr(s, name)(z),
+                               rtol=1e-12, atol=1e-12), name
+
+
+@pytest.mark.parametrize('name', ['f', 'dfdx', 'dfdu', 'delf'])
+def test_batch_is_vectorized(s, c, points, name):
+    T, X, U = points
+    got = getattr(c, name + '_batch')(T, X, U)
+    want = getattr(s, name + '_batch')(T, X, U)
+    assert got.shape == want.shape
+    assert np.allclose(got, want, rtol=1e-12, atol=1e-12)
+    # constant fields are broadcast over the points too
+    assert c._dfup.batch(T, *list(X.T) + list(U.T)).shape == (N, 4, 2)
+
+
+def test_numeric_inverse_is_not_exported(tmpdir):
+    def Mq(q):
+        return np.array([[2.0, sym.cos(q[0] - q[1]) / 2],
+                         [sym.cos(q[0] - q[1]) / 2, 2.0]], dtype=object)
+    g = GenericSys(2, Mq, lambda q: 9.8 * q[1], si=1, k=3)
+    with pytest.raises(Exception) as e:
+        export.export(g, str(tmpdir.join('g.py')))
+    assert 'cannot be exported' in str(e.value)
+    assert tmpdir.listdir() == []
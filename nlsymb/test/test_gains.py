@@ -0,0 +1,81 @@
+import numpy as np
+
+from nlsymb import Trajectory
+from nlsymb.lqr import LQR, LQ
+
+# a damped oscillator with a varying stiffness, driven through both
+# states, and a non-diagonal R
+tlims = (0.0, 1.5)
+times = np.linspace(0.0, 1.5, 31)
+R = np.array([[1.0, 0.3], [0.3, 0.5]])
+
+
+def A(t):
+    return np.array([[0.0, 1.0], [-2.0 - np.sin(3 * t), -0.3]])
+
+
+def B(t):
+    return np.array([[0.1, 0.0], [0.0, 1.0 + 0.5 * t]])
+
+
+def problem(**kwargs):
+    kw = dict(q=lambda t: np.array([np.cos(2 * t), 0.5 * t]),
+              r=lambda t: np.array([0.2, -np.sin(t)]),
+              qf=np.array([0.3, -0.2]),
+              Q=lambda t: np.diag([2.0, 1.0]))
+    kw.update(kwargs)
+    return kw
+
+
+def test_constant_r_is_factored_once():
+    lq = LQR(tlims, A, B, R=R)
+    assert lq._Rfac is not None
+    assert np.array_equal(lq.R(0.7), R)
+    # callables are left alone, the default is the constant identity
+    assert LQR(tlims, A, B, R=lambda t: R)._Rfac is None
+    assert np.array_equal(LQR(tlims, A, B)._Rfac[0], np.eye(2))
+
+
+def test_cholesky_gains_match_general_solve():
+    ref = LQR(tlims, A, B, R=lambda t: R)
+    ref.solve()
+    lq = LQR(tlims, A, B, R=R)
+    lq.solve()
+    # exactly on the solver's grid, off it up to the interpolation
+    for t in ref._Ptj._t:
+        K = np.linalg.solve(R, B(t).T.dot(ref.P(t)))
+        assert np.allclose(ref.K(t), K, rtol=1e-10, atol=1e-10)
+    for t in times:
+        assert np.allclose(lq.K(t), ref.K(t), rtol=1e-8, atol=1e-8)
+
+
+def test_cholesky_fused_and_staged():
+    for fused in (True, False):
+        ref = LQ(tlims, A, B, fused=fused, **problem(R=lambda t: R))
+        ref.solve()
+        lq = LQ(tlims, A, B, fused=fused, **problem(R=R))
+        lq.solve()
+        for t in times:
+            for name in ('K', 'C'):
+                assert np.allclose(getattr(lq, name)(t),
+                                   getattr(ref, name)(t),
+                                   rtol=1e-6, atol=1e-6), (fused, name)
+        for t in lq._bt._t:
+            C = np.linalg.solve(R, B(t).T.dot(lq.b(t)) +
+                                np.array([0.2, -np.sin(t)]))
+            assert np.allclose(lq.C(t), C, rtol=1e-10, atol=1e-10)
+
+
+def test_addpoints_matches_addpoint():
+    t = np.linspace(0.0, 1.0, 11)
+    K = np.random.RandomState(0).randn(11, 2, 2)
+    one, bulk = Trajectory('K'), Trajectory('K')
+    for (tt, k) in zip(t, K):
+        one.addpoint(tt, K=k)
+    bulk.addpoints(t, K=K)
+    one.interpolate()
+    bulk.interpolate()
+    assert (bulk.tmin, bulk.tmax) == (0.0, 1.0)
+    assert bulk._t == one._t
+    for tt in np.linspace(0.0, 1.0, 23):
+        assert np.allclose(bulk.K(tt), one.K(tt), rtol=1e-14)
@@ -0,0 +1,94 @@
+import numpy as np
+import sympy as sym
+import pytest
+
+from nlsymb.sys import FlatFloor2D, GenericSys
+
+N = 3
+
+
+def chain(q, cos=sym.cos):
+    # mass matrix of a chain whose neighbours are coupled through their
+    # angle, q dependent and not block diagonal
+    M = np.zeros((N, N), dtype=object)
+    for i in range(N):
+        M[i, i] = 2.0
+        if i + 1 < N:
+            M[i, i + 1] = M[i + 1, i] = cos(q[i] - q[i + 1]) / 2
+    return M
+
+
+def potential(q):
+    return 9.8 * q[1] + q[0] ** 2
+
+
+@pytest.fixture(scope='module')
+def g():
+    return GenericSys(N, chain, potential, si=1, k=3)
+
+
+def points(dim, n=6):
+    # states on both sides of the guard, away from it
+    rng = np.random.RandomState(0)
+    X = rng.randn(n, 2 * dim)
+    X[:, 1] = np.sign(X[:, 1]) * (np.abs(X[:, 1]) + 0.1)
+    X[::2, 1] *= -1
+    return X, rng.randn(n, dim)
+
+
+def test_dim2_matches_flatfloor():
+    s = FlatFloor2D(k=3)
+    g = GenericSys(2, lambda q: np.eye(2), lambda q: -9.8 * q[1], si=1, k=3)
+    for (x, u) in zip(*points(2)):
+        for name in ('f', 'dfdx', 'dfdu', 'delf'):
+            assert np.allclose(getattr(g, name)(0.1, x, u),
+                               getattr(s, name)(0.1, x, u),
+                               rtol=1e-12, atol=1e-12), name
+
+
+def test_coupled_inverse_is_numeric(g):
+    # the coupled block of Mq is not inverted symbolically
+    assert all(str(el.func).startswith('numinv') for el in g.Mqi.flat)
+
+
+def test_plus_field_solves_mass_matrix(g):
+    M = lambda q: np.array(chain(q, np.cos), dtype=float)
+    h = 1e-6
+    for (x, u) in zip(*points(N)):
+        if x[1] < 0:
+            continue
+        (q, v) = (x[:N], x[N:])
+        dM = np.empty((N, N, N))
+        for k in range(N):
+            e = h * np.eye(N)[k]
+            dM[:, :, k] = (M(q + e) - M(q - e)) / (2 * h)
+        dV = np.array([2 * q[0], 9.8, 0.0])
+        rhs = -np.einsum('i,ijk,k', v, dM, v) \
+            + np.einsum('i,ikj,k', v, dM, v) / 2 + dV + u
+        f = g.f(0.0, x, u)
+        assert np.allclose(f[:N], v)
+        assert np.allclose(M(q).dot(f[N:]), rhs, rtol=1e-7, atol=1e-7)
+
+
+def test_jacobians_match_differences(g):
+    h = 1e-6
+    for (x, u) in zip(*points(N)):
+        dfdx = g.dfdx(0.0, x, u)
+        dfdu = g.dfdu(0.0, x, u)
+        for k in range(2 * N):
+            e = h * np.eye(2 * N)[k]
+            fd = (g.f(0.0, x + e, u) - g.f(0.0, x - e, u)) / (2 * h)
+            assert np.allclose(dfdx[:, k], fd, rtol=1e-5, atol=1e-5)
+        for k in range(N):
+            e = h * np.eye(N)[k]
+            fd = (g.f(0.0, x, u + e) - g.f(0.0, x, u - e)) / (2 * h)
+            assert np.allclose(dfdu[:, k], fd, rtol=1e-5, atol=1e-5)
+
+
+def test_batch_matches_pointwise(g):
+    X, U = points(N)
+    T = np.zeros(len(X))
+    for name in ('f', 'dfdx', 'dfdu', 'delf'):
+        got = getattr(g, name + '_batch')(T, X, U)
+        want = np.array([getattr(g, name)(0.0, x, u) for (x, u) in zip(X, U)])
+        assert np.allclose(got, want, rtol=1e-12, atol=1e-12), name
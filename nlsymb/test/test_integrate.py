@@ -0,0 +1,38 @@
+import numpy as np
+
+from nlsymb import sysIntegrate, IntegrationStats
+
+# a point moving at unit speed towards a guard at x = xg; crossing it
+# flips the velocity, the jump term records that
+flip = np.array([[0.0, 0.0], [0.0, -2.0]])
+
+
+def integrate(xg, tf, **kwargs):
+    func = lambda t, x: np.array([x[1], 0.0])
+    phi = lambda x: xg - x[0]
+    return sysIntegrate(func, np.array([0.0, 1.0]), phi=phi, tlims=(0, tf),
+                        delfunc=lambda t, x: flip, **kwargs)
+
+
+def test_crossing_inside_is_restarted():
+    stats = IntegrationStats()
+    (t, x, jumps) = integrate(0.5, 1.0, stats=stats)
+    assert len(jumps) == 1
+    assert abs(jumps[0][0] - 0.5) < 1e-6
+    assert stats.crossings == 1 and stats.restarts >= 1
+    assert t[-1] <= 1.0 + 1e-2
+
+
+def test_exact_ends_at_tf():
+    (t, x, jumps) = integrate(0.5, 1.0, exact=True)
+    assert t[-1] == 1.0
+    assert np.allclose(x[-1], [1.0, 1.0], atol=1e-6)
+    assert len(jumps) == 1
+
+
+def test_exact_leaves_crossing_past_tf():
+    # the guard is reached within the last step, but after tf
+    (t, x, jumps) = integrate(1.002, 1.0, exact=True)
+    assert t[-1] == 1.0 and all(tt <= 1.0 for tt in t)
+    assert jumps == []
+    assert np.allclose(x[-1], [1.0, 1.0], atol=1e-6)
@@ -0,0 +1,119 @@
+import numpy as np
+
+from nlsymb.lqr import LQ, DLQ, GradDirection
+
+# a time varying linear system (a damped oscillator with a varying
+# stiffness, driven through both states) and a tracking cost, on which
+# the solvers are compared with the staged vode Riccati solve
+tlims = (0.0, 1.5)
+times = np.linspace(0.0, 1.5, 31)
+
+
+def A(t):
+    return np.array([[0.0, 1.0], [-2.0 - np.sin(3 * t), -0.3]])
+
+
+def B(t):
+    return np.array([[0.1, 0.0], [0.0, 1.0 + 0.5 * t]])
+
+
+def problem():
+    return dict(q=lambda t: np.array([np.cos(2 * t), 0.5 * t]),
+                r=lambda t: np.array([0.2, -np.sin(t)]),
+                qf=np.array([0.3, -0.2]),
+                Q=lambda t: np.diag([2.0, 1.0]),
+                R=lambda t: np.diag([1.0, 0.5]),
+                Pb=np.diag([1.0, 0.5]))
+
+
+def solved(cls, **kwargs):
+    kw = problem()
+    kw.update(kwargs)
+    lq = cls(tlims, A, B, **kw)
+    lq.solve()
+    return lq
+
+
+def close(f, g, tol):
+    # f(t) and g(t) agree to tol relative to the size of g over times
+    F = np.array([f(t) for t in times])
+    G = np.array([g(t) for t in times])
+    return np.abs(F - G).max() <= tol * max(np.abs(G).max(), 1.0)
+
+
+def test_dlq_matches_riccati():
+    ref = solved(LQ, fused=False)
+    dlq = solved(DLQ, dt=1e-3)
+    for name in ('P', 'K', 'b', 'C'):
+        assert close(getattr(dlq, name), getattr(ref, name), 5e-3), name
+
+
+def test_dlq_converges_with_the_grid():
+    ref = solved(LQ, fused=False)
+    err = []
+    for dt in (1e-2, 1e-3):
+        dlq = solved(DLQ, dt=dt)
+        err.append(max(np.abs(dlq.K(t) - ref.K(t)).max() for t in times))
+    assert err[1] < err[0] / 5
+
+
+def test_dlq_tgrid():
+    grid = np.concatenate((np.linspace(0, 0.5, 501),
+                           np.linspace(0.5, 1.5, 501)[1:]))
+    dlq = solved(DLQ, tgrid=grid)
+    assert np.array_equal(dlq.t, grid)
+    assert dlq.Ks.shape == (len(grid), 2, 2)
+    assert close(dlq.K, solved(LQ, fused=False).K, 1e-2)
+
+
+def test_fused_matches_staged():
+    ref = solved(LQ, fused=False)
+    lq = solved(LQ)
+    for name in ('P', 'K', 'b', 'C'):
+        assert close(getattr(lq, name), getattr(ref, name), 5e-4), name
+
+
+def test_fused_single_pass():
+    # one vode run on one grid for every output
+    lq = solved(LQ)
+    t = lq._Ptj._t
+    for tj in (lq._Kt, lq._bt, lq._Ct):
+        assert tj._t == t
+
+
+def direction(**kwargs):
+    kw = problem()
+    kw.update(dx0=np.array([0.4, -0.1]), **kwargs)
+    d = GradDirection(tlims, A, B, **kw)
+    d.solve()
+    return d.direction
+
+
+def test_exact_direction_matches_vode():
+    ref = direction()
+    tj = direction(exact=True)
+    assert close(tj.x, ref.x, 1e-3)
+    assert close(tj.u, ref.u, 1e-3)
+    assert tj._t[0] == tlims[0] and tj._t[-1] == tlims[1]
+
+
+def test_exact_direction_on_dlq_grid():
+    ref = direction()
+    tj = direction(exact=True, discrete=True, dt=1e-3)
+    assert len(tj._t) == 1501
+    assert close(tj.x, ref.x, 5e-3)
+    assert close(tj.u, ref.u, 5e-3)
+
+
+def test_dlq_constant_weights():
+    # constant Q and R arrays, as CDRE accepts for R
+    ref = solved(DLQ, dt=1e-2)
+    dlq = solved(DLQ, dt=1e-2, Q=np.diag([2.0, 1.0]), R=np.diag([1.0, 0.5]))
+    for name in ('Ps', 'Ks', 'bs', 'Cs'):
+        assert np.allclose(getattr(dlq, name), getattr(ref, name),
+                           rtol=1e-12, atol=1e-12), name
+    lq = solved(LQ, fused=False, R=np.diag([1.0, 0.5]))
+    assert close(solved(DLQ, dt=1e-3, R=np.diag([1.0, 0.5])).K, lq.K, 5e-3)
+    # GradDirection(discrete=True) takes what the continuous path takes
+    tj = direction(discrete=True, R=np.diag([1.0, 0.5]))
+    assert close(tj.x, direction(R=np.diag([1.0, 0.5])).x, 2e-2)
@@ -0,0 +1,88 @@
+import numpy as np
+import pytest
+
+from nlsymb import Trajectory, profiling
+from nlsymb.optim import TrajectoryOptimizer
+from nlsymb.sys import FlatFloor2D
+
+tlims = (0.0, 1.0)
+R = lambda t: np.diag([10.0, 10.0])
+Q = lambda t: np.diag([10.0, 10.0, 1.0, 1.0])
+PT = np.diag([10.0, 10.0, 1.0, 1.0])
+
+
+def problem():
+    ref = Trajectory('x', 'u')
+    for t in np.linspace(0.0, 1.0, 21):
+        ref.addpoint(t, x=np.array([t, 1.0 - 1.5 * t, 1.0, -1.5]),
+                     u=np.array([0.0, 9.8]))
+    ref.interpolate()
+    ref.tlims = tlims
+    itj = Trajectory('x', 'u')
+    for t in tlims:
+        itj.addpoint(t, x=ref.x(t), u=np.zeros(2))
+    itj.interpolate()
+    return ref, itj
+
+
+@pytest.fixture(scope='module')
+def runs():
+    s = FlatFloor2D(k=3)
+    out = {}
+    for keep in (None, 1):
+        ref, itj = problem()
+        opt = TrajectoryOptimizer(s, ref, R, Q, PT, maxiter=2, keep=keep,
+                                  memory=True, verbose=False)
+        opt.run(itj)
+        out[keep] = opt
+    return out
+
+
+def test_keep_bounds_the_history(runs):
+    full, last = runs[None], runs[1]
+    assert len(full.trajectories) == 3 and len(full.costs) == 3
+    assert last.trajectories == [last.tj] and len(last.costs) == 3
+    assert np.allclose(last.costs, full.costs)
+
+    history = lambda opt: [held['history']['trajectories']
+                           for (_, stage, held) in opt.memory
+                           if stage == 'project']
+    grows, bounded = history(full), history(last)
+    assert grows[0] == bounded[0]
+    assert grows[2] > grows[1] > grows[0]
+    # only the current iterate is held
+    assert bounded[2] < grows[2] / 2
+
+
+def test_memory_per_stage(runs):
+    opt = runs[1]
+    assert [(i, stage) for (i, stage, _) in opt.memory] == \
+        [(0, 'project'), (0, 'direction'), (1, 'project'),
+         (1, 'direction'), (2, 'project'), (2, 'direction')]
+    (_, _, held) = opt.memory[0]
+    assert sorted(held) == ['history', 'regulator', 'tj']
+    assert set(['x', 'u', 'x.interp', 'u.interp']) <= set(held['tj'])
+    assert all(v > 0 for v in held['tj'].values())
+    assert all(v > 0 for v in held['regulator'].values())
+    (_, _, held) = opt.memory[1]
+    assert sorted(held) == ['direction', 'history']
+    assert any(k.startswith('lq.') for k in held['direction'])
+
+
+def test_memory_report(runs):
+    opt = runs[1]
+    lines = opt.memory_report().splitlines()
+    assert lines[0].split() == ['iter', 'stage', 'object', 'bytes']
+    rows = sum(len(v) for (_, _, held) in opt.memory
+               for v in held.values())
+    assert len(lines) == rows + 1
+    assert lines[1].split()[:3] == ['0', 'project', 'history.trajectories']
+    # nothing is recorded unless asked for
+    assert TrajectoryOptimizer(None, problem()[0], R, Q, PT).memory == []
+
+
+def test_nbytes_counts_shared_buffers_once():
+    a = np.zeros(1000)
+    assert profiling.nbytes([a, a[10:], a.reshape(10, 100)]) < \
+        a.nbytes + 1000
+    assert profiling.nbytes([a, a.copy()]) >= 2 * a.nbytes
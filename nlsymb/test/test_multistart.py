@@ -0,0 +1,52 @@
+import numpy as np
+
+from nlsymb import Trajectory
+from nlsymb.multistart import MultiStart
+from nlsymb.sys import FlatFloor2D
+
+tlims = (0.0, 1.0)
+R = lambda t: np.diag([10.0, 10.0])
+Q = lambda t: np.diag([10.0, 10.0, 1.0, 1.0])
+PT = np.diag([10.0, 10.0, 1.0, 1.0])
+
+
+def reference():
+    ref = Trajectory('x', 'u')
+    for t in np.linspace(0.0, 1.0, 21):
+        ref.addpoint(t, x=np.array([t, 1.0 - 1.5 * t, 1.0, -1.5]),
+                     u=np.array([0.0, 9.8]))
+    ref.interpolate()
+    ref.tlims = tlims
+    return ref
+
+
+def start(ref, u):
+    # the reference path under a constant control
+    itj = Trajectory('x', 'u')
+    for t in tlims:
+        itj.addpoint(t, x=ref.x(t), u=np.array(u, dtype=float))
+    itj.interpolate()
+    return itj
+
+
+def test_best_first_and_far_start_pruned():
+    ref = reference()
+    ms = MultiStart(FlatFloor2D(k=3), ref, R, Q, PT, processes=2,
+                    maxiter=3)
+    # the two workers take the good starts first, so the far one only
+    # runs once the best cost is known
+    results = ms.run([start(ref, [0.0, 0.0]), start(ref, [0.0, 0.0]),
+                      start(ref, [20.0, -20.0])])
+
+    assert [res['index'] for res in results[2:]] == [2]
+    far = results[2]
+    assert far['reason'] == 'pruned' and far['iterations'] == 2
+    assert far['cost'] > 2.0 * ms.best
+
+    for res in results[:2]:
+        assert res['reason'] == 'maxiter' and res['iterations'] == 3
+        assert res['cost'] == ms.best == min(res['costs'])
+        # the optimized trajectory comes back from the worker
+        assert np.allclose(res['tj'].x(0.0), ref.x(0.0))
+        assert res['tj'].tlims == tlims
+    assert results[0]['costs'] == results[1]['costs']
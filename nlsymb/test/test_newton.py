@@ -0,0 +1,99 @@
+import numpy as np
+import pytest
+
+from nlsymb import Trajectory
+from nlsymb.lqr import NewtonDirection
+from nlsymb.optim import TrajectoryOptimizer
+from nlsymb.sys import FlatFloor2D, SinFloor2D
+
+tlims = (0.0, 1.0)
+R = lambda t: np.diag([10.0, 10.0])
+Q = lambda t: np.diag([10.0, 10.0, 1.0, 1.0])
+PT = np.diag([10.0, 10.0, 1.0, 1.0])
+
+
+def A(t):
+    return np.array([[0.0, 1.0], [-2.0 - np.sin(3 * t), -0.3]])
+
+
+def B(t):
+    return np.array([[0.1, 0.0], [0.0, 1.0 + 0.5 * t]])
+
+
+def fxx(t):
+    # curvature that, weighted by the costate, makes Q indefinite
+    out = np.zeros((2, 2, 2))
+    out[0] = [[-40.0, 5.0], [5.0, 0.0]]
+    out[1] = [[0.0, 0.0], [0.0, -40.0]]
+    return out
+
+
+def test_newton_q_is_clipped_to_psd():
+    Qlq = lambda t: np.diag([2.0, 1.0])
+    d = NewtonDirection(tlims, A, B, Q=Qlq, R=lambda t: np.eye(2),
+                        PT=np.eye(2), fxx=fxx, psd=1e-6,
+                        q=lambda t: np.array([np.cos(2 * t), 0.5 * t]),
+                        r=lambda t: np.zeros(2), qf=np.array([1.0, -1.0]))
+    t = np.linspace(0.0, 1.0, 21)
+    # the model before clipping, from the costate
+    H = np.einsum('ki,kijl->kjl', np.array(map(d.costate, t)),
+                  np.array(map(fxx, t)))
+    raw = np.array(map(Qlq, t)) + (H + H.transpose(0, 2, 1)) / 2
+    assert np.linalg.eigvalsh(raw).min() < -1.0
+
+    Qn = np.array(map(d.lq.Q, t))
+    assert np.allclose(Qn, Qn.transpose(0, 2, 1))
+    assert np.linalg.eigvalsh(Qn).min() >= 1e-6 * (1 - 1e-6)
+    # the directions that were positive are kept, up to the
+    # interpolation of Q between the costate times
+    w, V = np.linalg.eigh(raw)
+    for k in range(len(t)):
+        for j in np.flatnonzero(w[k] > 1e-3):
+            assert np.allclose(Qn[k].dot(V[k, :, j]), w[k, j] * V[k, :, j],
+                               rtol=5e-2, atol=5e-2)
+
+
+def test_dfdxx_matches_differences():
+    s = SinFloor2D(k=3)
+    h = 1e-6
+    rng = np.random.RandomState(0)
+    for x in rng.randn(4, 4):
+        u = rng.randn(2)
+        fxx = s.dfdxx(0.0, x, u)
+        for k in range(4):
+            e = h * np.eye(4)[k]
+            fd = (s.dfdx(0.0, x + e, u) - s.dfdx(0.0, x - e, u)) / (2 * h)
+            assert np.allclose(fxx[:, :, k], fd, rtol=1e-5, atol=1e-5)
+        fxu = s.dfdxu(0.0, x, u)
+        for k in range(2):
+            e = h * np.eye(2)[k]
+            fd = (s.dfdx(0.0, x, u + e) - s.dfdx(0.0, x, u - e)) / (2 * h)
+            assert np.allclose(fxu[:, :, k], fd, rtol=1e-5, atol=1e-5)
+
+
+def problem():
+    ref = Trajectory('x', 'u')
+    for t in np.linspace(0.0, 1.0, 21):
+        ref.addpoint(t, x=np.array([t, 1.0 - 1.5 * t, 1.0, -1.5]),
+                     u=np.array([0.0, 9.8]))
+    ref.interpolate()
+    ref.tlims = tlims
+    itj = Trajectory('x', 'u')
+    for t in tlims:
+        itj.addpoint(t, x=ref.x(t), u=np.zeros(2))
+    itj.interpolate()
+    return ref, itj
+
+
+@pytest.mark.parametrize('method', ['gauss-newton', 'newton'])
+def test_unit_step_reduces_cost(method):
+    ref, itj = problem()
+    opt = TrajectoryOptimizer(FlatFloor2D(k=3), ref, R, Q, PT, maxiter=1,
+                              method=method, verbose=False)
+    opt.run(itj)
+    assert isinstance(opt.descdir, NewtonDirection)
+    # the unit step is taken, and lands near the minimum of the model
+    assert opt.ls.gamma == 1.0
+    assert opt.costs[1] < 1e-3 * opt.costs[0]
+    # and the next direction is much shorter
+    assert opt.gradcosts[1] < 1e-3 * opt.gradcosts[0]
@@ -0,0 +1,99 @@
+import numpy as np
+import sympy as sym
+
+from nlsymb import tensor as tn
+
+
+def symbols(name, shape, zeros=0.0, seed=0):
+    # an object tensor of distinct symbols, with a fraction of its
+    # entries structurally zero
+    rng = np.random.RandomState(seed)
+    out = np.empty(shape, dtype=object)
+    for (i, idx) in enumerate(np.ndindex(*shape)):
+        out[idx] = 0 if rng.rand() < zeros else \
+            sym.Symbol('%s%d' % (name, i))
+    return out
+
+
+def numeric(arrays, seed=1):
+    # the tensors with every symbol replaced by a random value
+    rng = np.random.RandomState(seed)
+    rule = {}
+    for arr in arrays:
+        for el in arr.flat:
+            for s in sym.sympify(el).free_symbols:
+                rule.setdefault(s, rng.randn())
+    vals = [np.array([float(sym.sympify(el).xreplace(rule))
+                      for el in arr.flat]).reshape(arr.shape)
+            for arr in arrays]
+    return rule, vals
+
+
+def check(string, *shapes, **kwargs):
+    zeros = kwargs['zeros'] if 'zeros' in kwargs else 0.0
+    arrays = [symbols('abcd'[k], shape, zeros, seed=k)
+              for (k, shape) in enumerate(shapes)]
+    rule, vals = numeric(arrays)
+
+    out = np.array(tn.einsum(string, *arrays), dtype=object)
+    got = np.array([float(sym.sympify(el).xreplace(rule))
+                    for el in out.flat]).reshape(out.shape)
+    want = np.einsum(string, *vals)
+    assert got.shape == np.shape(want)
+    assert np.allclose(got, want, rtol=1e-12, atol=1e-12)
+
+
+def test_matrix_vector():
+    check('ij,j', (3, 4), (4,))
+    check('ij,j->i', (3, 4), (4,))
+
+
+def test_matrix_matrix():
+    check('ij,jk->ik', (3, 4), (4, 2))
+    check('ij,jk->ki', (3, 4), (4, 2))
+
+
+def test_three_operands():
+    # the quadratic form of the hessian terms in sys.py
+    check('i,ijk,k', (4,), (4, 4, 4), (4,))
+    check('i,ijk,k->j', (4,), (4, 4, 4), (4,), zeros=0.5)
+
+
+def test_sparse_operands():
+    check('ij,jk,kl->il', (4, 5), (5, 3), (3, 4), zeros=0.6)
+
+
+def test_axes_summed_out_alone():
+    check('ijk,k->i', (2, 3, 4), (4,))
+    check('ij,k->i', (3, 2), (4,))
+
+
+def test_diagonal():
+    check('ii->i', (4, 4))
+    check('ii', (4, 4))
+
+
+def test_implicit_output_is_alphabetical():
+    check('ji,j', (3, 4), (3,))
+    check('kj,ji', (2, 3), (3, 4))
+
+
+def test_all_zero():
+    arrays = [np.zeros((3, 3), dtype=object), symbols('a', (3,))]
+    out = tn.einsum('ij,j', *arrays)
+    assert all(sym.sympify(el) == 0 for el in np.array(out).flat)
+
+
+def test_numeric_passes_through():
+    A, x = np.arange(12.0).reshape(3, 4), np.arange(4.0)
+    assert np.array_equal(tn.einsum('ij,j', A, x), np.einsum('ij,j', A, x))
+
+
+def test_canon():
+    x, y = sym.symbols('x y')
+    A = np.array([[2 * x * y, 2 * x]], dtype=object)
+    v = np.array([1, y], dtype=object)
+    out = tn.einsum('ij,j', A, v, canon=True)
+    assert out[0] == sym.factor_terms(4 * x * y)
+    out = tn.einsum('ij,j', A, v, canon=sym.expand)
+    assert sym.expand(out[0] - 4 * x * y) == 0
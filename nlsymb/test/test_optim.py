@@ -0,0 +1,111 @@
+import numpy as np
+import pytest
+
+from nlsymb import Trajectory, export
+from nlsymb.optim import TrajectoryOptimizer, load_system
+from nlsymb.sys import FlatFloor2D
+
+# the flat_optim.py problem: track a fall through the floor from a
+# trajectory with no control at all
+tlims = (0.0, 1.0)
+R = lambda t: np.diag([10.0, 10.0])
+Q = lambda t: np.diag([10.0, 10.0, 1.0, 1.0])
+PT = np.diag([10.0, 10.0, 1.0, 1.0])
+
+
+@pytest.fixture(scope='module')
+def s():
+    return FlatFloor2D(k=3)
+
+
+def reference():
+    ref = Trajectory('x', 'u')
+    for t in np.linspace(0.0, 1.0, 21):
+        ref.addpoint(t, x=np.array([t, 1.0 - 1.5 * t, 1.0, -1.5]),
+                     u=np.array([0.0, 9.8]))
+    ref.interpolate()
+    ref.tlims = tlims
+    return ref
+
+
+def initial(ref):
+    itj = Trajectory('x', 'u')
+    for t in tlims:
+        itj.addpoint(t, x=ref.x(t), u=np.zeros(2))
+    itj.interpolate()
+    return itj
+
+
+def optimizer(s, **kwargs):
+    ref = reference()
+    kwargs.setdefault('verbose', False)
+    return TrajectoryOptimizer(s, ref, R, Q, PT, **kwargs), initial(ref)
+
+
+@pytest.fixture(scope='module')
+def run(s):
+    opt, itj = optimizer(s, maxiter=2)
+    opt.run(itj)
+    return opt
+
+
+def test_loop_descends(run):
+    assert run.reason == 'maxiter' and run.index == 2
+    assert len(run.costs) == len(run.gradcosts) == 3
+    assert len(run.trajectories) == 3 and run.tj is run.trajectories[-1]
+    assert all(b < a for (a, b) in zip(run.costs, run.costs[1:]))
+    # the projected iterates start where the system does
+    assert np.allclose(run.tj.x(0.0), run.nlsys.xinit)
+
+
+def test_stages_are_timed(run):
+    calls = dict((k, v[0]) for (k, v) in run.timings.items())
+    assert calls == {'project': 3, 'direction': 3, 'linesearch': 2,
+                     'cost': 6}
+    assert run.report().splitlines()[0].split() == \
+        ['stage', 'calls', 'seconds']
+
+
+def test_callback_stops(s):
+    seen = []
+
+    def cb(opt):
+        seen.append(opt.index)
+        return opt.index == 1
+
+    opt, itj = optimizer(s, callbacks=[cb])
+    opt.run(itj)
+    assert seen == [0, 1]
+    assert opt.reason == 'callback' and len(opt.costs) == 2
+
+
+def test_resume_matches_straight_run(s, run, tmpdir):
+    ckpt = str(tmpdir.join('ckpt.p'))
+    first, itj = optimizer(s, maxiter=1, checkpoint=ckpt)
+    first.run(itj)
+    assert first.reason == 'maxiter' and len(first.costs) == 2
+
+    opt, _ = optimizer(s, maxiter=2)
+    opt.resume(ckpt)
+    assert opt.index == 1 and opt.costs == first.costs
+    opt.run()
+    assert opt.reason == 'maxiter' and opt.index == 2
+    assert np.allclose(opt.costs, run.costs, rtol=1e-6)
+    assert np.allclose(opt.gradcosts, run.gradcosts, rtol=1e-6)
+
+
+def test_load_system_needs_compiled_sys(s, tmpdir):
+    # a SymSys is not in the checkpoint, it has to be built again
+    ckpt = str(tmpdir.join('sym.p'))
+    opt, itj = optimizer(s, maxiter=0, checkpoint=ckpt)
+    opt.run(itj)
+    assert load_system(ckpt) is None
+
+    c = export.load(export.export(s, str(tmpdir.join('flat.py'))))
+    ckpt = str(tmpdir.join('compiled.p'))
+    opt, itj = optimizer(c, maxiter=0, checkpoint=ckpt)
+    opt.run(itj)
+    loaded = load_system(ckpt)
+    assert loaded.path == c.path
+    x, u = np.array([0.1, 0.5, 1.0, -1.0]), np.array([0.0, 9.8])
+    assert np.allclose(loaded.f(0.0, x, u), s.f(0.0, x, u))
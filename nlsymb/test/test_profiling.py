@@ -0,0 +1,88 @@
+import csv
+import json
+
+import numpy as np
+import pytest
+
+from nlsymb import profiling
+from nlsymb.lqr import LQR
+
+
+@pytest.fixture(autouse=True)
+def registry():
+    profiling.reset()
+    profiling.enable()
+    yield
+    profiling.disable()
+    profiling.reset()
+
+
+@profiling.profiled('outer')
+def outer():
+    with profiling.section('inner'):
+        pass
+
+
+def iterate():
+    # two iterations of nested sections, marked as the optimizer does
+    for it in range(2):
+        for k in range(it + 1):
+            outer()
+        with profiling.section('cost'):
+            pass
+        profiling.mark(it)
+
+
+def test_nested_counts():
+    iterate()
+    stats = profiling.totals()
+    assert sorted(stats) == ['cost', 'outer', 'outer/inner']
+    assert stats['outer'][0] == stats['outer/inner'][0] == 3
+    assert stats['cost'][0] == 2
+    # times are inclusive
+    assert stats['outer'][1] >= stats['outer/inner'][1]
+    # per iteration, only what happened since the last mark
+    its = profiling.iterations()
+    assert [label for (label, _) in its] == [0, 1]
+    assert its[0][1]['outer'][0] == 1 and its[1][1]['outer'][0] == 2
+
+
+def test_disabled_records_nothing():
+    profiling.disable()
+    iterate()
+    assert profiling.totals() == {} and profiling.iterations() == []
+
+
+def test_dump_csv(tmpdir):
+    iterate()
+    path = str(tmpdir.join('prof.csv'))
+    profiling.dump(path)
+    rows = list(csv.reader(open(path)))
+    assert rows[0] == ['iteration', 'section', 'calls', 'seconds']
+    body = [(r[0], r[1], int(r[2])) for r in rows[1:]]
+    assert body == [('0', 'cost', 1), ('0', 'outer', 1),
+                    ('0', 'outer/inner', 1), ('1', 'cost', 1),
+                    ('1', 'outer', 2), ('1', 'outer/inner', 2),
+                    ('total', 'cost', 2), ('total', 'outer', 3),
+                    ('total', 'outer/inner', 3)]
+    assert all(float(r[3]) >= 0 for r in rows[1:])
+
+
+def test_dump_json(tmpdir):
+    iterate()
+    path = str(tmpdir.join('prof.json'))
+    profiling.dump(path)
+    out = json.load(open(path))
+    assert sorted(out) == ['iterations', 'totals']
+    assert out['totals']['outer'][0] == 3
+    assert [it['iteration'] for it in out['iterations']] == [0, 1]
+    assert out['iterations'][1]['sections']['outer'][0] == 2
+
+
+def test_solvers_are_profiled():
+    A = lambda t: np.array([[0.0, 1.0], [-2.0, -0.3]])
+    B = lambda t: np.array([[0.0], [1.0]])
+    LQR((0.0, 1.0), A, B).solve()
+    calls, secs = profiling.totals()['riccati']
+    assert calls == 1 and secs > 0
+    assert profiling.report().splitlines()[1].split()[:2] == ['riccati', '1']
@@ -0,0 +1,122 @@
+import os
+import pickle
+import multiprocessing
+
+import numpy as np
+import pytest
+
+from nlsymb import Trajectory
+from nlsymb import shared
+from nlsymb.shared import share, SharedTrajectory
+
+
+@pytest.fixture(autouse=True)
+def shmdir(tmpdir, monkeypatch):
+    monkeypatch.setattr(shared, 'SHMDIR', str(tmpdir))
+    return tmpdir
+
+
+def trajectory(n=40):
+    # points added out of order, as the projections and jumps do
+    rng = np.random.RandomState(0)
+    tj = Trajectory('x', 'u', 'K')
+    for t in rng.permutation(np.linspace(0.0, 1.0, n)):
+        tj.addpoint(t, x=np.array([t, t ** 2, -t, 1.0]),
+                    u=np.array([np.sin(t), 2 * t]),
+                    K=np.outer([1.0, t], [t, 0.0, 1.0, -t]))
+    tj.tlims = (0.0, 1.0)
+    tj.jumps = [(0.5, np.eye(4))]
+    tj.feasible = True
+    tj.interpolate()
+    return tj
+
+
+def test_round_trip():
+    tj = trajectory()
+    with share(tj) as h:
+        out = h.attach()
+        order = np.argsort(tj._t)
+        assert np.array_equal(out._t, np.array(tj._t)[order])
+        for name in ('x', 'u', 'K'):
+            want = np.array(getattr(tj, '_' + name))[order]
+            assert np.array_equal(getattr(out, '_' + name), want)
+            for t in (0.0, 0.123, 0.5, 1.0):
+                assert np.allclose(getattr(out, name)(t),
+                                   getattr(tj, name)(t), atol=1e-14)
+        assert out.tlims == tj.tlims
+        assert out.feasible is True
+        assert np.array_equal(out.jumps[0][1], tj.jumps[0][1])
+
+
+def test_handle_pickles_small():
+    tj = trajectory(400)
+    with share(tj) as h:
+        data = pickle.dumps(h, pickle.HIGHEST_PROTOCOL)
+        assert len(data) < len(pickle.dumps(tj, pickle.HIGHEST_PROTOCOL)) / 10
+        out = pickle.loads(data).attach()
+        assert np.allclose(out.x(0.3), tj.x(0.3))
+
+
+def test_attach_is_read_only_unless_writable():
+    with share(trajectory()) as h:
+        ro = h.attach()
+        with pytest.raises(ValueError):
+            ro._x[0][0] = 5.0
+        rw = h.attach(writable=True)
+        rw._x[0][0] = 5.0
+        assert h.attach()._x[0][0] == 5.0
+
+
+def _read(h):
+    return h.attach().x(0.25)
+
+
+def test_attach_in_another_process():
+    tj = trajectory()
+    with share(tj) as h:
+        pool = multiprocessing.Pool(1)
+        try:
+            got = pool.apply(_read, (h,))
+        finally:
+            pool.close()
+            pool.join()
+    assert np.allclose(got, tj.x(0.25))
+
+
+def test_ragged_field_raises(shmdir):
+    tj = Trajectory('x', 'u')
+    tj.addpoint(0.0, x=np.zeros(4), u=np.zeros(2))
+    tj.addpoint(1.0, x=np.zeros(3), u=np.zeros(2))
+    with pytest.raises(Exception) as e:
+        share(tj)
+    assert 'x' in str(e.value)
+    # nothing is left behind
+    assert shmdir.listdir() == []
+
+
+def test_object_field_raises(shmdir):
+    tj = Trajectory('x', 'u')
+    tj.addpoint(0.0, x=np.zeros(4), u=[np.zeros(2), None])
+    tj.addpoint(1.0, x=np.zeros(4), u=[np.zeros(2), None])
+    with pytest.raises(Exception):
+        share(tj)
+    assert shmdir.listdir() == []
+
+
+def test_unlink(shmdir):
+    tj = trajectory()
+    h = share(tj)
+    assert os.path.exists(h.path) and h.nbytes() > 0
+    out = h.attach()
+    h.unlink()
+    assert not os.path.exists(h.path)
+    assert shmdir.listdir() == []
+    # attached trajectories keep their mapping, unlink is idempotent
+    assert np.allclose(out.x(0.7), tj.x(0.7))
+    h.unlink()
+
+
+def test_context_manager_unlinks(shmdir):
+    with share(trajectory()) as h:
+        assert isinstance(h, SharedTrajectory)
+    assert not os.path.exists(h.path)
@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+
+from nlsymb import Trajectory
+from nlsymb.lqr import Controller
+from nlsymb.sys import System, FlatFloor2D
+
+tlims = (0.0, 1.0)
+times = np.linspace(0.0, 1.0, 9)
+K = np.array([[10.0, 0.0, 5.0, 0.0], [0.0, 10.0, 0.0, 5.0]])
+
+
+@pytest.fixture(scope='module')
+def s():
+    return FlatFloor2D(k=3)
+
+
+def reference():
+    # falling through the floor at t = 2/3
+    ref = Trajectory('x', 'u')
+    for t in np.linspace(0.0, 1.0, 21):
+        ref.addpoint(t, x=np.array([t, 1.0 - 1.5 * t, 1.0, -1.5]),
+                     u=np.array([0.0, 9.8]))
+    ref.interpolate()
+    ref.tlims = tlims
+    return ref
+
+
+def controller():
+    # a gain schedule, so that the workers can rebuild the controller
+    sched = Trajectory('K')
+    for t in tlims:
+        sched.addpoint(t, K=K)
+    sched.interpolate()
+    return Controller(reference=reference(), K=sched.K, schedule=sched)
+
+
+def system(s, **kwargs):
+    out = System(s.f, tlims=tlims, xinit=np.array([0.0, 1.1, 1.0, -1.4]),
+                 dfdx=s.dfdx, dfdu=s.dfdu, **kwargs)
+    out.set_u(controller())
+    out.phi = s.phi
+    out.delf = s.delf
+    return out
+
+
+@pytest.fixture(scope='module')
+def plain(s):
+    return system(s).integrate(linearize=False)
+
+
+@pytest.mark.parametrize('processes', [1, 2])
+def test_matches_plain_integrate(s, plain, processes):
+    # a guess off the solution, as a line search iterate is
+    guess = lambda t: plain.x(t) + 1e-2 * np.array([1.0, -1.0, 0.5, 0.5])
+    sys = system(s, segments=6, processes=processes)
+    try:
+        tj = sys.integrate(linearize=False, guess=guess)
+    finally:
+        sys.close()
+    # within what locating the crossing by interpolation allows
+    for t in times:
+        assert np.allclose(tj.x(t), plain.x(t), rtol=1e-3, atol=1e-3), t
+    assert len(tj.jumps) == 1
+    assert abs(tj.jumps[0][0] - plain.jumps[0][0]) < 1e-5
+    # every start is updated in each pass, so the passes do not grow
+    # with the segments (one segment is fixed per pass otherwise)
+    assert tj.passes <= 3
+
+
+def test_solution_as_guess(s, plain):
+    sys = system(s, segments=4, processes=1)
+    tj = sys.integrate(linearize=False, guess=plain.x)
+    assert tj.passes <= 2
+    assert np.allclose(tj.x(1.0), plain.x(1.0), rtol=1e-3, atol=1e-3)
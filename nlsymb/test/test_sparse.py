@@ -0,0 +1,87 @@
+import numpy as np
+
+from nlsymb import sparse
+from nlsymb.lqr import LQR
+from nlsymb.sparse import Pattern
+from nlsymb.sys import FlatFloor2D
+
+# a mechanical system of n coordinates: A = [0 I; * *], B = [0; *], large
+# enough for the structured products
+n = 15
+
+
+def mechanical(rng):
+    A = np.zeros((2 * n, 2 * n))
+    A[:n, n:] = np.eye(n)
+    A[n:] = rng.randn(n, 2 * n)
+    B = np.zeros((2 * n, n))
+    B[n:] = rng.randn(n, n)
+    return A, B
+
+
+def patterns():
+    mask = np.zeros((2 * n, 2 * n), dtype=bool)
+    mask[:n, n:] = np.eye(n, dtype=bool)
+    mask[n:] = True
+    Bmask = np.zeros((2 * n, n), dtype=bool)
+    Bmask[n:] = True
+    return (Pattern(mask, unit=np.eye(2 * n, k=n, dtype=bool)),
+            Pattern(Bmask))
+
+
+def test_symsys_pattern_has_selector_rows():
+    s = FlatFloor2D(k=3)
+    p = s.dfdx_pattern
+    assert list(p.sel) == [0, 1] and list(p.csel) == [2, 3]
+    # 4x4 is below MINSIZE, np.dot is faster there
+    assert not p.structured
+
+
+def test_structured_products_match_dense():
+    rng = np.random.RandomState(0)
+    A, B = mechanical(rng)
+    Ap, Bp = patterns()
+    assert Ap.structured and Bp.structured
+    assert A.size >= sparse.MINSIZE
+
+    # entries outside the multiplied block, the selector rows included,
+    # are never read: NaN there would show in the result otherwise
+    An = A.copy()
+    An[:n] = np.nan
+    Bn = np.where(Bp.mask, B, np.nan)
+
+    X = rng.randn(2 * n, 2 * n)
+    assert np.allclose(Ap.dot(An, X), A.dot(X), rtol=1e-13, atol=1e-13)
+    assert np.allclose(Ap.tdot(An, X), A.T.dot(X), rtol=1e-13, atol=1e-13)
+    assert np.allclose(Bp.tdot(Bn, X), B.T.dot(X), rtol=1e-13, atol=1e-13)
+    # matrix-vector products stay dense
+    x = rng.randn(2 * n)
+    assert np.allclose(sparse.dot(Ap, A, x), A.dot(x))
+
+
+def test_repeated_selected_column():
+    mask = np.zeros((20, 20), dtype=bool)
+    mask[0, 5] = mask[1, 5] = True
+    mask[10:, :5] = True
+    p = Pattern(mask, unit=mask & (np.arange(20)[:, None] < 2))
+    M = np.where(mask, np.random.RandomState(1).randn(20, 20), 0.0)
+    M[0, 5] = M[1, 5] = 1.0
+    X = np.random.RandomState(2).randn(20, 20)
+    assert np.allclose(p.tdot(M, X), M.T.dot(X))
+    assert np.allclose(p.dot(M, X), M.dot(X))
+
+
+def test_riccati_with_patterns():
+    rng = np.random.RandomState(3)
+    A0, B0 = mechanical(rng)
+    A0[n:] *= 0.2
+    # the [0 I] rows stay as they are
+    A = lambda t: A0 + np.vstack((0 * A0[:n], 0.1 * np.sin(t) * A0[n:]))
+    B = lambda t: B0
+    Ap, Bp = patterns()
+    ref = LQR((0.0, 0.5), A, B)
+    ref.solve()
+    lq = LQR((0.0, 0.5), A, B, Apattern=Ap, Bpattern=Bp)
+    lq.solve()
+    for t in (0.0, 0.2, 0.5):
+        assert np.allclose(lq.K(t), ref.K(t), rtol=1e-5, atol=1e-6)
@@ -0,0 +1,72 @@
+import numpy as np
+
+from nlsymb import sysIntegrate, IntegrationStats
+from nlsymb.lqr import LQR, LQ
+
+flip = np.array([[0.0, 0.0], [0.0, -2.0]])
+
+
+def bounce(**kwargs):
+    # a point moving towards a guard at x = 0.5, which flips its velocity
+    func = lambda t, x: np.array([x[1], -x[0]])
+    return sysIntegrate(func, np.array([0.0, 1.0]), tlims=(0, 1.0),
+                        phi=lambda x: 0.5 - x[0],
+                        delfunc=lambda t, x: flip, **kwargs)
+
+
+def A(t):
+    return np.array([[0.0, 1.0], [-2.0 - np.sin(3 * t), -0.3]])
+
+
+def B(t):
+    return np.array([[0.1, 0.0], [0.0, 1.0 + 0.5 * t]])
+
+
+def test_sysintegrate_counts():
+    stats = IntegrationStats()
+    (t, x, jumps) = bounce(stats=stats)
+    assert len(jumps) == 1
+    assert stats.steps >= len(t) - 2 and stats.rhs >= stats.steps
+    assert stats.crossings == 1 and stats.restarts >= 1
+    assert stats.wall > 0
+    # without a jacobian there are no jacobian evaluations
+    assert stats.jac == 0
+
+    # a second integration adds to the same counters
+    steps = stats.steps
+    bounce(stats=stats)
+    assert stats.steps >= 2 * steps - 2 and stats.crossings == 2
+
+
+def test_jacobian_counts():
+    stats = IntegrationStats()
+    jac = lambda t, x: np.array([[0.0, 1.0], [-1.0, 0.0]])
+    bounce(stats=stats, jac=jac)
+    assert stats.jac > 0 and stats.lu > 0
+
+
+def test_stats_add_up():
+    a = IntegrationStats(steps=3, rhs=5, wall=0.5)
+    b = IntegrationStats(steps=1, crossings=2)
+    c = a + b
+    assert c.asdict() == dict(steps=4, rhs=5, jac=0, lu=0, rejected=0,
+                              restarts=0, crossings=2, wall=0.5)
+    a += b
+    assert a.asdict() == c.asdict()
+    assert a.steps == 4 and b.steps == 1
+
+
+def test_solvers_keep_stats():
+    reg = LQR((0.0, 1.0), A, B)
+    reg.solve()
+    assert reg.stats.steps > 0 and reg.stats.rhs > 0
+
+    kw = dict(q=lambda t: np.ones(2), r=lambda t: np.zeros(2),
+              qf=np.zeros(2))
+    staged = LQ((0.0, 1.0), A, B, fused=False, **kw)
+    staged.solve()
+    # the riccati pass and the b pass
+    assert staged.stats.steps > reg.stats.steps
+    fused = LQ((0.0, 1.0), A, B, **kw)
+    fused.solve()
+    assert fused.stats.steps > 0 and fused.stats.restarts == 0
@@ -0,0 +1,61 @@
+import numpy as np
+import sympy as sym
+
+from nlsymb import tensor as tn
+
+x1, x2, y = sym.symbols('x1 x2 y')
+X = np.array([x1, x2], dtype=object)
+F = np.array([x1 * sym.sin(x2), x2 ** 2 + y, 3 * x1 + x2, 2], dtype=object)
+
+
+def run():
+    dF = tn.diff(F, X)
+    sF = tn.subs(F, {x1: 2 * y, x2: x1})
+    eF = tn.eval(dF, np.array([x1, x2, y]), [0.5, -1.0, 2.0])
+    return dF, sF, eF
+
+
+def test_diff_matches_sympy():
+    tn.clear_cache()
+    dF = tn.diff(F, X)
+    for i in range(len(F)):
+        for j in range(len(X)):
+            assert sym.simplify(dF[i, j] - sym.sympify(F[i]).diff(X[j])) == 0
+
+
+def test_subs_is_simultaneous():
+    tn.clear_cache()
+    out = tn.subs([x1 + x2], {x1: x2, x2: x1})
+    assert out[0] == x1 + x2
+    out = tn.subs([x1 * x2 ** 2], {x1: x2, x2: x1})
+    assert out[0] == x2 * x1 ** 2
+
+
+def test_eval_matches_subs():
+    tn.clear_cache()
+    vals = {x1: 0.5, x2: -1.0, y: 2.0}
+    got = tn.eval(F, [x1, x2, y], [vals[x1], vals[x2], vals[y]])
+    want = [float(sym.sympify(f).subs(vals)) for f in F]
+    assert np.allclose(got, want, rtol=1e-14)
+
+
+def test_same_results_after_clear_cache():
+    tn.clear_cache()
+    first = run()
+    info = tn.cache_info()
+    assert info['diff'] > 0 and info['subs'] > 0 and info['eval'] > 0
+
+    # served from the caches
+    again = run()
+    assert tn.cache_info() == info
+
+    tn.clear_cache()
+    assert tn.cache_info() == {'diff': 0, 'subs': 0, 'eval': 0}
+    cleared = run()
+
+    for other in (again, cleared):
+        assert all(sym.sympify(a) == sym.sympify(b)
+                   for (a, b) in zip(first[0].flat, other[0].flat))
+        assert all(sym.sympify(a) == sym.sympify(b)
+                   for (a, b) in zip(first[1].flat, other[1].flat))
+        assert np.array_equal(first[2], other[2])
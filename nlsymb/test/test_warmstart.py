@@ -0,0 +1,81 @@
+import numpy as np
+
+from nlsymb.lqr import LQR, WarmStart
+
+
+# a time varying linear system; A and B depend on absolute time, so
+# windows that overlap share their linearization there
+def A(t):
+    return np.array([[0.0, 1.0], [-2.0 - np.sin(3 * t), -0.3]])
+
+
+def B(t):
+    return np.array([[0.1, 0.0], [0.0, 1.0 + 0.5 * t]])
+
+
+kw = dict(Q=lambda t: np.diag([2.0, 1.0]), R=np.diag([1.0, 0.5]))
+
+
+def fresh(tlims, A=A, B=B):
+    reg = LQR(tlims, A, B, **kw)
+    reg.solve()
+    return reg
+
+
+def gain_error(reg, ref, tlims, num=61):
+    # largest difference of the gains over tlims, relative to ref's
+    t = np.linspace(tlims[0], tlims[1], num)
+    err = max(np.abs(reg.K(tt) - ref.K(tt)).max() for tt in t)
+    return err / max(np.abs(ref.K(tt)).max() for tt in t)
+
+
+def test_shifted_matches_fresh_on_overlap():
+    ws = WarmStart(shift=True)
+    ws.riccati((0.0, 1.0), A, B, **kw)
+    for tlims in [(0.3, 1.3), (0.5, 1.5), (0.6, 1.6)]:
+        reg = ws.riccati(tlims, A, B, **kw)
+        assert gain_error(reg, fresh(tlims), tlims) < 1e-3
+        # right where the old window ended the gain must not jump
+        old_tb = tlims[1] - 0.3
+        assert np.allclose(reg.K(old_tb - 1e-3), reg.K(old_tb + 1e-3),
+                           atol=1e-2)
+    assert ws.stats['shifted'] == 3 and ws.stats['solved'] == 1
+
+
+def test_shift_needs_unchanged_overlap():
+    ws = WarmStart(shift=True)
+    ws.riccati((0.0, 1.0), A, B, **kw)
+    A2 = lambda t: A(t) + 0.1
+    reg = ws.riccati((0.3, 1.3), A2, B, **kw)
+    assert ws.stats['shifted'] == 0 and ws.stats['solved'] == 2
+    assert gain_error(reg, fresh((0.3, 1.3), A=A2), (0.3, 1.3)) < 1e-6
+
+
+def early(t):
+    # A changed only on [0, 0.4]
+    return A(t) + (0.2 * np.cos(t) if t < 0.4 else 0.0)
+
+
+def test_unchanged_is_reused():
+    ws = WarmStart()
+    reg = ws.riccati((0.0, 1.0), A, B, **kw)
+    assert ws.riccati((0.0, 1.0), A, B, **kw) is reg
+    assert ws.stats['reused'] == 1 and ws.stats['solved'] == 1
+
+
+def test_partial_matches_cold():
+    ws = WarmStart()
+    ws.riccati((0.0, 1.0), A, B, **kw)
+    reg = ws.riccati((0.0, 1.0), early, B, **kw)
+    assert ws.stats['partial'] == 1 and ws.stats['solved'] == 1
+    assert gain_error(reg, fresh((0.0, 1.0), A=early), (0.0, 1.0)) < 1e-3
+    # the spliced solution is what the next call compares against
+    assert ws.riccati((0.0, 1.0), early, B, **kw) is reg
+
+
+def test_partial_off_solves_cold():
+    ws = WarmStart(partial=False)
+    ws.riccati((0.0, 1.0), A, B, **kw)
+    reg = ws.riccati((0.0, 1.0), early, B, **kw)
+    assert ws.stats['partial'] == 0 and ws.stats['solved'] == 2
+    assert gain_error(reg, fresh((0.0, 1.0), A=early), (0.0, 1.0)) < 1e-6
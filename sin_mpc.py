@@ -0,0 +1,45 @@
+# receding horizon tracking of the sin_optim.py reference,
+# reports per tick latency to check for real-time feasibility
+
+import numpy as np
+
+from nlsymb import Timer
+from nlsymb.sys import SinFloor2D
+from nlsymb.mpc import RecedingHorizon
+
+
+if __name__ == "__main__":
+    import pickle
+
+    # the run, plus one horizon, has to fit in the reference
+    tlims = (0, 1.4)
+    horizon = 0.5
+    dt = 0.05
+
+    with Timer("creating symbolic system"):
+        s = SinFloor2D(k=3)
+
+    ref_file = open('pkl/sin_forced.p', 'rb')
+    ref = pickle.load(ref_file)
+    ref_file.close()
+    ref.interpolate()
+    ref.tlims = (0, 1.9)
+
+    Rcost = lambda t: np.diag([10, 10])
+    Qcost = lambda t: np.diag([10, 10, 1, 1])
+    PTcost = Qcost(tlims[1])
+
+    mpc = RecedingHorizon(s, ref, Rcost, Qcost, PTcost,
+                          horizon=horizon, dt=dt, maxiter=2)
+
+    with Timer("receding horizon run"):
+        tj = mpc.run(ref.x(tlims[0]), tlims)
+
+    lat = mpc.latency()
+    print("ticks: %d, dt = %.3fs" % (len(mpc.latencies), dt))
+    for k in ['p50', 'p90', 'p99', 'max']:
+        print("%-4s %8.3fs" % (k, lat[k]))
+    print("worst tick / dt: %.2f (%s)" %
+          (lat['realtime'], 'real-time' if lat['realtime'] <= 1
+           else 'not real-time'))
+    print("riccati: " + mpc.warmstart.report())